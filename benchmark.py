@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+"""Measure performance of schema inference, schemas merging and hiveql
+generation on synthetic data. Documents are generated from seeded
+random template, so runs with the same parameters are comparable.
+Results are saved as json and can be compared with baseline results."""
+
+import sys
+import os
+import json
+import time
+import random
+import datetime
+import argparse
+import resource
+import tempfile
+import shutil
+import subprocess
+import multiprocessing
+import bson
+
+import get_mongo_schema_as_json
+import get_hiveql_create_tables_by_schema
+
+def message(mes, cr='\n'):
+    sys.stderr.write( mes + cr)
+
+scalar_types = [int, float, unicode, bool, datetime.datetime]
+
+def generate_template(rnd, depth, width, fanout):
+    """Template of documents: dict of field name to scalar type, nested
+    template or list with template of array item"""
+    template = {}
+    for i in xrange(width):
+        r = rnd.random()
+        if depth > 1 and r < 0.2:
+            template['f%d' % i] = generate_template(rnd, depth-1, width, fanout)
+        elif depth > 1 and fanout > 0 and r < 0.3:
+            template['f%d' % i] = [generate_template(rnd, depth-1, width, fanout)]
+        elif fanout > 0 and r < 0.35:
+            template['f%d' % i] = [rnd.choice(scalar_types)]
+        else:
+            template['f%d' % i] = rnd.choice(scalar_types)
+    return template
+
+def generate_value(rnd, t):
+    if t is int:
+        return rnd.randint(0, 1000000)
+    elif t is float:
+        return rnd.random() + rnd.randint(0, 1000)
+    elif t is unicode:
+        return u'v' * rnd.randint(1, 32)
+    elif t is bool:
+        return rnd.random() < 0.5
+    elif t is datetime.datetime:
+        return datetime.datetime(2015, 1, 1) + datetime.timedelta(seconds=rnd.randint(0, 10**8))
+    return None
+
+def generate_document(rnd, template, fanout, conflict_rate, sparse_rate):
+    doc = {}
+    for key, t in template.iteritems():
+        if rnd.random() < sparse_rate:
+            continue
+        if type(t) is dict:
+            doc[key] = generate_document(rnd, t, fanout, conflict_rate, sparse_rate)
+        elif type(t) is list:
+            items = []
+            for i in xrange(rnd.randint(0, fanout)):
+                if type(t[0]) is dict:
+                    items.append(generate_document(rnd, t[0], fanout, conflict_rate, sparse_rate))
+                else:
+                    items.append(generate_value(rnd, t[0]))
+            doc[key] = items
+        elif rnd.random() < conflict_rate:
+            doc[key] = generate_value(rnd, rnd.choice(scalar_types + [type(None)]))
+        else:
+            doc[key] = generate_value(rnd, t)
+    return doc
+
+def generate_documents(args):
+    """Generate documents one by one, so they are not held in memory
+    all at once"""
+    rnd = random.Random(args.seed)
+    template = generate_template(rnd, args.depth, args.width, args.fanout)
+    for i in xrange(args.docs):
+        doc = generate_document(rnd, template, args.fanout, args.conflict_rate, args.sparse_rate)
+        doc['_id'] = bson.objectid.ObjectId()
+        yield doc
+
+def generate_wide_schema(seed, fields_count, conflict_rate=0.0):
+    """Serialized schema with fields_count branches, every tenth field
+    is a struct and every fiftieth is an array of structs"""
+    rnd = random.Random(seed)
+    hive_types = ["INT", "BIGINT", "DOUBLE", "STRING", "BOOLEAN", "TIMESTAMP"]
+    schema = {}
+    nested = schema
+    for i in xrange(fields_count):
+        if i % 50 == 0:
+            nested = {}
+            schema['a%d' % i] = [nested]
+        elif i % 10 == 0:
+            nested = {}
+            schema['s%d' % i] = nested
+        t = hive_types[i % len(hive_types)]
+        if rnd.random() < conflict_rate:
+            t = rnd.choice(hive_types)
+        nested['f%d' % i] = t
+    return schema
+
+def get_peak_memory_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def bench_inference(args):
+    """Documents are generated lazily and only their folding is timed,
+    benchmark runs in own process, so growth of its peak memory is
+    memory of inference"""
+    memory_before = get_peak_memory_kb()
+    shape_cache = get_mongo_schema_as_json.RecordShapeCache(args.shape_cache_size)
+    seconds = 0.0
+    schema = {}
+    for doc in generate_documents(args):
+        start = time.time()
+        schema = shape_cache.fold(doc, schema)
+        seconds += time.time() - start
+    start = time.time()
+    get_mongo_schema_as_json.prepare_schema_for_serialization(schema)
+    seconds += time.time() - start
+    return {"seconds": seconds,
+            "docs_per_sec": args.docs / seconds,
+            "peak_memory_kb": get_peak_memory_kb(),
+            "inference_memory_kb": get_peak_memory_kb() - memory_before}
+
+def bench_merge(args):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        file_names = []
+        for name, conflict_rate in [('primary', 0.0), ('secondary', 0.1)]:
+            file_names.append(os.path.join(tmp_dir, name+'.json'))
+            with open(file_names[-1], 'w') as schema_file:
+                json.dump(generate_wide_schema(args.seed, args.wide_fields, conflict_rate), schema_file)
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'merge_schemas.py')
+        start = time.time()
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call([sys.executable, script,
+                                   '--primary-schema', file_names[0],
+                                   '--secondary-schema', file_names[1],
+                                   '--merged-schema', os.path.join(tmp_dir, 'merged.json')],
+                                  stdout=devnull)
+        seconds = time.time() - start
+        return {"seconds": seconds,
+                "peak_memory_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss}
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def bench_ddl(args):
+    hive = get_hiveql_create_tables_by_schema
+    schema = hive.get_canonical_hive_schema(generate_wide_schema(args.seed, args.wide_fields))
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        start = time.time()
+        hive_gen = hive.HiveTableGenerator(schema, 'mongorecords', 'records', tmp_dir, "", "", False)
+        hive_gen.hiveql_gen_nested_plain_tables()
+        hive_gen.hiveql_gen_base_plain_table()
+        plain_tables_seconds = time.time() - start
+        start = time.time()
+        with open(os.path.join(tmp_dir, 'external_table.sql'), 'w') as external_table_file:
+            hive.write_external_hive_table(external_table_file, schema)
+        external_table_seconds = time.time() - start
+        return {"seconds": plain_tables_seconds + external_table_seconds,
+                "plain_tables_seconds": plain_tables_seconds,
+                "external_table_seconds": external_table_seconds,
+                "peak_memory_kb": get_peak_memory_kb()}
+    finally:
+        shutil.rmtree(tmp_dir)
+
+benchmarks = {"inference": bench_inference,
+              "merge": bench_merge,
+              "ddl": bench_ddl}
+
+def run_benchmark(params):
+    """Run benchmark in own process to measure its peak memory"""
+    name, args = params
+    #generated hiveql file names are reported to stderr by generator
+    get_hiveql_create_tables_by_schema.message = lambda mes: None
+    return benchmarks[name](args)
+
+def compare_with_baseline(results, baseline):
+    for name, metrics in results.iteritems():
+        for metric, value in metrics.iteritems():
+            base_value = baseline.get(name, {}).get(metric)
+            if not base_value:
+                continue
+            message("%s.%s: %.3f baseline %.3f (x%.2f)" % (name, metric, value, base_value,
+                                                            float(value) / base_value))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-of", action="store",
+                        help="Output file with results encoded as json(stdout by default)", type=argparse.FileType('w'))
+    parser.add_argument("--baseline", action="store",
+                        help="File with results of previous run to compare with", type=argparse.FileType('r'))
+    parser.add_argument("--benchmarks", nargs='+', choices=sorted(benchmarks.keys()),
+                        default=sorted(benchmarks.keys()), help="Benchmarks to run, all by default")
+    parser.add_argument("--seed", help="Seed of random generator, default=%(default)s", type=int, default=1)
+    parser.add_argument("--docs", help="Count of documents for inference, default=%(default)s", type=int, default=20000)
+    parser.add_argument("--depth", help="Nesting depth of documents, default=%(default)s", type=int, default=3)
+    parser.add_argument("--width", help="Count of keys at every level of document, default=%(default)s",
+                        type=int, default=10)
+    parser.add_argument("--fanout", help="Max count of array items, default=%(default)s", type=int, default=4)
+    parser.add_argument("--conflict-rate", help="Rate of values of unexpected type, default=%(default)s",
+                        type=float, default=0.01)
+    parser.add_argument("--sparse-rate", help="Rate of missing fields, default=%(default)s",
+                        type=float, default=0.1)
+    parser.add_argument("--shape-cache-size", help="Shape cache size used by inference, default=%(default)s",
+                        type=int, default=get_mongo_schema_as_json.default_shape_cache_size)
+    parser.add_argument("--wide-fields", help="Count of fields of schema for merge and ddl, default=%(default)s",
+                        type=int, default=20000)
+
+    args = parser.parse_args()
+
+    if args.of == None:
+        args.of = sys.stdout
+
+    params = dict(vars(args))
+    for key in ['of', 'baseline']:
+        del params[key]
+
+    results = {}
+    for name in args.benchmarks:
+        message("Running %s benchmark" % (name))
+        pool = multiprocessing.Pool(1)
+        results[name] = pool.apply(run_benchmark, [(name, argparse.Namespace(**params))])
+        pool.close()
+        pool.join()
+
+    json.dump({"params": params, "results": results}, args.of, indent=4, sort_keys=True)
+
+    if args.baseline is not None:
+        compare_with_baseline(results, json.load(args.baseline)["results"])
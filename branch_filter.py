@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+"""Include/exclude filter of dotted branches shared by scripts. Segment
+of pattern can be shell pattern ('*' matches any key) and '**' matches
+any count of nested keys, like '*.audit' or 'history.**'. Patterns are
+compiled into tries, document or schema is walked key by key carrying
+state of filter, so filtered out subtrees are pruned before descending
+into them. Arrays are transparent as in branch names."""
+
+import fnmatch
+
+DEEP = '**'
+
+def is_glob_segment(segment):
+    return '*' in segment or '?' in segment or '[' in segment
+
+def get_exact_branch(pattern):
+    """Branch matched by pattern without wildcards, trailing '**' matches
+    the same subtree as its parent. None if pattern has wildcards."""
+    splits = pattern.split('.')
+    while len(splits) > 1 and splits[-1] == DEEP:
+        splits.pop()
+    if len([segment for segment in splits if is_glob_segment(segment)]):
+        return None
+    return '.'.join(splits)
+
+def read_branches_file(branches_file):
+    branches = []
+    for line in branches_file:
+        if len(line.strip()):
+            branches.append(line.strip())
+    return branches
+
+def is_empty_branch(value):
+    """Scalar, empty struct or array of them, such branch is dropped if
+    it's only on the way to included branches"""
+    while type(value) is list and len(value):
+        value = value[0]
+    return type(value) is not dict or len(value) == 0
+
+
+class PatternTrie:
+    """Trie of patterns walked as nondeterministic automaton: node has
+    children of literal segments, children of glob segments and pattern
+    ending at it. Node of '**' is entered without consuming of key and
+    loops on any key."""
+
+    def __init__(self, patterns, exact=False):
+        self.literals = []
+        self.globs = []
+        self.deep = []
+        self.is_deep = []
+        self.terminals = []
+        root = self.add_node(False)
+        for pattern in patterns:
+            self.add_pattern(pattern, exact)
+        self.root_nodes = self.closure([root])
+
+    def add_node(self, is_deep):
+        self.literals.append({})
+        self.globs.append([])
+        self.deep.append(None)
+        self.is_deep.append(is_deep)
+        self.terminals.append(None)
+        return len(self.terminals)-1
+
+    def add_pattern(self, pattern, exact):
+        node = 0
+        for segment in pattern.split('.'):
+            if not exact and segment == DEEP:
+                if self.deep[node] is None:
+                    self.deep[node] = self.add_node(True)
+                node = self.deep[node]
+            elif not exact and is_glob_segment(segment):
+                children = [child for glob, child in self.globs[node] if glob == segment]
+                if len(children):
+                    node = children[0]
+                else:
+                    child = self.add_node(False)
+                    self.globs[node].append((segment, child))
+                    node = child
+            else:
+                child = self.literals[node].get(segment)
+                if child is None:
+                    child = self.add_node(False)
+                    self.literals[node][segment] = child
+                node = child
+        self.terminals[node] = pattern
+
+    def closure(self, nodes):
+        """Nodes and '**' nodes reachable from them without key"""
+        res = set()
+        stack = list(nodes)
+        while len(stack):
+            node = stack.pop()
+            if node in res:
+                continue
+            res.add(node)
+            if self.deep[node] is not None:
+                stack.append(self.deep[node])
+        return frozenset(res)
+
+    def step(self, nodes, key):
+        res = []
+        for node in nodes:
+            child = self.literals[node].get(key)
+            if child is not None:
+                res.append(child)
+            for glob, child in self.globs[node]:
+                if fnmatch.fnmatchcase(key, glob):
+                    res.append(child)
+            if self.is_deep[node]:
+                res.append(node)
+        return self.closure(res)
+
+    def get_matched(self, nodes):
+        return [self.terminals[node] for node in nodes if self.terminals[node] is not None]
+
+
+class FilterState(object):
+    """Nodes of both tries reached by path of keys: include nodes (None
+    if all nested branches are included) and exclude nodes. Partial
+    state is on the way to included branches only. Transitions by keys
+    are cached, so check of key is one dict lookup."""
+    __slots__ = ('branch_filter', 'include_nodes', 'exclude_nodes', 'partial', 'transitions')
+
+    def __init__(self, branch_filter, include_nodes, exclude_nodes):
+        self.branch_filter = branch_filter
+        self.include_nodes = include_nodes
+        self.exclude_nodes = exclude_nodes
+        self.partial = include_nodes is not None
+        self.transitions = {}
+
+    def child(self, key):
+        """State of nested key, None if key's subtree is filtered out"""
+        try:
+            return self.transitions[key]
+        except KeyError:
+            pass
+        child = self.branch_filter.get_child_state(self, key)
+        if len(self.transitions) >= self.branch_filter.max_transitions:
+            self.transitions.clear()
+        self.transitions[key] = child
+        return child
+
+
+class BranchFilter:
+    """Compiled include and exclude patterns. Branch is filtered out if
+    it or its parent matches exclude pattern, or if include patterns are
+    set and neither it nor its parent matches them. Branches on the way
+    to included ones are kept as containers only. Document is walked
+    carrying FilterState starting from root."""
+
+    #transitions cache of state is reset when it grows above (keys can be ids)
+    max_transitions = 10000
+
+    def __init__(self, include_patterns=None, exclude_patterns=None, exact=False):
+        self.include = None
+        if include_patterns:
+            self.include = PatternTrie([self.decode(p) for p in include_patterns], exact)
+        self.exclude = PatternTrie([self.decode(p) for p in exclude_patterns or []], exact)
+        self.states = {}
+        self.matched_patterns = set()
+        include_nodes = None
+        if self.include is not None:
+            include_nodes = self.include.root_nodes
+        self.root = self.get_state(include_nodes, self.exclude.root_nodes)
+
+    def decode(self, pattern):
+        #keys of decoded records and json schemas are unicode
+        if type(pattern) is str:
+            return pattern.decode('utf-8')
+        return pattern
+
+    def get_state(self, include_nodes, exclude_nodes):
+        """States are shared by all paths reaching the same nodes"""
+        if include_nodes is not None and len(self.include.get_matched(include_nodes)):
+            include_nodes = None
+        state = self.states.get((include_nodes, exclude_nodes))
+        if state is None:
+            state = FilterState(self, include_nodes, exclude_nodes)
+            self.states[(include_nodes, exclude_nodes)] = state
+        return state
+
+    def get_child_state(self, state, key):
+        exclude_nodes = self.exclude.step(state.exclude_nodes, key)
+        matched = self.exclude.get_matched(exclude_nodes)
+        if len(matched):
+            self.matched_patterns.update(matched)
+            return None
+        include_nodes = state.include_nodes
+        if include_nodes is not None:
+            include_nodes = self.include.step(include_nodes, key)
+            if len(include_nodes) == 0:
+                return None
+        return self.get_state(include_nodes, exclude_nodes)
+
+    def is_included(self, branch):
+        state = self.root
+        for key in branch.split('.'):
+            state = state.child(key)
+            if state is None:
+                return False
+        return not state.partial
+
+    def prune_schema(self, schema, state=None):
+        """Remove filtered out branches from schema of nested dicts and
+        lists in place, branches on the way to included ones are removed
+        if nothing is left in them"""
+        if state is None:
+            state = self.root
+        if type(schema) is list:
+            for item in schema:
+                self.prune_schema(item, state)
+        elif type(schema) is dict:
+            for key in schema.keys():
+                nested_state = state.child(key)
+                if nested_state is None:
+                    del schema[key]
+                    continue
+                self.prune_schema(schema[key], nested_state)
+                if nested_state.partial and is_empty_branch(schema[key]):
+                    del schema[key]
+        return schema
+
+    def get_unmatched_exclude_patterns(self):
+        return [pattern for pattern in self.exclude.get_matched(xrange(len(self.exclude.terminals)))
+                if pattern not in self.matched_patterns]
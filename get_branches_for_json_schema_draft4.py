@@ -1,33 +1,35 @@
-
 import argparse
 import json
 
-def get_branches_from_schema_recursively(schema):
+def get_draft4_branches(schema):
+    """Get branches of json-schema draft4, 'properties' of object,
+    'items' of array and single 'anyOf' are not included into names"""
     branches = []
-    if type(schema) is not dict and type(schema) is not list:
-        return branches
-
-    for key, value in schema.iteritems():
-        v = None
-        if type(value) is dict:
-            v = value
-        elif type(value) is list:
-            v = value[0]
-        
-        if v is not None:
-            l = get_branches_from_schema_recursively(v)
-
-            for item in l:
-                if key == 'properties' and schema['type'] == 'object':
-                    branches.append(item)
-                elif key == 'items' and ('type' in schema.keys() and schema['type'] == 'array'):
-                    branches.append(item)
-                elif key == 'anyOf' and len(schema.keys()) == 1:
-                    branches.append(item)
-                else:
-                    branches.append(key+'.'+item)
-        else:
-            branches.append(key)
+    #entries: object with prefix for its keys or leaf with its name
+    stack = [(schema, '')]
+    while len(stack):
+        value, name = stack.pop()
+        if type(value) is not dict:
+            branches.append(name)
+            continue
+        value_type = value.get('type')
+        for key, nested_value in reversed(value.items()):
+            if type(nested_value) is not dict and type(nested_value) is not list:
+                stack.append((nested_value, name+key))
+                continue
+            v = nested_value
+            if type(nested_value) is list:
+                v = None
+                if len(nested_value):
+                    v = nested_value[0]
+            if type(v) is not dict:
+                continue
+            if (key == 'properties' and value_type == 'object') or \
+                    (key == 'items' and value_type == 'array') or \
+                    (key == 'anyOf' and len(value) == 1):
+                stack.append((v, name))
+            else:
+                stack.append((v, name+key+'.'))
     return branches
 
 if __name__=='__main__':
@@ -43,7 +45,7 @@ if __name__=='__main__':
 
     #get list of branches
     schema = json.load(args.schema_draft4_file)
-    schema_branches=get_branches_from_schema_recursively(schema)
+    schema_branches=get_draft4_branches(schema)
 
     #remove exscessive last split from every branch
     for item in schema_branches:
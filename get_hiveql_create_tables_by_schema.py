@@ -13,161 +13,217 @@ import sys
 import os
 import argparse
 import json
+import time
+from schema_tree import get_schema_branches, intern_schema_types
+from branch_filter import BranchFilter, read_branches_file
+from metrics import Metrics
 
 artifical_field_name='artificial_field_name_do_not_change'
 
 def message(mes):
     sys.stderr.write( mes + '\n')
 
-def get_exclude_branches_structure(exclude_branches_list):
-    exclude_branches_structure = {}
-    exclude_branches_list.sort()
-    current = ""
-    nested_exclude_branches_list = []
-    for key in exclude_branches_list:
-        splits = key.split('.', 1)
-        if current != splits[0]:
-            if len(current)>0:
-                exclude_branches_structure[ current ] = get_exclude_branches_structure( nested_exclude_branches_list )
-            current = splits[0]
-            del nested_exclude_branches_list[:]
-        if len(splits) > 1:
-            nested_exclude_branches_list.append(splits[1])
-    if len(current)>0 and exclude_branches_structure.get(current) == None:
-        exclude_branches_structure[ current ] = get_exclude_branches_structure( nested_exclude_branches_list )
-    return exclude_branches_structure
-
-
-def remove_excluded_branches_from_schema(schema, exclude_branches_structure):
-    for key, value in exclude_branches_structure.iteritems():
-        if type(schema) is dict:
-            if len(value)>0:
-                if schema.get(key) == None:
-                    message("can't locate attr key="+key+" at schema")
-                else:
-                    remove_excluded_branches_from_schema(schema[key], value)
-            else:
-                if schema.get(key) == None:
-                    message("can't exclude key="+key+" as not located")
-                else:
-                    del schema[key]
-        elif type(schema) is list:
-            if len(value)>0:
-                if len(schema)>0 and type(schema[0]) is dict:
-                    if schema[0].get(key) == None:
-                        message("can't locate in array key="+key+" at schema")
-                    else:
-                        remove_excluded_branches_from_schema(schema[0][key], value)
-                else:
-                    message("can't locate array key="+key+" at schema")
-            elif schema[0].get(key) != None:
-                del schema[0][key]
+#narrowed types of columns are read from external table as wider types
+#and casted by plain tables
+max_varchar_length = 65535
 
+def get_external_type(column_type):
+    if column_type == "SMALLINT":
+        return "INT"
+    elif column_type.startswith("VARCHAR("):
+        return "STRING"
+    return column_type
 
-def generate_external_hive_table(indirection_level, schema):
-    indirection_level += 1
-    output = ''
-    indent = '    '
-    indent_struct = indent
-    delim = ' '
-    struct_open = '(\n'
-    struct_close = '\n)\n'
-    if indirection_level > 1:
-        indent_struct = indent * (indirection_level-1)
-        indent = indent * indirection_level
-        delim = ':'
-        struct_open = 'STRUCT\n'+indent_struct+'<\n'
-        struct_close = '\n'+indent_struct+'>'
-    array_open = 'ARRAY\n'+indent_struct+'<\n'
-    array_close = '\n'+indent_struct+'>'
-
-    if type(schema) is dict:
-        output += struct_open
-        for key in schema.keys()[:-1]:
-            output += indent + '`' + key + '`' + delim + generate_external_hive_table(indirection_level, schema[key]) + ',\n'
-        if len(schema.keys()) > 0:
-            key = schema.keys()[-1]
-            output += indent + '`' +key + '`' + delim + generate_external_hive_table(indirection_level, schema[key])
-        output += indent + struct_close
-    elif type(schema) is list:
-        output += array_open
-        for item in schema[:-1]:
-            output += indent + generate_external_hive_table(indirection_level, item) + ',\n'
-        if len(schema) > 0:
-            output += indent + generate_external_hive_table(indirection_level, schema[-1])
-        output += indent + array_close
-    elif type(schema) is str or type(schema) is unicode:
-        output += schema
-    else:
-        raise Exception("unknown schema", type(schema))
-    return output
+def get_narrowed_type(column_type, branch_stats):
+    """Narrower (or wider if INT overflows) type of column by statistics
+    of its values. Type is kept if values of other types were seen.
+    Length of VARCHAR is rounded up to power of 2 to leave room for
+    longer values."""
+    types = branch_stats["types"]
+    if len(types) != 1 or column_type not in types:
+        return column_type
+    if column_type == "INT" and "min" in branch_stats:
+        if branch_stats["min"] >= -2**15 and branch_stats["max"] < 2**15:
+            return "SMALLINT"
+        elif branch_stats["min"] < -2**31 or branch_stats["max"] >= 2**31:
+            return "BIGINT"
+    elif column_type == "STRING" and "max_length" in branch_stats:
+        length = 1
+        while length < branch_stats["max_length"]:
+            length *= 2
+        if length <= max_varchar_length:
+            return "VARCHAR(%d)" % (length)
+    return column_type
 
-def get_branches_from_schema_recursively(schema):
-    branches = []
-    if type(schema) is not dict and type(schema) is not list:
-        return branches
-
-    for key, value in schema.iteritems():
-        k=""
+def apply_field_stats(schema, field_stats, min_presence_rate):
+    """Narrow types of schema's branches by statistics of values saved
+    by get_mongo_schema_as_json.py --stats-file. Returns branches having
+    non null value in not more than min_presence_rate of records, they
+    are to be excluded. Branches of _id are kept as is."""
+    records_count = field_stats["records"]
+    branches_stats = field_stats["branches"]
+    empty_branches = []
+    #entries are container, key of value in container and branch name
+    stack = [(schema, key, key) for key in schema if key != '_id']
+    while len(stack):
+        container, key, branch = stack.pop()
+        value = container[key]
         if type(value) is dict:
-            l = get_branches_from_schema_recursively(value)
-            for item in l:
-                branches.append(key+'.'+item)
+            stack.extend([(value, nested_key, branch+'.'+nested_key) for nested_key in value])
         elif type(value) is list:
-            try:
-                l = get_branches_from_schema_recursively(value[0])
-            except:
-                message("Data type not specified. Empty arrays like [] not allowed")
-                raise
-            if len(l): 
-                for item in l:
-                    branches.append(key+'.'+item)
+            if len(value):
+                stack.append((value, 0, branch))
+        else:
+            branch_stats = branches_stats.get(branch)
+            if branch_stats is None:
+                continue
+            if records_count == 0 or float(branch_stats["records"]) / records_count <= min_presence_rate:
+                empty_branches.append(branch)
             else:
-                #field is just an array of basic data type
-                branches.append(key)
+                container[key] = get_narrowed_type(value, branch_stats)
+    return empty_branches
+
+def get_inline_arrays(field_stats, max_length):
+    """Canonical names of array branches whose length never exceeds
+    max_length and their max length"""
+    inline_arrays = {}
+    for branch, lengths in field_stats.get("arrays", {}).iteritems():
+        length = max([int(length) for length in lengths])
+        if length > 0 and length <= max_length:
+            branch = '.'.join([get_canonical_name(key) for key in branch.split('.')])
+            inline_arrays[branch] = length
+    return inline_arrays
+
+
+#count of tokens of external table definition joined for one write
+write_chunk_tokens = 4096
+
+def get_external_hive_table_tokens(indirection_level, schema):
+    """Generate pieces of external table's columns definition in output
+    order, schema is walked by explicit stack"""
+    stack = [(indirection_level, schema)]
+    while len(stack):
+        item = stack.pop()
+        if type(item) is not tuple:
+            yield item
+            continue
+        indirection_level, schema = item
+        indirection_level += 1
+        indent = '    '
+        indent_struct = indent
+        delim = ' '
+        struct_open = '(\n'
+        struct_close = '\n)\n'
+        if indirection_level > 1:
+            indent_struct = indent * (indirection_level-1)
+            indent = indent * indirection_level
+            delim = ':'
+            struct_open = 'STRUCT\n'+indent_struct+'<\n'
+            struct_close = '\n'+indent_struct+'>'
+        array_open = 'ARRAY\n'+indent_struct+'<\n'
+        array_close = '\n'+indent_struct+'>'
+
+        if type(schema) is dict:
+            tokens = [struct_open]
+            keys = schema.keys()
+            for key in keys:
+                value = schema[key]
+                if type(value) is str or type(value) is unicode:
+                    tokens.append(indent + '`' + key + '`' + delim + get_external_type(value))
+                else:
+                    tokens.append(indent + '`' + key + '`' + delim)
+                    tokens.append((indirection_level, value))
+                tokens.append(',\n')
+            if len(keys) > 0:
+                tokens.pop()
+            tokens.append(indent + struct_close)
+        elif type(schema) is list:
+            tokens = [array_open]
+            for nested in schema:
+                tokens.append(indent)
+                tokens.append((indirection_level, nested))
+                tokens.append(',\n')
+            if len(schema) > 0:
+                tokens.pop()
+            tokens.append(indent + array_close)
+        elif type(schema) is str or type(schema) is unicode:
+            yield get_external_type(schema)
+            continue
         else:
-            branches.append(key)
-    return branches
+            raise Exception("unknown schema", type(schema))
+        tokens.reverse()
+        stack.extend(tokens)
 
+def write_external_hive_table(output_file, schema):
+    """Write external table's columns definition into file by chunks
+    without building whole string"""
+    chunk = []
+    for token in get_external_hive_table_tokens(0, schema):
+        chunk.append(token)
+        if len(chunk) >= write_chunk_tokens:
+            output_file.write(''.join(chunk))
+            chunk = []
+    output_file.write(''.join(chunk))
 
-def get_canonical_hive_schema_recursively(schema):
-    if type(schema) is not list and type(schema) is not dict:
-        return schema
+def generate_external_hive_table(indirection_level, schema):
+    return ''.join(get_external_hive_table_tokens(indirection_level, schema))
 
+def get_canonical_name(key):
+    if key[0] == '_':
+        key = key[1:]
+    return key.replace('?','')
+
+def get_canonical_hive_schema(schema):
+    """Copy of schema having canonical names of fields, empty structs and
+    arrays of them are dropped. Nested structs are copied by explicit
+    stack."""
+    if type(schema) is not dict:
+        return schema
     canonical_schema = {}
-    for key, value in schema.iteritems():
-        if key[0] == '_':
-            key = key[1:]
-        key = key.replace('?','')
-        if type(value) is list:
-            #do not propogate array of empty structs
-            if not(len(value)>0 and type(value[0]) is dict and len(value[0]) == 0):
-                canonical_schema[key] = [get_canonical_hive_schema_recursively(value[0])]
-        elif type(value) is dict:
-            #do not propogate empty structs
-            if len(value) != 0:
-                canonical_schema[key] = get_canonical_hive_schema_recursively(value)
-        else:
-            canonical_schema[key] = value
+    stack = [(schema, canonical_schema)]
+    while len(stack):
+        struct, canonical_struct = stack.pop()
+        for key, value in struct.iteritems():
+            key = get_canonical_name(key)
+            if type(value) is list:
+                #do not propogate array of empty structs
+                if len(value) > 0 and type(value[0]) is dict:
+                    if len(value[0]) != 0:
+                        canonical_struct[key] = [{}]
+                        stack.append((value[0], canonical_struct[key][0]))
+                else:
+                    canonical_struct[key] = [value[0]]
+            elif type(value) is dict:
+                #do not propogate empty structs
+                if len(value) != 0:
+                    canonical_struct[key] = {}
+                    stack.append((value, canonical_struct[key]))
+            else:
+                canonical_struct[key] = value
     return canonical_schema
 
 
-def get_struct_fields_recursively(schema):
+def get_column_name(sel_item):
+    """Column name of select item, index of inlined array item becomes
+    suffix of name"""
+    return sel_item.replace('.', '_').replace('[', '_').replace(']', '')
+
+def get_struct_fields(schema):
+    """Get [field, type] of every scalar of struct, arrays are skipped.
+    Field nested into structs is list of keys of its path. Fields are
+    listed in order of keys, nested structs are walked by explicit stack."""
     select_fields = []
-    for key, type_value in schema.iteritems():
-        if type(type_value) is dict:
-            nested_struct = get_struct_fields_recursively(type_value)
-            for item in nested_struct:
-                item_field = item[0]
-                item_type = item[1]
-                if type(item_field) is list:
-                    s = [key]
-                    s.extend(item_field)
-                    select_fields.append( [s, item_type] )
-                else:
-                    select_fields.append( [ [key, item_field], item_type ] )
-        elif type(type_value) is not list:
-            select_fields.append( [key, type_value] )
+    stack = [(key, value, []) for key, value in reversed(schema.items())]
+    while len(stack):
+        key, value, path = stack.pop()
+        if type(value) is dict:
+            stack.extend([(nested_key, nested_value, path+[key])
+                          for nested_key, nested_value in reversed(value.items())])
+        elif type(value) is not list:
+            if len(path):
+                select_fields.append( [path+[key], value] )
+            else:
+                select_fields.append( [key, value] )
     return select_fields
 
 def create_keys_mapping(branches):
@@ -182,6 +238,179 @@ def create_keys_mapping(branches):
             mappings[str(new_item)] = str(item)
     return mappings
 
+def get_base_branch_kind(schema, branch):
+    """Get canonical path of branch of base record and its kind:
+    'objectid', 'timestamp', 'number' or None for other types. Branch
+    must not be nested into arrays."""
+    value = schema
+    for key in branch.split('.'):
+        if type(value) is not dict or key not in value:
+            raise Exception("Branch not found or nested into array", branch)
+        value = value[key]
+    path = [get_canonical_name(key) for key in branch.split('.')]
+    if type(value) is dict and value.get('oid') == 'STRING':
+        return (path, 'objectid')
+    elif value == 'TIMESTAMP':
+        return (path, 'timestamp')
+    elif value in ['INT', 'BIGINT', 'DOUBLE']:
+        return (path, 'number')
+    return (path, None)
+
+def get_partition_by(schema, branch):
+    """Get canonical path of branch to partition tables by and its kind:
+    'objectid' if branch is ObjectId (creation time is used) or
+    'timestamp'"""
+    path, kind = get_base_branch_kind(schema, branch)
+    if kind not in ['objectid', 'timestamp']:
+        raise Exception("Partition branch must be ObjectId or TIMESTAMP", branch)
+    return (path, kind)
+
+#mongo.input.query selecting records above watermark passed by hiveconf
+watermark_query_fmts = {"objectid": '{{"{0}": {{"$gt": {{"$oid": "${{hiveconf:watermark}}"}}}}}}',
+                        "timestamp": '{{"{0}": {{"$gt": {{"$date": ${{hiveconf:watermark}}}}}}}}',
+                        "number": '{{"{0}": {{"$gt": ${{hiveconf:watermark}}}}}}'}
+#query getting next watermark from base plain table
+watermark_select_fmts = {"objectid": "SELECT max({0}_oid) FROM {1};\n",
+                         "timestamp": "SELECT unix_timestamp(max({0}))*1000 FROM {1};\n",
+                         "number": "SELECT max({0}) FROM {1};\n"}
+#unset hiveconf variable is left as is, so script fails instead of loading invalid query
+watermark_guard_str = "SELECT assert_true('${hiveconf:watermark}' != concat('$', '{hiveconf:watermark}'));\n"
+
+def get_watermark_query(schema, branch):
+    """Get mongo.input.query loading records above watermark and query
+    selecting next watermark by column of base plain table"""
+    path, kind = get_base_branch_kind(schema, branch)
+    if kind is None:
+        raise Exception("Watermark branch must be ObjectId, TIMESTAMP or number", branch)
+    return (watermark_query_fmts[kind].format(branch), watermark_select_fmts[kind].format('_'.join(path), '{0}'))
+
+def has_nested_arrays(schema):
+    """True if any array of schema has nested array, such arrays get
+    tables nested deeper than one level"""
+    stack = [(schema, False)]
+    while len(stack):
+        value, in_array = stack.pop()
+        if type(value) is list:
+            if in_array:
+                return True
+            stack.extend([(item, True) for item in value])
+        elif type(value) is dict:
+            stack.extend([(item, in_array) for item in value.itervalues()])
+    return False
+
+#table properties of storage settings by storage format
+#stripe_size is size of orc stripe or parquet row group in bytes
+storage_table_properties = {"orc": {"compression": "orc.compress",
+                                    "stripe_size": "orc.stripe.size",
+                                    "bloom_filters": "orc.bloom.filter.columns",
+                                    "bloom_filter_fpp": "orc.bloom.filter.fpp"},
+                            "parquet": {"compression": "parquet.compression",
+                                        "stripe_size": "parquet.block.size"}}
+format_storage_settings_names = ["compression", "stripe_size", "bloom_filters", "bloom_filter_fpp"]
+default_storage_settings = {"format": "orc", "bloom_filter_keys": True, "analyze": True}
+storage_settings_names = ["format", "sort_by", "bloom_filter_keys", "analyze"] + format_storage_settings_names
+
+def load_storage_profile(profile_file):
+    """Load storage profile: 'default' settings and 'tables' settings by
+    table name overriding default ones"""
+    profile = json.load(profile_file)
+    settings_list = [profile.get("default", {})] + profile.get("tables", {}).values()
+    for settings in settings_list:
+        for name in settings:
+            if name not in storage_settings_names:
+                raise Exception("Unknown storage setting", name)
+    return profile
+
+def get_storage_settings(profile, table_name):
+    table_settings = profile.get("tables", {}).get(table_name, {})
+    settings = dict(default_storage_settings)
+    settings.update(profile.get("default", {}))
+    #default settings not supported by format of table are not applied
+    storage_format = table_settings.get("format", settings["format"]).lower()
+    for name in format_storage_settings_names:
+        if name in settings and name not in storage_table_properties.get(storage_format, {}):
+            del settings[name]
+    settings.update(table_settings)
+    return settings
+
+def get_key_columns(columns):
+    """Columns of table's own, parent's or base record's id"""
+    return [column for column, column_type in columns
+            if column == 'id' or column == 'id_oid' or column.endswith('_id')]
+
+def get_storage_clause(settings, columns, table_custom_properties):
+    """STORED AS and TBLPROPERTIES of storage settings around custom
+    table properties. Bloom filters are added on key columns if format
+    supports them."""
+    storage_format = settings["format"].lower()
+    table_properties = storage_table_properties.get(storage_format, {})
+    bloom_filters = list(settings.get("bloom_filters", []))
+    if settings["bloom_filter_keys"] and "bloom_filters" in table_properties:
+        for column in get_key_columns(columns):
+            if column not in bloom_filters:
+                bloom_filters.append(column)
+    properties = []
+    for name in ["compression", "stripe_size", "bloom_filter_fpp"]:
+        if name in settings:
+            if name not in table_properties:
+                raise Exception("Storage setting is not supported by format", name, storage_format)
+            properties.append("'%s'='%s'" % (table_properties[name], settings[name]))
+    if len(bloom_filters):
+        if "bloom_filters" not in table_properties:
+            raise Exception("Storage setting is not supported by format", "bloom_filters", storage_format)
+        properties.append("'%s'='%s'" % (table_properties["bloom_filters"], ",".join(bloom_filters)))
+    clause = "STORED AS " + storage_format
+    if len(table_custom_properties):
+        clause += " " + table_custom_properties
+    if len(properties):
+        clause += " TBLPROPERTIES(" + ", ".join(properties) + ")"
+    return clause
+
+def get_compound_table_name(nesting_list):
+    compound_name = ""
+    for i in xrange(len(nesting_list)):
+        nest = nesting_list[i]
+        name = nest[:-1]
+        if len(compound_name) != 0 :
+            compound_name += "-"
+        compound_name += name
+    return compound_name+'s'
+
+class TablePlan(object):
+    """Plan of plain table: fields selected from array item (list of
+    names for fields of structs), names of arrays from base record to
+    the array and types of columns. Names of plain fields are kept in
+    set for membership checks, parent and children are plans of tables
+    of enclosing and nested arrays."""
+    __slots__ = ('name', 'select_fields', 'nesting_list', 'types', 'field_names', 'parent', 'children')
+
+    def __init__(self, name, select_fields, nesting_list, types):
+        self.name = name
+        self.select_fields = select_fields
+        self.nesting_list = nesting_list
+        self.types = types
+        self.field_names = set([field for field in select_fields if type(field) is not list])
+        self.parent = None
+        self.children = []
+
+    def is_base(self):
+        return len(self.nesting_list) == 1
+
+    def has_id(self):
+        """Record has own id which is not ObjectId"""
+        return 'id' in self.field_names or '_id' in self.field_names
+
+    def name_component(self):
+        return self.nesting_list[-1]
+
+    def get_base(self):
+        """Plan of base table of the table"""
+        table_plan = self
+        while table_plan.parent is not None:
+            table_plan = table_plan.parent
+        return table_plan
+
+
 class HiveTableGenerator:
     create_fmt = "drop table {0}; create table {0} {1} as\n"
     select_fmt = "SELECT\n {0}{1}{2} \nFROM "
@@ -191,6 +420,9 @@ class HiveTableGenerator:
     select_item_nvl_fmt = ",\ntranslate({0}_exp.{1}, '\r\n', '  ') AS {2}"
     select_item_nvl_fmt2 = "translate({0}, '\r\n', '  ') AS {1}"
     select_item_nvl_fmt3 = ",\ntranslate({0}_exp, '\r\n', '  ') AS {1}"
+#for fields of narrowed types
+    translate_fmt = "translate({0}, '\r\n', '  ')"
+    cast_item_fmt = "CAST({0} AS {1}) AS {2}"
 #for non string fields
     select_item_fmt = ",\n{0}_exp.{1} AS {2}"
     select_item_fmt2 = "{0} AS {1}"
@@ -198,12 +430,70 @@ class HiveTableGenerator:
 #
     primaryk_fmt = "row_number() OVER(ORDER BY {0}_exp.id) AS {1}"
     explode_as_fmt = " AS {0}_exp LATERAL VIEW EXPLODE({0}_exp.{1}) {1}_e AS {1}_exp"
+#for multi-insert mode
+    create_columns_fmt = "drop table {0}; create table {0} (\n{1}\n) {2};\n"
+    create_if_not_exists_fmt = "create table if not exists {0} (\n{1}\n) {2};\n"
+    column_fmt = "`{0}` {1}"
+    multi_from_fmt = "FROM {0} {1}_exp"
+    multi_insert_fmt = "\n{0}SELECT\n {1}{2}"
+    lateral_view_fmt = "\nLATERAL VIEW EXPLODE({0}_exp.{1}) {1}_e AS {1}_exp"
+#for materialized explode levels
+    level_table_fmt = "drop table {0}; create table {0} {7} as\n\
+SELECT\n {1},\n{2} AS parent_id,\n{3}_exp{6} \nFROM {4}{5};\n"
+    level_explode_fmt = "\nLATERAL VIEW EXPLODE({0}) {1}_e AS {1}_exp"
+    level_foreignk_fmt = ",\n{0} AS {1}_id"
+    drop_level_fmt = "\ndrop table {0};"
+#for keys made of parent key and array position
+    posexplode_as_fmt = " AS {0}_exp LATERAL VIEW POSEXPLODE({0}_exp.{1}) {1}_e AS {1}_pos, {1}_exp"
+    level_posexplode_fmt = "\nLATERAL VIEW POSEXPLODE({0}) {1}_e AS {1}_pos, {1}_exp"
+    composite_key_fmt = "concat_ws('.', {0}, CAST({1}_pos AS STRING))"
+    hash_key_fmt = "md5({0})"
+    key_strategies = ["row_number", "posexplode", "hash"]
+#for partitioned tables
+    partition_column = "partition_date"
+    partition_formats = {"daily": "yyyy-MM-dd", "monthly": "yyyy-MM"}
+    objectid_partition_fmt = "from_unixtime(CAST(conv(substr({0}.oid, 1, 8), 16, 10) AS BIGINT), '{1}')"
+    timestamp_partition_fmt = "from_unixtime(unix_timestamp({0}), '{1}')"
+    partition_item_fmt = ",\n{0} AS {1}"
+    dynamic_partition_opts = "SET hive.exec.dynamic.partition=true;\nSET hive.exec.dynamic.partition.mode=nonstrict;\n"
+    partitioned_by_fmt = "PARTITIONED BY ({0} STRING) "
+#for partitioned or incrementally loaded tables
+    insert_fmt = "INSERT {0} TABLE {1}{2}\n"
+    insert_partition_fmt = " PARTITION ({0})"
+#for storage profile
+    sort_by_fmt = "\nSORT BY {0}"
+    analyze_fmt = "\nANALYZE TABLE {0}{1} COMPUTE STATISTICS FOR COLUMNS;"
 
-    def __init__(self, schema, ext_table_name, base_table_name, tables_folder_name, table_custom_properties, hive_opts, short_column_names):
+    def __init__(self, schema, ext_table_name, base_table_name, tables_folder_name, table_custom_properties, hive_opts, short_column_names,
+                 partition_by=None, partition_granularity="daily", incremental=False, key_strategy="row_number",
+                 storage_profile=None, inline_arrays=None):
+        """partition_by is (canonical path, kind) of branch of base record
+        used to partition all tables, see get_partition_by. Incremental
+        tables are created once and new records are appended to them.
+        Keys of nested tables are generated by key_strategy: row_number
+        ordered by parent's id, posexplode - parent's key and position
+        in array, hash - md5 of posexplode key. Storage profile sets
+        storage of tables, see load_storage_profile. Arrays of inline_arrays
+        dict of canonical branch name and max length are selected as
+        indexed columns of parent table instead of own tables."""
+        if incremental and key_strategy == "row_number":
+            #row numbers restart on every load and collide with appended keys
+            raise Exception("Incremental tables require posexplode or hash key strategy", key_strategy)
+        self.inline_arrays = inline_arrays or {}
+        self.storage_profile = storage_profile
+        self.key_strategy = key_strategy
+        self.key_type = "INT"
+        if key_strategy != "row_number":
+            self.key_type = "STRING"
+        self.partition_by = partition_by
+        self.incremental = incremental
+        self.partition_granularity = partition_granularity
+        #plans of tables by table name
         self.helper_structure = {}
         self.ext_table_name = ext_table_name
         self.tables_folder_name = tables_folder_name
         self.create_structure_for_plain_hive_tables([base_table_name], schema, self.helper_structure)
+        self.link_table_plans()
         self.table_custom_properties = table_custom_properties
         self.hive_opts = hive_opts
         self.short_column_names = short_column_names
@@ -213,6 +503,8 @@ class HiveTableGenerator:
         if fieldtype == "STRING":
             strtype = True
         res = ""
+        if fieldtype is not None and get_external_type(fieldtype) != fieldtype:
+            return self.sel_cast_item_fmt(expname, fieldname, fieldnameas, fieldtype)
         if not expname:
             if strtype:
                 res = self.select_item_nvl_fmt2.format(fieldname, fieldnameas)
@@ -230,63 +522,278 @@ class HiveTableGenerator:
                 res = self.select_item_fmt.format(expname, fieldname, fieldnameas)
         return res
 
-    def create_structure_for_plain_hive_tables(self, nesting_list, schema, res_tables):
-        select_fields = []
-        output = ""
-        if type(schema) is dict:
-            schema_as_dict = schema
-        elif type(schema) is list:
-            schema_as_dict = schema[0]
+    def sel_cast_item_fmt(self, expname, fieldname, fieldnameas, fieldtype):
+        """Select item of field of narrowed type read from external table
+        as wider type"""
+        if not expname:
+            field = fieldname
+        elif not fieldname:
+            field = expname + "_exp"
         else:
-            #handle case when list contains just an item of primitive data type 
-            artificial_struct = {artifical_field_name:schema}
-            schema_as_dict = artificial_struct
+            field = expname + "_exp." + fieldname
+        if get_external_type(fieldtype) == "STRING":
+            field = self.translate_fmt.format(field)
+        res = self.cast_item_fmt.format(field, fieldtype, fieldnameas)
+        if expname:
+            res = ",\n" + res
+        return res
 
-        types = {}
-        select_fields = []
-        for key, value in schema_as_dict.iteritems():
-            if type(value) is list:
-                self.create_structure_for_plain_hive_tables(nesting_list+[key], value[0], res_tables) 
-            elif type(value) is dict:
-                #get fields
-                struct_fields = get_struct_fields_recursively(value)
-                for item in struct_fields:
-                    item_field = item[0]
-                    item_type = item[1]
-                    if type(item_field) is list:
-                        s = [key]
-                        s.extend(item_field)
-                    else:
-                        s = [key] + [item_field]
-                    select_fields.append( s )
-                    types['_'.join( s )] = item_type
+    def create_structure_for_plain_hive_tables(self, nesting_list, schema, res_tables):
+        """Create plans of table of schema and of tables of its arrays,
+        arrays are walked by explicit stack"""
+        stack = [(nesting_list, schema)]
+        while len(stack):
+            nesting_list, schema = stack.pop()
+            if type(schema) is dict:
+                schema_as_dict = schema
+            elif type(schema) is list:
+                schema_as_dict = schema[0]
+            else:
+                #handle case when list contains just an item of primitive data type 
+                artificial_struct = {artifical_field_name:schema}
+                schema_as_dict = artificial_struct
+
+            types = {}
+            select_fields = []
+            for key, value in schema_as_dict.iteritems():
+                if type(value) is list and self.is_inline_array(nesting_list+[key], value[0]):
+                    for i in xrange(self.inline_arrays['.'.join(nesting_list[1:]+[key])]):
+                        indexed_key = "%s[%d]" % (key, i)
+                        if type(value[0]) is not dict:
+                            select_fields.append( indexed_key )
+                            types[indexed_key] = value[0]
+                            continue
+                        for item_field, item_type in get_struct_fields(value[0]):
+                            if type(item_field) is list:
+                                s = [indexed_key] + item_field
+                            else:
+                                s = [indexed_key, item_field]
+                            select_fields.append( s )
+                            types['_'.join( s )] = item_type
+                elif type(value) is list:
+                    stack.append((nesting_list+[key], value[0]))
+                elif type(value) is dict:
+                    #get fields
+                    struct_fields = get_struct_fields(value)
+                    for item in struct_fields:
+                        item_field = item[0]
+                        item_type = item[1]
+                        if type(item_field) is list:
+                            s = [key]
+                            s.extend(item_field)
+                        else:
+                            s = [key] + [item_field]
+                        select_fields.append( s )
+                        types['_'.join( s )] = item_type
+                else:
+                    select_fields.append( key )
+                    types[key] = value
+
+            res_tables[get_compound_table_name(nesting_list)] = TablePlan(get_compound_table_name(nesting_list),
+                                                                          select_fields, nesting_list, types)
+
+    def link_table_plans(self):
+        """Link every plan with plan of parent array's table"""
+        table_plans_by_path = {}
+        for table_plan in self.helper_structure.itervalues():
+            table_plans_by_path[tuple(table_plan.nesting_list)] = table_plan
+        for table_plan in self.helper_structure.itervalues():
+            if not table_plan.is_base():
+                table_plan.parent = table_plans_by_path[tuple(table_plan.nesting_list[:-1])]
+                table_plan.parent.children.append(table_plan)
+
+    def is_inline_array(self, nesting_list, item_schema):
+        """Array is inlined if it's short enough and its item has no
+        arrays which would need own tables"""
+        if '.'.join(nesting_list[1:]) not in self.inline_arrays:
+            return False
+        if type(item_schema) is list:
+            return False
+        if type(item_schema) is dict:
+            for value in item_schema.itervalues():
+                if type(value) is list:
+                    return False
+        return True
+
+    def get_nested_table_select_items(self, table_name, table_plan):
+        """Select items of fields of nested table's array item, every item
+        starts with delimiter. Returns items and list of (column, type)."""
+        name_component = table_plan.name_component()
+        types = table_plan.types
+        select_items_str = ""
+        columns = []
+        for t in table_plan.select_fields:
+            main_sel_item = ""
+            if type(t) is list:
+                main_sel_item = '.'.join(t)
             else:
-                select_fields.append( key )
-                types[key] = value
-
-        compound_name = ""
-        for i in xrange(len(nesting_list)):
-            nest = nesting_list[i]
-            name = nest[:-1]
-            if len(compound_name) != 0 :
-                compound_name += "-"
-            compound_name += name
-        res_tables[compound_name+'s'] = (select_fields, nesting_list, types)
-
-    def helper_structure_by_name_component(self, name):
-        for table_name, table_struct in self.helper_structure.iteritems():
-            if name == table_name:
-                return table_struct
-        return None
+                main_sel_item = t
+            #handling array item of base data types (not struct)
+            if main_sel_item == artifical_field_name:
+                field_type = types[artifical_field_name]
+                column_name = name_component[:-1]
+                select_items_str += self.sel_item_fmt(expname=name_component, fieldname=None, fieldnameas=column_name, fieldtype=field_type)
+            else:
+                field_type = types[main_sel_item.replace('.', '_')]
+                if self.short_column_names:
+                    column_name = get_column_name(main_sel_item)
+                else:
+                    column_name = table_name[:-1]+"_"+get_column_name(main_sel_item)
+                select_items_str += self.sel_item_fmt(name_component, main_sel_item, 
+                                                      column_name, field_type)
+            columns.append((column_name, field_type))
+        return (select_items_str, columns)
+
+    def get_base_table_select_items(self, table_plan):
+        """Select items of base table's fields and list of (column, type)"""
+        types = table_plan.types
+        select_items_str = ""
+        columns = []
+        for t in table_plan.select_fields:
+            main_sel_item = ""
+            if type(t) is list:
+                main_sel_item = '.'.join(t)
+                as_name = get_column_name(main_sel_item)
+                field_type = types['_'.join(t)]
+                main_sel_item = self.sel_item_fmt(expname=None, fieldname=main_sel_item, fieldnameas=as_name, fieldtype=field_type)
+            else:
+                as_name = get_column_name(t)
+                field_type = types[t]
+                main_sel_item = self.sel_item_fmt(expname=None, fieldname=t, fieldnameas=as_name, fieldtype=field_type)
+            if len(select_items_str):
+                main_sel_item = ',\n'+main_sel_item
+            select_items_str += main_sel_item
+            columns.append((as_name, field_type))
+        return (select_items_str, columns)
+
+    def get_partition_str(self, base_name_component=None):
+        """Expression of partition of base record, record is referred by
+        alias of base table if base name component is specified"""
+        field = '.'.join(self.partition_by[0])
+        if base_name_component is not None:
+            field = base_name_component + '_exp.' + field
+        if self.partition_by[1] == 'objectid':
+            fmt = self.objectid_partition_fmt
+        else:
+            fmt = self.timestamp_partition_fmt
+        return fmt.format(field, self.partition_formats[self.partition_granularity])
+
+    def get_partition_item(self, partition_str):
+        """Select item of partition column, empty if tables aren't partitioned"""
+        if self.partition_by is None:
+            return ""
+        return self.partition_item_fmt.format(partition_str, self.partition_column)
+
+    def get_table_properties(self, table_name, columns):
+        """Custom table properties and storage of storage profile"""
+        table_properties = self.table_custom_properties.replace('{TABLE_NAME}', table_name)
+        if self.storage_profile is None:
+            return table_properties
+        return get_storage_clause(get_storage_settings(self.storage_profile, table_name), columns, table_properties)
+
+    def get_intermediate_storage(self, table_name, columns):
+        """Storage of intermediate table, orc if there is no storage profile"""
+        if self.storage_profile is None:
+            return "STORED AS orc"
+        return get_storage_clause(get_storage_settings(self.storage_profile, table_name), columns, "")
+
+    def get_sort_str(self, table_name):
+        if self.storage_profile is None:
+            return ""
+        sort_by = get_storage_settings(self.storage_profile, table_name).get("sort_by")
+        if not sort_by:
+            return ""
+        return self.sort_by_fmt.format(", ".join(sort_by))
+
+    def get_analyze_str(self, table_name):
+        """Compute statistics of columns of loaded table to be used by
+        planner of joins"""
+        if self.storage_profile is None or \
+                not get_storage_settings(self.storage_profile, table_name)["analyze"]:
+            return ""
+        partition_str = ""
+        if self.partition_by is not None:
+            partition_str = self.insert_partition_fmt.format(self.partition_column)
+        return self.analyze_fmt.format(table_name, partition_str)
+
+    def get_table_script(self, table_name, columns, query_str):
+        """Script creating plain table by query. Partitioned or
+        incrementally loaded table is created with columns and populated
+        by insert, query must select partition column last."""
+        table_properties = self.get_table_properties(table_name, columns)
+        query_str += self.get_sort_str(table_name) + ";" + self.get_analyze_str(table_name)
+        if self.partition_by is None and not self.incremental:
+            return self.create_fmt.format(table_name, table_properties) + query_str
+        return self.get_dynamic_partition_opts() + \
+            self.get_create_columns_str(table_name, columns, table_properties) + \
+            self.get_insert_str(table_name) + query_str
+
+    def get_dynamic_partition_opts(self):
+        if self.partition_by is None:
+            return ""
+        return self.dynamic_partition_opts
+
+    def get_create_columns_str(self, table_name, columns, table_properties):
+        """Create table with explicit columns, incrementally loaded table
+        is created only once"""
+        columns_str = ',\n'.join([self.column_fmt.format(column, column_type) for column, column_type in columns])
+        if self.partition_by is not None:
+            table_properties = self.partitioned_by_fmt.format(self.partition_column) + table_properties
+        if self.incremental:
+            return self.create_if_not_exists_fmt.format(table_name, columns_str, table_properties)
+        return self.create_columns_fmt.format(table_name, columns_str, table_properties)
+
+    def get_insert_str(self, table_name):
+        """Insert into partitions or appending to incrementally loaded table"""
+        mode = "OVERWRITE"
+        if self.incremental:
+            mode = "INTO"
+        partition_str = ""
+        if self.partition_by is not None:
+            partition_str = self.insert_partition_fmt.format(self.partition_column)
+        return self.insert_fmt.format(mode, table_name, partition_str)
+
+    def get_explode_str(self, explode_str, name_component):
+        """Lateral view exploding array, position of item is needed by
+        positional keys"""
+        if self.key_strategy == "row_number":
+            return self.level_explode_fmt.format(explode_str, name_component)
+        return self.level_posexplode_fmt.format(explode_str, name_component)
+
+    def get_base_record_key(self, base_table_plan):
+        """Base record's id as string to be prefix of positional keys"""
+        id_str = self.get_base_record_id(base_table_plan)[0]
+        if id_str.endswith('.oid'):
+            return id_str
+        return "CAST(" + id_str + " AS STRING)"
+
+    def get_item_key(self, parent_key_str, name_component):
+        """Positional key of exploded array item"""
+        return self.composite_key_fmt.format(parent_key_str, name_component)
+
+    def get_output_key(self, key_str):
+        """Key saved into plain table, positional key is hashed by hash
+        strategy, so primary and foreign keys are hashed the same way"""
+        if self.key_strategy == "hash":
+            return self.hash_key_fmt.format(key_str)
+        return key_str
+
+    def get_base_record_id(self, base_table_plan):
+        """Expression selecting id of base table's record and its type"""
+        base_name_component = base_table_plan.name_component()
+        types = base_table_plan.types
+        if not base_table_plan.has_id():
+            return (base_name_component+'_exp.id.oid', types.get('id_oid', 'STRING'))
+        return (base_name_component+'_exp.id', types.get('id', 'STRING'))
 
     def hiveql_gen_nested_plain_tables(self):
-        for table_name, table_struct in self.helper_structure.iteritems():
+        for table_name, table_plan in self.helper_structure.iteritems():
             file_name = table_name
             table_name = table_name.replace('-','_')
             query_str = ""
             select_str = ""
-            name_components = table_struct[1]
-            types = table_struct[2]
+            name_components = table_plan.nesting_list
+            types = table_plan.types
             #skip base table
             if len(name_components) == 1:
                 continue
@@ -299,35 +806,31 @@ class HiveTableGenerator:
                 if name_component_idx+1 < len(name_components):
                     next_name_component = name_components[name_component_idx+1]
 
-                explode_as_str = self.explode_as_fmt.format(prev_name_component, name_component)
+                if self.key_strategy == "row_number":
+                    explode_as_str = self.explode_as_fmt.format(prev_name_component, name_component)
+                else:
+                    explode_as_str = self.posexplode_as_fmt.format(prev_name_component, name_component)
+                    if name_component_idx == 1:
+                        parent_key_str = self.get_base_record_key(table_plan.get_base())
+                    else:
+                        parent_key_str = prev_name_component + "_exp.id"
+                    key_str = self.get_item_key(parent_key_str, name_component)
+                #partition of base record is passed through nested selects
+                partition_str = None
+                if self.partition_by is not None:
+                    if name_component_idx == 1:
+                        partition_str = self.get_partition_str(prev_name_component)
+                    else:
+                        partition_str = prev_name_component + "_exp." + self.partition_column
 
                 if len(next_name_component) == 0:
                     #if main select
-                    select_items_str = ""
-                    for t in table_struct[0]:
-                        main_sel_item = ""
-                        if type(t) is list:
-                            main_sel_item = '.'.join(t)
-                        else:
-                            main_sel_item = t
-                        #handling array item of base data types (not struct)
-                        if main_sel_item == artifical_field_name:
-                            field_type = types[artifical_field_name]
-                            select_items_str += self.sel_item_fmt(expname=name_component, fieldname=None, fieldnameas=name_component[:-1], fieldtype=field_type)
-                        else:
-                            field_type = types[main_sel_item.replace('.', '_')]
-                            if self.short_column_names:
-                                column_name = main_sel_item.replace('.', '_')
-                            else:
-                                column_name = table_name[:-1]+"_"+main_sel_item.replace('.', '_')
-                            select_items_str += self.sel_item_fmt(name_component, main_sel_item, 
-                                                                  column_name, field_type)
+                    select_items_str, columns = self.get_nested_table_select_items(table_name, table_plan)
                     #use special names for foreign,parent columns to prefent name conflicts
                     
-                    #handle situation when foreign key is ObjectId and not just int
-                    prev_table_struct = self.helper_structure_by_name_component(prev_name_component)
-                    if prev_table_struct and \
-                            'id' not in prev_table_struct[0] and '_id' not in prev_table_struct[0]:
+                    #handle situation when foreign key is ObjectId and not just int,
+                    #parent array's items get id by nested select
+                    if table_plan.parent.is_base() and not table_plan.parent.has_id():
                         foreignk_str = self.foreignk_fmt2.format(prev_name_component,
                                                                 "_".join(name_components[:-1]))
                     else:
@@ -335,7 +838,18 @@ class HiveTableGenerator:
                                                                 "_".join(name_components[:-1]))
                     pk_str = self.primaryk_fmt.format( prev_name_component,
                                                        "_".join(name_components)+"_id" )
-                    select_str = self.select_fmt.format(pk_str, foreignk_str, select_items_str)
+                    fk_type = self.key_type
+                    if name_component_idx == 1:
+                        fk_type = self.get_base_record_id(table_plan.parent)[1]
+                    if self.key_strategy != "row_number":
+                        pk_str = self.get_output_key(key_str) + " AS " + "_".join(name_components)+"_id"
+                        if name_component_idx > 1:
+                            foreignk_str = self.level_foreignk_fmt.format(self.get_output_key(parent_key_str),
+                                                                          "_".join(name_components[:-1]))
+                    columns = [("_".join(name_components)+"_id", self.key_type),
+                               ("_".join(name_components[:-1])+"_id", fk_type)] + columns
+                    select_str = self.select_fmt.format(pk_str, foreignk_str,
+                                                        select_items_str + self.get_partition_item(partition_str))
                 else:
                     #if nested selects
                     #handling array item of base data types (not struct)
@@ -344,18 +858,20 @@ class HiveTableGenerator:
                         select_exp_str = self.sel_item_fmt(expname=name_component, fieldname=None, 
                                                            fieldnameas=name_component[:-1], fieldtype=field_type)
                     else:
+                        #selected field is array, so it's never translated as string
                         select_exp_str = self.sel_item_fmt(name_component, next_name_component, 
-                                                           next_name_component, field_type)
+                                                           next_name_component, None)
                     pk_str = self.primaryk_fmt.format( prev_name_component, "id" )
-                    select_str = self.select_fmt.format(pk_str, select_exp_str, "")
+                    if self.key_strategy != "row_number":
+                        pk_str = key_str + " AS id"
+                    select_str = self.select_fmt.format(pk_str, select_exp_str, self.get_partition_item(partition_str))
                 if len(query_str) == 0:
                     query_str = select_str + self.ext_table_name
                 else:
                     query_str = select_str + "("+query_str+")"
                 query_str += "\n" + explode_as_str
-            query_str += ";"
 
-            complete_script = self.create_fmt.format(table_name, self.table_custom_properties.replace('{TABLE_NAME}', table_name))+query_str
+            complete_script = self.get_table_script(table_name, columns, query_str)
             with open(self.tables_folder_name+"/"+file_name+".sql", 'w') as plain_table_file:
                 plain_table_file.write(self.hive_opts)
                 plain_table_file.write(complete_script)
@@ -363,35 +879,182 @@ class HiveTableGenerator:
                 message(plain_table_file.name)
 
     def hiveql_gen_base_plain_table(self):
-        for table_name, table_struct in self.helper_structure.iteritems():
-            name_components = table_struct[1]
-            types = table_struct[2]
+        for table_name, table_plan in self.helper_structure.iteritems():
             #skip all nested structures
-            if len(name_components) > 1:
+            if not table_plan.is_base():
                 continue
-            select_items_str = ""
-            for t in table_struct[0]:
-                main_sel_item = ""
-                if type(t) is list:
-                    main_sel_item = '.'.join(t)
-                    as_name = main_sel_item.replace('.', '_')
-                    field_type = types[as_name]
-                    main_sel_item = self.sel_item_fmt(expname=None, fieldname=main_sel_item, fieldnameas=as_name, fieldtype=field_type)
-                else:
-                    field_type = types[t]
-                    main_sel_item = self.sel_item_fmt(expname=None, fieldname=t, fieldnameas=t, fieldtype=field_type)
-                if len(select_items_str):
-                    main_sel_item = ',\n'+main_sel_item
-                select_items_str += main_sel_item
-            select_str = self.select_fmt.format(select_items_str, "", "")
-            query_str = select_str + self.ext_table_name + ';'
-            complete_script = self.create_fmt.format(table_name, self.table_custom_properties.replace('{TABLE_NAME}', table_name))+query_str
+            select_items_str, columns = self.get_base_table_select_items(table_plan)
+            partition_item_str = ""
+            if self.partition_by is not None:
+                partition_item_str = self.get_partition_item(self.get_partition_str())
+            select_str = self.select_fmt.format(select_items_str, partition_item_str, "")
+            query_str = select_str + self.ext_table_name
+            complete_script = self.get_table_script(table_name, columns, query_str)
             with open(self.tables_folder_name+"/"+table_name+".sql", 'w') as plain_table_file:
                 plain_table_file.write(self.hive_opts)
                 plain_table_file.write(complete_script)
                 plain_table_file.close()
                 message(plain_table_file.name)
 
+    def get_tables_in_topological_order(self):
+        """Names of tables of helper structure, every table goes after
+        table of its parent array"""
+        children = {}
+        for table_name, table_plan in self.helper_structure.iteritems():
+            if len(table_plan.children):
+                children[table_name] = [child.name for child in table_plan.children]
+        ordered = []
+        queue = sorted([table_name for table_name, table_plan in self.helper_structure.iteritems()
+                        if table_plan.is_base()])
+        while len(queue):
+            table_name = queue.pop(0)
+            ordered.append(table_name)
+            queue.extend(sorted(children.get(table_name, [])))
+        return (ordered, children)
+
+    def hiveql_gen_nested_tables_by_levels(self):
+        """Generate nested plain tables from materialized explode levels:
+        array which has nested arrays is exploded once into level table
+        and both its plain table and nested levels are selected from it.
+        Scripts are generated in topological order, order is saved into
+        scripts_order.txt. Level table is dropped by script of its last
+        nested table."""
+        ordered, children = self.get_tables_in_topological_order()
+        #level table of parent array is read by scripts of its children
+        last_children = {}
+        for file_name in ordered:
+            parent = self.helper_structure[file_name].parent
+            if parent is not None and not parent.is_base():
+                last_children[parent.name] = file_name
+        scripts = []
+        for file_name in ordered:
+            table_plan = self.helper_structure[file_name]
+            table_name = file_name.replace('-','_')
+            name_components = table_plan.nesting_list
+            #skip base table
+            if len(name_components) == 1:
+                scripts.append(file_name)
+                continue
+            prev_name_component = name_components[-2]
+            name_component = name_components[-1]
+            if len(name_components) == 2:
+                #first level is exploded from external table
+                source_str = self.ext_table_name + " " + prev_name_component + "_exp"
+                parent_id_str, fk_type = self.get_base_record_id(table_plan.parent)
+                parent_key_str = self.get_base_record_key(table_plan.parent)
+                order_str = prev_name_component + "_exp.id"
+                explode_str = prev_name_component + "_exp." + name_component
+                partition_str = None
+                if self.partition_by is not None:
+                    partition_str = self.get_partition_str(prev_name_component)
+            else:
+                parent_level = table_plan.parent.name.replace('-','_') + "_level"
+                source_str = parent_level + " " + prev_name_component + "_level"
+                parent_id_str = prev_name_component + "_level.id"
+                fk_type = self.key_type
+                parent_key_str = parent_id_str
+                order_str = parent_id_str
+                explode_str = prev_name_component + "_level." + prev_name_component + "_exp." + name_component
+                partition_str = prev_name_component + "_level." + self.partition_column
+            pk_name = "_".join(name_components)+"_id"
+            select_items_str, columns = self.get_nested_table_select_items(table_name, table_plan)
+            columns = [(pk_name, self.key_type), ("_".join(name_components[:-1])+"_id", fk_type)] + columns
+            key_str = "row_number() OVER(ORDER BY " + order_str + ")"
+            if self.key_strategy != "row_number":
+                key_str = self.get_item_key(parent_key_str, name_component)
+            level_str = ""
+            if file_name in children:
+                level_name = table_name + "_level"
+                level_str = self.level_table_fmt.format(level_name, key_str + " AS id",
+                                                        parent_id_str, name_component, source_str,
+                                                        self.get_explode_str(explode_str, name_component),
+                                                        self.get_partition_item(partition_str),
+                                                        self.get_intermediate_storage(level_name, [("id", None), ("parent_id", None)]))
+                #level 1 parent_id is base record's id which is not hashed
+                parent_id_str = "parent_id"
+                if len(name_components) > 2:
+                    parent_id_str = self.get_output_key(parent_id_str)
+                select_str = self.select_fmt.format(self.get_output_key("id") + " AS " + pk_name,
+                                                    self.level_foreignk_fmt.format(parent_id_str, "_".join(name_components[:-1])),
+                                                    select_items_str + self.get_partition_item(self.partition_column))
+                query_str = select_str + level_name
+            else:
+                if len(name_components) > 2:
+                    parent_id_str = self.get_output_key(parent_id_str)
+                select_str = self.select_fmt.format(self.get_output_key(key_str) + " AS " + pk_name,
+                                                    self.level_foreignk_fmt.format(parent_id_str, "_".join(name_components[:-1])),
+                                                    select_items_str + self.get_partition_item(partition_str))
+                query_str = select_str + source_str + self.get_explode_str(explode_str, name_component)
+
+            complete_script = level_str + self.get_table_script(table_name, columns, query_str)
+            if len(name_components) > 2 and last_children[table_plan.parent.name] == file_name:
+                complete_script += self.drop_level_fmt.format(table_plan.parent.name.replace('-','_') + "_level")
+            with open(self.tables_folder_name+"/"+file_name+".sql", 'w') as plain_table_file:
+                plain_table_file.write(self.hive_opts)
+                plain_table_file.write(complete_script)
+                plain_table_file.close()
+                message(plain_table_file.name)
+            scripts.append(file_name)
+        with open(self.tables_folder_name+"/scripts_order.txt", 'w') as order_file:
+            for file_name in scripts:
+                order_file.write(file_name+".sql\n")
+
+    def hiveql_gen_multi_insert(self):
+        """Generate one script creating all plain tables and populating
+        them by multi-insert, so external table is scanned only once.
+        Every nested table refers to base table's record. Insert of
+        multi-insert can have only one lateral view, so tables nested
+        deeper than one level are not supported."""
+        for table_plan in self.helper_structure.itervalues():
+            if len(table_plan.nesting_list) > 2:
+                raise Exception("Multi-insert of nested arrays is not supported", table_plan.name)
+        create_str = self.get_dynamic_partition_opts()
+        insert_str = ""
+        analyze_str = ""
+        base_name_component = None
+        base_file_name = None
+        for table_name, table_plan in sorted(self.helper_structure.iteritems()):
+            file_name = table_name
+            table_name = table_name.replace('-','_')
+            name_components = table_plan.nesting_list
+            base_name_component = name_components[0]
+            if len(name_components) == 1:
+                base_file_name = file_name
+                select_items_str, columns = self.get_base_table_select_items(table_plan)
+                lateral_views_str = ""
+            else:
+                select_items_str, columns = self.get_nested_table_select_items(table_name, table_plan)
+                id_str, id_type = self.get_base_record_id(table_plan.parent)
+                name_component = name_components[1]
+                pk_name = "_".join(name_components)+"_id"
+                fk_name = base_name_component+"_id"
+                if self.key_strategy == "row_number":
+                    pk_str = self.primaryk_fmt.format(base_name_component, pk_name)
+                    lateral_views_str = self.lateral_view_fmt.format(base_name_component, name_component)
+                else:
+                    key_str = self.get_item_key(self.get_base_record_key(table_plan.parent), name_component)
+                    pk_str = self.get_output_key(key_str) + " AS " + pk_name
+                    lateral_views_str = self.get_explode_str(base_name_component + "_exp." + name_component,
+                                                             name_component)
+                select_items_str = pk_str + ",\n" + self.select_item_fmt2.format(id_str, fk_name) + select_items_str
+                columns = [(pk_name, self.key_type), (fk_name, id_type)] + columns
+            if self.partition_by is not None:
+                select_items_str += self.get_partition_item(self.get_partition_str(base_name_component))
+            create_str += self.get_create_columns_str(table_name, columns,
+                                                      self.get_table_properties(table_name, columns))
+            insert_str += self.multi_insert_fmt.format(self.get_insert_str(table_name), select_items_str,
+                                                       lateral_views_str + self.get_sort_str(table_name))
+            analyze_str += self.get_analyze_str(table_name)
+        if base_file_name is None:
+            base_file_name = base_name_component
+        complete_script = create_str + \
+            self.multi_from_fmt.format(self.ext_table_name, base_name_component) + insert_str + ";" + analyze_str
+        with open(self.tables_folder_name+"/"+base_file_name+"_multi_insert.sql", 'w') as plain_table_file:
+            plain_table_file.write(self.hive_opts)
+            plain_table_file.write(complete_script)
+            plain_table_file.close()
+            message(plain_table_file.name)
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -401,8 +1064,12 @@ if __name__ == "__main__":
                         help="Input file with json schema, (stdin by default)", type=file)
     parser.add_argument("-od", "--output-dir", help="Directory to save hiveql scripts", type=str)    
     parser.add_argument("-fexclude", action="store",
-                        help="Input file with list of branches to exclude, see 'ofb' option", type=file)
-    parser.add_argument("-output-branches", action="store", help="Output file with list of all branches", type=argparse.FileType('w'))
+                        help="Input file with list of branches to exclude, see 'ofb' option. Branches can be \
+patterns like '*.audit' or 'history.**'", type=file)
+    parser.add_argument("-finclude", action="store",
+                        help="Input file with list of branches (or patterns) to include", type=file)
+    parser.add_argument("-output-branches", action="store", help="Output file with list of all branches \
+left after -fexclude and -finclude", type=argparse.FileType('w'))
     parser.add_argument("-table-custom-properties",
                         help="Optional hive's table properties like ROW FORMAT, STORED AS, LOCATION.\
 Will substitute substring {TABLE_NAME} if provided by real table name", 
@@ -414,9 +1081,37 @@ Will substitute substring {TABLE_NAME} if provided by real table name",
     parser.add_argument("-big-table-optimization",
                         help="If specified then intermediate native table will be created", action='store_true')
     parser.add_argument("-short-column-names", help="If specified then short column names will be used", action='store_true')
+    parser.add_argument("-partition-by", help="Partition all plain tables by creation time of ObjectId branch \
+(like _id) or by TIMESTAMP branch of base record", type=str)
+    parser.add_argument("-partition-granularity", help="Partitions of -partition-by, default=%(default)s",
+                        choices=["daily", "monthly"], default="daily")
+    parser.add_argument("-incremental-by", help="Append records having greater value of ObjectId, TIMESTAMP or number \
+branch (like _id) than watermark passed by -hiveconf watermark=<value>, instead of recreating tables", type=str)
+    parser.add_argument("-key-strategy", help="Keys of nested tables: row_number ordered by parent's id (single reducer), \
+posexplode - parent's key and array position, hash - md5 of posexplode key, default=row_number \
+(posexplode with -incremental-by)", choices=HiveTableGenerator.key_strategies)
+    parser.add_argument("-storage-profile", action="store", help="Input file with json storage profile: \
+'default' and per table ('tables') format, compression, stripe_size (of orc stripe or parquet row group), sort_by, bloom_filters, \
+bloom_filter_fpp, bloom_filter_keys (on *_id columns, default true), analyze (compute column statistics, default true)",
+                        type=file)
+    parser.add_argument("-field-stats", action="store", help="Input file with statistics of values saved by \
+get_mongo_schema_as_json.py --stats-file, it's used to narrow types of columns to SMALLINT and VARCHAR(n), \
+to widen INT to BIGINT and to drop branches having no values", type=file)
+    parser.add_argument("-min-presence-rate", help="Branches having non null value in not more than this rate \
+of records are dropped if -field-stats is specified, default=%(default)s", type=float, default=0.0)
+    parser.add_argument("-inline-arrays-max-length", help="Arrays never longer than this length according to \
+-field-stats are selected as indexed columns (<field>_0, <field>_1, ...) of parent table instead of own tables",
+                        type=int)
+    parser.add_argument("-materialize-levels", help="If specified then every array having nested arrays is exploded \
+once into intermediate level table and nested plain tables are selected from it", action='store_true')
+    parser.add_argument("-multi-insert", help="If specified then single script creating all plain tables and \
+populating them by multi-insert from one scan of external table will be generated", action='store_true')
+    parser.add_argument("-metrics-file", help="Output file with metrics encoded as json", type=str)
+    parser.add_argument("-profile", help="Output file with cProfile stats", type=str)
 
 
     args = parser.parse_args()
+    metrics = Metrics(profile_file_name=args.profile)
 
     if args.table_name == None or args.mongouri == None or args.output_dir == None:
         parser.print_help()
@@ -426,24 +1121,80 @@ Will substitute substring {TABLE_NAME} if provided by real table name",
         args.input_file_schema = sys.stdin
         message( "using stdin to read schema in json format")
 
+    if args.multi_insert and args.materialize_levels:
+        message("-multi-insert can't be used together with -materialize-levels")
+        exit(1)
+
+    if args.inline_arrays_max_length is not None and args.field_stats is None:
+        message("-inline-arrays-max-length requires -field-stats")
+        exit(1)
+
+    if args.incremental_by is not None and args.key_strategy == "row_number":
+        message("-incremental-by can't be used with -key-strategy row_number, keys would restart on every load")
+        exit(1)
+
     if args.table_custom_properties == None:
         args.table_custom_properties = ""
 
     ext_table_name = 'mongo'+args.table_name
+    partition_by = None
+    input_query = watermark_select = ""
+    storage_profile = None
+    if args.storage_profile is not None:
+        storage_profile = load_storage_profile(args.storage_profile)
 
-    schema = json.load(args.input_file_schema)
-    schema_branches=get_branches_from_schema_recursively(schema)
+    t = time.time()
+    schema = intern_schema_types(json.load(args.input_file_schema))
+    metrics.add_time('load', time.time() - t)
+    if args.partition_by is not None:
+        partition_by = get_partition_by(schema, args.partition_by)
+    if args.incremental_by is not None:
+        input_query, watermark_select = get_watermark_query(schema, args.incremental_by)
+        input_query = ",\n'mongo.input.query'='" + input_query + "'"
+    t = time.time()
+    schema_branches = get_schema_branches(schema, empty_struct_as_branch=False)
+    metrics.add('branches', len(schema_branches))
+
+    include_branches = exclude_branches = None
+    if args.finclude != None:
+        include_branches = read_branches_file(args.finclude)
+    if args.fexclude != None:
+        exclude_branches = read_branches_file(args.fexclude)
+    if include_branches or exclude_branches:
+        branch_filter = BranchFilter(include_branches, exclude_branches)
+        branch_filter.prune_schema(schema)
+        for pattern in branch_filter.get_unmatched_exclude_patterns():
+            message("can't exclude branch="+pattern+" as not located")
 
     if args.output_branches != None:
-        for item in schema_branches:
+        for item in get_schema_branches(schema, empty_struct_as_branch=False):
             args.output_branches.writelines(item+'\n')
 
-    if args.fexclude != None:
-        exclude_branches_list = []
-        for line in args.fexclude:
-            exclude_branches_list.append(line.strip())
-        exclude_branches_structure = get_exclude_branches_structure(exclude_branches_list)
-        remove_excluded_branches_from_schema(schema, exclude_branches_structure)
+    field_stats = inline_arrays = None
+    if args.field_stats != None:
+        field_stats = json.load(args.field_stats)
+    if field_stats is not None and field_stats.get("sampled"):
+        #values out of range of sample would be truncated by narrowed types
+        message("-field-stats are collected from sample of records, types are not narrowed, \
+branches are not dropped and arrays are not inlined")
+    elif field_stats is not None:
+        empty_branches = apply_field_stats(schema, field_stats, args.min_presence_rate)
+        if len(empty_branches):
+            message("Dropped branches having no values: "+', '.join(sorted(empty_branches)))
+            BranchFilter(exclude_patterns=empty_branches, exact=True).prune_schema(schema)
+        metrics.add('dropped_branches', len(empty_branches))
+        if args.inline_arrays_max_length is not None:
+            inline_arrays = get_inline_arrays(field_stats, args.inline_arrays_max_length)
+    metrics.add_time('prepare', time.time() - t)
+
+    #insert of multi-insert can have only one lateral view
+    if args.multi_insert and has_nested_arrays(schema):
+        message("-multi-insert can't be used for schema having nested arrays, use -materialize-levels instead")
+        exit(1)
+    if args.key_strategy is None:
+        args.key_strategy = "row_number"
+        if args.incremental_by is not None:
+            args.key_strategy = "posexplode"
 
     hive_mongo_opts = hive_opts = ""
     if args.fhive_opts is not None:
@@ -453,7 +1204,9 @@ Will substitute substring {TABLE_NAME} if provided by real table name",
 
     keys_mapping = create_keys_mapping(schema_branches)
     #rewrite current schema after getting keys mapping, it's used original names of fields
-    schema = get_canonical_hive_schema_recursively(schema)
+    t = time.time()
+    schema = get_canonical_hive_schema(schema)
+    metrics.add_time('prepare', time.time() - t)
 
     tables_folder_name = args.output_dir
     if os.path.isdir(tables_folder_name) == True:
@@ -463,24 +1216,44 @@ Will substitute substring {TABLE_NAME} if provided by real table name",
     #generate native flat tables
     message('Saved plain tables: ')
 
+    t = time.time()
     if args.big_table_optimization:
         hive_gen = HiveTableGenerator(schema, ext_table_name, args.table_name, tables_folder_name, 
                                       args.table_custom_properties, hive_opts,
-                                      args.short_column_names)
+                                      args.short_column_names, partition_by, args.partition_granularity,
+                                      args.incremental_by is not None, args.key_strategy, storage_profile,
+                                      inline_arrays)
     else:
         hive_gen = HiveTableGenerator(schema, ext_table_name, args.table_name, tables_folder_name, 
                                       args.table_custom_properties, hive_mongo_opts+hive_opts, 
-                                      args.short_column_names)
-    hive_gen.hiveql_gen_nested_plain_tables()
-    hive_gen.hiveql_gen_base_plain_table()
+                                      args.short_column_names, partition_by, args.partition_granularity,
+                                      args.incremental_by is not None, args.key_strategy, storage_profile,
+                                      inline_arrays)
+    if args.multi_insert:
+        hive_gen.hiveql_gen_multi_insert()
+    elif args.materialize_levels:
+        hive_gen.hiveql_gen_nested_tables_by_levels()
+        hive_gen.hiveql_gen_base_plain_table()
+    else:
+        hive_gen.hiveql_gen_nested_plain_tables()
+        hive_gen.hiveql_gen_base_plain_table()
+    metrics.add_time('plain_tables', time.time() - t)
+    metrics.add('tables', len(hive_gen.helper_structure))
+
+    if args.incremental_by is not None:
+        base_table_name = get_compound_table_name([args.table_name])
+        with open(tables_folder_name+'/'+base_table_name+'_watermark.sql', 'w') as watermark_file:
+            watermark_file.write(watermark_select.format(base_table_name))
+            watermark_file.close()
+            message(watermark_file.name)
 
     #generate external nested table
-    table_schema  = generate_external_hive_table(0, schema)
+    t = time.time()
     templ_dict = {"mongouri"   : args.mongouri,
                   "table_name" : ext_table_name,
-                  "schema"     : table_schema,
-                  "mappings"   : str(keys_mapping).replace("'", '"') }
-    external_table = ""
+                  "mappings"   : str(keys_mapping).replace("'", '"'),
+                  "input_query": input_query,
+                  "intermediate_storage": hive_gen.get_intermediate_storage(ext_table_name, []) }
 
     #depending on parameter will be chosed one or another template file
     template_fname="template.txt"
@@ -489,16 +1262,31 @@ Will substitute substring {TABLE_NAME} if provided by real table name",
 
     with open(os.path.dirname(os.path.abspath(__file__))+'/'+template_fname, 'r') as templ_file:
         templ_str = templ_file.read()
-        external_table = templ_str % templ_dict
         templ_file.close()
 
+    #incrementally loaded table gets also script of first load without watermark
+    ext_table_scripts = [(ext_table_name, input_query)]
+    if args.incremental_by is not None:
+        ext_table_scripts.append((ext_table_name+'_initial', ""))
+
     message('Saved external table: ')
-    with open(tables_folder_name+'/'+ext_table_name+'.sql', 'w') as ext_table_file:
-        #write hive mongodb options
-        ext_table_file.write(hive_mongo_opts)
-        if args.big_table_optimization:
-            #hive options needed for heavy intermediate table
-            ext_table_file.write(hive_opts)
-        ext_table_file.write(external_table)
-        ext_table_file.close()
-        message(ext_table_file.name)
+    for script_name, script_input_query in ext_table_scripts:
+        templ_dict["input_query"] = script_input_query
+        with open(tables_folder_name+'/'+script_name+'.sql', 'w') as ext_table_file:
+            #write hive mongodb options
+            ext_table_file.write(hive_mongo_opts)
+            if args.big_table_optimization:
+                #hive options needed for heavy intermediate table
+                ext_table_file.write(hive_opts)
+            if script_input_query:
+                ext_table_file.write(watermark_guard_str)
+            #schema is streamed into file in place of its placeholder
+            templ_parts = templ_str.split('%(schema)s')
+            for i in xrange(len(templ_parts)):
+                if i > 0:
+                    write_external_hive_table(ext_table_file, schema)
+                ext_table_file.write(templ_parts[i] % templ_dict)
+            ext_table_file.close()
+            message(ext_table_file.name)
+    metrics.add_time('external_table', time.time() - t)
+    metrics.finish(args.metrics_file)
@@ -4,72 +4,503 @@
 corresponding to read data. Export schema as json."""
 
 import sys
+import os
+import collections
 import json
+import time
+import mmap
+import struct
+import hashlib
+import base64
+import zlib
 import argparse
 import bson
+from bson import json_util
+from bson.raw_bson import RawBSONDocument
+from bson.codec_options import CodecOptions
 import datetime
+import random
+import math
+import uuid
+import itertools
+import multiprocessing
 import pymongo
 from pymongo.mongo_client import MongoClient
+from schema_tree import map_schema_types, merge_serialized_schemas
+from metrics import Metrics, SharedProgress
+from schema_cache import SchemaCache, get_cache_key, default_schema_cache_size
+from branch_filter import BranchFilter, read_branches_file, get_exact_branch
+
+default_shape_cache_size = 1024
+#shape cache is disabled if after this count of lookups
+#less than half of them were hits
+shape_cache_probe_count = 1000
 
 def message(mes, cr='\n'):
     sys.stderr.write( mes + cr)
 
-def assign_val_to_schema_key(val, schema, key):
-    if type(val) is type:
-        schema[key] = val
-    elif type(val) is list and len(val)>0 and val[0] is not type(None):
-        schema[key] = val
-    elif type(schema[key]) == None or type(schema[key]) == type(None) or \
-            ( (type(schema[key]) is dict or type(schema[key]) is list) \
-                  and len(val) >= len(schema[key]) ) :
-        if val is not type(None) or schema[key] == None or type(schema[key]) == type(None):
-            schema[key] = val
-
-def get_mongo_collection_schema(source_data, schema):
-    if type(source_data) is dict:
-        if type(schema) is not dict:
+class FoldState(object):
+    """State of folding of records into schema: count of changes made
+    to schema and, if set, shapes of subdocuments folded without changes
+    mapped to count of changes at that moment, schema node and keys of
+    values to fold anyway (see RecordShapeCache)"""
+    __slots__ = ('changes', 'shapes', 'hits', 'misses', 'raw_keys')
+
+    def __init__(self, shapes=None):
+        self.changes = 0
+        self.shapes = shapes
+        self.hits = 0
+        self.misses = 0
+        #decoded keys of raw bson by raw keys
+        self.raw_keys = {}
+
+#python types of numbers in order of widening, see widen_scalar_types
+#of schema_tree for the same rules applied to serialized types
+numeric_value_types = [int, bson.int64.Int64, float]
+objectid_type = bson.objectid.ObjectId
+#ObjectId is folded as struct of its synthetic fields
+objectid_struct = {u'oid': u'', u'bsontype': 7}
+
+def widen_value_types(prev_type, value_type):
+    """Type able to hold values of both types, null takes other type,
+    numbers are widened, other conflicting types become string"""
+    if value_type is type(None):
+        return prev_type
+    elif prev_type is type(None):
+        return value_type
+    elif prev_type in numeric_value_types and value_type in numeric_value_types:
+        return numeric_value_types[max(numeric_value_types.index(prev_type), numeric_value_types.index(value_type))]
+    return unicode
+
+def folds_unchanged(schema, value_type):
+    """True if scalar of value_type folds into scalar schema without
+    changing it, float is int or double by value"""
+    if type(schema) is not type:
+        return False
+    if value_type is float:
+        return schema is float or schema is unicode
+    return value_type is schema or widen_value_types(schema, value_type) is schema
+
+def is_struct_value(value):
+    """Value having struct or array schema, other values are scalars
+    skipped on the way to included branches"""
+    t = type(value)
+    return t is dict or t is list or t is bson.objectid.ObjectId
+
+def get_mongo_collection_schema(source_data, schema, branch_state=None, fold_state=None):
+    """Fold record into schema, if state of branch filter is set then
+    filtered out subtrees are skipped without descending into them.
+    Changes of schema are counted by fold_state if it's set."""
+    if fold_state is None:
+        fold_state = FoldState()
+    return fold_value(source_data, schema, branch_state, fold_state)
+
+def fold_value(source_data, schema, branch_state, fold_state):
+    """Fold value into its schema (None if there is no schema yet) by the
+    same rules as merge_serialized_schemas: array wins over struct, struct
+    wins over scalar, conflicting scalars are widened. So schema doesn't
+    depend on order of records and on split of them into ranges. Nested
+    schemas are changed in place, recursion is bounded by nesting limit of
+    bson documents (100)"""
+    value_type = type(source_data)
+    if value_type is objectid_type:
+        source_data = objectid_struct
+        value_type = dict
+    if value_type is dict:
+        schema_type = type(schema)
+        if schema_type is list:
+            return schema
+        elif schema_type is not dict:
             schema = {}
-        for key in source_data:
-            nested_schema = {}
-            #add to schema
-            if ( schema.get(key) == None ):
-                schema[key] = {}
+        keys = source_data
+        shapes = fold_state.shapes
+        if shapes is not None:
+            #shape of subdocument is built by builtins, not walked
+            shape = (id(schema), branch_state, tuple(source_data), tuple(map(type, source_data.itervalues())))
+            known = shapes.get(shape)
+            if known is not None and known[0] == fold_state.changes and known[1] is schema:
+                fold_state.hits += 1
+                keys = known[2]
+                #most recently used shape goes last
+                del shapes[shape]
+                shapes[shape] = known
             else:
-                nested_schema = schema[key]
-            tmp_schema = get_mongo_collection_schema(source_data[key], nested_schema)
-            assign_val_to_schema_key(tmp_schema, schema, key)
-
-            #if key == 'associated_item_ids':
-            #    print key, schema[key], tmp_schema
-    elif type(source_data) is list:
-        if type(schema) is list:
-            schema_as_list = schema
-        else:
-            schema_as_list = [schema]
-        nested_schema = schema_as_list
+                fold_state.misses += 1
+                changes = fold_state.changes
+        nested_state = branch_state
+        for key in keys:
+            if branch_state is not None:
+                nested_state = branch_state.child(key)
+                if nested_state is None or (nested_state.partial and not is_struct_value(source_data[key])):
+                    continue
+            prev = schema.get(key)
+            nested_schema = fold_value(source_data[key], prev, nested_state, fold_state)
+            #nested schema is mostly the same object changed in place
+            if nested_schema is not prev:
+                schema[key] = nested_schema
+                fold_state.changes += 1
+        if shapes is not None and keys is source_data and fold_state.changes == changes:
+            #scalars of the same types are folded into the same schema
+            #without changes again, only values of nested schemas and
+            #floats which may change it by value are folded on hit
+            folded_keys = []
+            for key, value in source_data.iteritems():
+                t = type(value)
+                if t is dict or t is list or (t is float and not folds_unchanged(schema.get(key), t)):
+                    folded_keys.append(key)
+            #node is kept by cache, so its id is not reused by other node
+            shapes[shape] = (changes, schema, folded_keys)
+    elif value_type is list:
+        schema_type = type(schema)
+        if fold_state.shapes is not None and schema_type is list and type(schema[0]) is type:
+            #shape of array of scalars is set of types of items
+            for item_type in set(map(type, source_data)):
+                if item_type is dict or item_type is list or item_type is objectid_type \
+                        or not folds_unchanged(schema[0], item_type):
+                    fold_state.misses += 1
+                    break
+            else:
+                fold_state.hits += 1
+                return schema
+        item_schema = prev = None
+        if schema_type is list:
+            item_schema = prev = schema[0]
         for item in source_data:
-            nested_schema[0] = get_mongo_collection_schema(item, nested_schema[0])
-        #trying to resolve conflicts automatically
-        if type(nested_schema[0]) == dict and len(nested_schema[0]) == 0:
-            nested_schema = type(None)
-        elif type(schema_as_list[0]) is dict and type(nested_schema[0]) is dict \
-                and len(schema_as_list)>len(nested_schema):
-            nested_schema = schema_as_list
-        schema = nested_schema
+            if branch_state is not None and branch_state.partial and not is_struct_value(item):
+                continue
+            item_schema = fold_value(item, item_schema, branch_state, fold_state)
+        schema = fold_array_item(schema, item_schema, prev, fold_state)
     else:
-        if type(source_data) is float:
-            if (source_data - int(source_data)) > 0:
-                schema = float
-            else:
-                schema = int
-        elif type(source_data) is bson.objectid.ObjectId:
-                schema = { 'oid': str, 'bsontype': int }
+        if value_type is float:
+            value_type = get_scalar_type(source_data)
+        schema = fold_scalar_type(value_type, schema)
+    return schema
+
+def get_scalar_type(value):
+    """Type that inference derives for scalar value, float is int or
+    double by value"""
+    t = type(value)
+    if t is float and (value - int(value)) <= 0:
+        return int
+    return t
+
+def fold_scalar_type(value_type, schema):
+    """Fold scalar of value_type into its schema"""
+    schema_type = type(schema)
+    if schema_type is dict or schema_type is list:
+        #struct or array is not replaced by scalar, as by merge of schemas
+        return schema
+    if schema_type is type and schema is not value_type:
+        return widen_value_types(schema, value_type)
+    return value_type
+
+def fold_array_item(schema, item_schema, prev, fold_state):
+    """Fold array having items folded into item_schema (starting from
+    prev, item of schema if it's array) into schema"""
+    if item_schema is None or (type(item_schema) is dict and len(item_schema) == 0):
+        #array of no items or of empty structs is folded as null,
+        #conflicts of its items are not resolved into item schema
+        return fold_scalar_type(type(None), schema)
+    if type(schema) is list:
+        if item_schema is not prev:
+            schema[0] = item_schema
+            fold_state.changes += 1
+        return schema
+    return [item_schema]
+
+unpack_int32 = struct.Struct('<i').unpack_from
+unpack_int64 = struct.Struct('<q').unpack_from
+unpack_double = struct.Struct('<d').unpack_from
+#sizes of bson values of fixed size by type
+raw_value_sizes = {'\x01': 8, '\x06': 0, '\x07': 12, '\x08': 1, '\x09': 8, '\x0a': 0, '\x10': 4,
+                   '\x11': 8, '\x12': 8, '\x13': 16, '\x7f': 0, '\xff': 0}
+
+def get_raw_value_end(data, t, pos):
+    """Offset after bson value of type t starting at pos, None for
+    unknown type"""
+    if t in raw_value_sizes:
+        return pos + raw_value_sizes[t]
+    elif t == '\x02' or t == '\x0d' or t == '\x0e':
+        return pos + 4 + unpack_int32(data, pos)[0]
+    elif t == '\x03' or t == '\x04' or t == '\x0f':
+        return pos + unpack_int32(data, pos)[0]
+    elif t == '\x05':
+        return pos + 5 + unpack_int32(data, pos)[0]
+    elif t == '\x0b':
+        return data.index('\x00', data.index('\x00', pos) + 1) + 1
+    elif t == '\x0c':
+        return pos + 16 + unpack_int32(data, pos)[0]
+    return None
+
+#python types of decoded values of bson scalar types read by type only
+raw_scalar_types = {'\x02': unicode, '\x10': int, '\x12': bson.int64.Int64, '\x08': bool,
+                    '\x09': datetime.datetime, '\x0a': type(None)}
+#count of decoded keys of raw bson to remember
+max_raw_keys = 10000
+#bson types of documents, arrays and ObjectId
+raw_struct_types = frozenset(['\x03', '\x04', '\x07'])
+
+def fold_raw_value(data, t, pos, end, schema, branch_state, fold_state):
+    """Fold bson value of type t at pos..end of buffer into its schema by
+    the same rules as fold_value, values are not decoded"""
+    value_type = raw_scalar_types.get(t)
+    if value_type is not None:
+        return fold_scalar_type(value_type, schema)
+    elif t == '\x03':
+        return fold_raw_document(data, pos, schema, branch_state, fold_state)
+    elif t == '\x04':
+        return fold_raw_array(data, pos, schema, branch_state, fold_state)
+    elif t == '\x01':
+        value = unpack_double(data, pos)[0]
+        if (value - int(value)) > 0:
+            return fold_scalar_type(float, schema)
+        return fold_scalar_type(int, schema)
+    elif t == '\x07':
+        return fold_value(objectid_struct, schema, branch_state, fold_state)
+    elif t == '\x05' and (data[pos+4] == '\x03' or data[pos+4] == '\x04'):
+        #binary of uuid subtypes is decoded as uuid
+        return fold_scalar_type(uuid.UUID, schema)
+    elif t == '\x05':
+        return fold_scalar_type(bson.binary.Binary, schema)
+    #rare types are decoded as element of document with empty key
+    value = bson.BSON(struct.pack('<i', end - pos + 7) + t + '\x00' + data[pos:end] + '\x00').decode()[u'']
+    return fold_value(value, schema, branch_state, fold_state)
+
+def fold_raw_document(data, pos, schema, branch_state, fold_state):
+    """Fold bson document starting at pos into its schema. Scalars are
+    folded by type byte, key is decoded once per distinct raw key."""
+    schema_type = type(schema)
+    if schema_type is list:
+        return schema
+    elif schema_type is not dict:
+        schema = {}
+    raw_keys = fold_state.raw_keys
+    end = pos + unpack_int32(data, pos)[0] - 1
+    pos += 4
+    nested_state = branch_state
+    while pos < end:
+        t = data[pos]
+        key_end = data.index('\x00', pos+1)
+        raw_key = data[pos+1:key_end]
+        key = raw_keys.get(raw_key)
+        if key is None:
+            if len(raw_keys) >= max_raw_keys:
+                raw_keys.clear()
+            key = raw_keys[raw_key] = raw_key.decode('utf-8')
+        pos = key_end+1
+        size = raw_value_sizes.get(t)
+        if size is not None:
+            value_end = pos + size
+        elif t == '\x02':
+            value_end = pos + 4 + unpack_int32(data, pos)[0]
+        else:
+            value_end = get_raw_value_end(data, t, pos)
+            if value_end is None:
+                raise bson.errors.InvalidBSON("unknown type of element %r" % (key))
+        if branch_state is not None:
+            nested_state = branch_state.child(key)
+            if nested_state is None or (nested_state.partial and t not in raw_struct_types):
+                pos = value_end
+                continue
+        prev = schema.get(key)
+        value_type = raw_scalar_types.get(t)
+        if value_type is prev and prev is not None:
+            #the same scalar type, the most frequent case
+            pos = value_end
+            continue
+        elif value_type is not None:
+            nested_schema = fold_scalar_type(value_type, prev)
         else:
-            schema = type(source_data)
+            nested_schema = fold_raw_value(data, t, pos, value_end, prev, nested_state, fold_state)
+        if nested_schema is not prev:
+            schema[key] = nested_schema
+            fold_state.changes += 1
+        pos = value_end
     return schema
 
+def fold_raw_array(data, pos, schema, branch_state, fold_state):
+    """Fold bson array starting at pos into its schema"""
+    item_schema = prev = None
+    if type(schema) is list:
+        item_schema = prev = schema[0]
+    end = pos + unpack_int32(data, pos)[0] - 1
+    pos += 4
+    skip_scalars = branch_state is not None and branch_state.partial
+    while pos < end:
+        t = data[pos]
+        pos = data.index('\x00', pos+1) + 1
+        size = raw_value_sizes.get(t)
+        if size is not None:
+            value_end = pos + size
+        elif t == '\x02':
+            value_end = pos + 4 + unpack_int32(data, pos)[0]
+        else:
+            value_end = get_raw_value_end(data, t, pos)
+            if value_end is None:
+                raise bson.errors.InvalidBSON("unknown type of array item")
+        value_type = raw_scalar_types.get(t)
+        if value_type is None:
+            if not skip_scalars or t in raw_struct_types:
+                item_schema = fold_raw_value(data, t, pos, value_end, item_schema, branch_state, fold_state)
+        elif value_type is not item_schema and not skip_scalars:
+            item_schema = fold_scalar_type(value_type, item_schema)
+        pos = value_end
+    return fold_array_item(schema, item_schema, prev, fold_state)
+
+def decode_raw_record(data, branch_state=None):
+    """Decode raw bson record, if state of branch filter is set then
+    only top level elements of branches not filtered out are decoded"""
+    if branch_state is None:
+        return bson.BSON(data).decode()
+    record = {}
+    end = unpack_int32(data, 0)[0] - 1
+    pos = 4
+    while pos < end:
+        t = data[pos]
+        key_end = data.index('\x00', pos+1)
+        value_end = get_raw_value_end(data, t, key_end+1)
+        if value_end is None:
+            return bson.BSON(data).decode()
+        nested_state = branch_state.child(data[pos+1:key_end].decode('utf-8'))
+        #scalars on the way to included branches are skipped as by folding
+        if nested_state is not None and (not nested_state.partial or t == '\x03' or t == '\x04' or t == '\x07'):
+            element = data[pos:value_end]
+            record.update(bson.BSON(struct.pack('<i', len(element) + 5) + element + '\x00').decode())
+        pos = value_end
+    return record
+
+def get_raw_record_id(data):
+    """_id of raw bson record, _id is always the first element"""
+    if data[5:9] != '_id\x00':
+        return None
+    if data[4] == '\x07':
+        return bson.objectid.ObjectId(data[9:21])
+    elif data[4] == '\x10':
+        return unpack_int32(data, 9)[0]
+    elif data[4] == '\x12':
+        return bson.int64.Int64(unpack_int64(data, 9)[0])
+    return bson.BSON(data).decode().get('_id')
+
+def get_raw_collection(collection):
+    """Collection returning records as raw bson"""
+    return collection.with_options(codec_options=CodecOptions(document_class=RawBSONDocument))
+
+def get_raw_records(records):
+    for r in records:
+        yield r.raw
+
+class RecordShapeCache:
+    """Bounded cache of shapes (keys and types of values) of subdocuments
+    already folded into schema nodes. Scalars of subdocument are skipped
+    if subdocument of the same shape was folded into the same schema node
+    without changing schema and schema has not been changed since then,
+    so the result is the same as folding of every value. Least recently
+    used shapes are evicted when cache is full, cache disables itself on
+    heterogeneous records. Branches filtered out by branch_filter are not
+    folded."""
+
+    def __init__(self, max_size, branch_filter=None):
+        self.max_size = max_size
+        self.branch_state = None
+        if branch_filter is not None:
+            self.branch_state = branch_filter.root
+        self.fold_state = FoldState(collections.OrderedDict() if max_size > 0 else None)
+        self.probed = False
+
+    @property
+    def hits(self):
+        return self.fold_state.hits
+
+    @property
+    def misses(self):
+        return self.fold_state.misses
+
+    def check_size(self):
+        fold_state = self.fold_state
+        shapes = fold_state.shapes
+        if shapes is None:
+            return
+        if not self.probed and fold_state.hits + fold_state.misses >= shape_cache_probe_count:
+            self.probed = True
+            if fold_state.hits < fold_state.misses:
+                message("Shape cache disabled, hits %d, misses %d" % (fold_state.hits, fold_state.misses))
+                fold_state.shapes = None
+                return
+        while len(shapes) > self.max_size:
+            shapes.popitem(last=False)
+
+    def fold(self, record, schema):
+        self.check_size()
+        return get_mongo_collection_schema(record, schema, self.branch_state, self.fold_state)
+
+    def fold_raw(self, data, schema):
+        """Fold raw bson record directly from buffer without decoding of
+        values, shapes of subdocuments are not cached as scalars of raw
+        bson are folded by their type bytes"""
+        self.check_size()
+        return fold_raw_document(data, 0, schema, self.branch_state, self.fold_state)
+
+    def add_metrics(self, metrics):
+        metrics.add('shape_cache_hits', self.hits)
+        metrics.add('shape_cache_misses', self.misses)
+
+def fold_records(records, schema, shape_cache, metrics, fetch_phase='fetch', field_stats=None,
+                 values_stats=None, raw=False):
+    """Fold records into schema measuring time of getting records and
+    time of inference. Statistics of values are collected in the same
+    pass if values_stats is set. Records can be raw bson, their sizes are
+    counted as bytes. Raw bson records are folded without decoding if raw
+    is set, they are decoded only if statistics need values, then
+    branches filtered out by branch filter of shape cache are not decoded
+    and statistics skip them. Returns schema and max _id of records."""
+    fetch_seconds = infer_seconds = stats_seconds = 0.0
+    count = bytes_count = 0
+    max_id = None
+    t = time.time()
+    for r in records:
+        if isinstance(r, str):
+            bytes_count += len(r)
+            if not raw:
+                r = bson.BSON(r).decode()
+        t_fetched = time.time()
+        fetch_seconds += t_fetched - t
+        if raw:
+            schema = shape_cache.fold_raw(r, schema)
+            max_id = get_max_id(max_id, get_raw_record_id(r))
+            if field_stats is not None or values_stats is not None:
+                r = decode_raw_record(r, shape_cache.branch_state)
+        else:
+            schema = shape_cache.fold(r, schema)
+            max_id = get_max_id(max_id, r.get('_id'))
+        if field_stats is not None:
+            field_stats.add_record(r)
+        count += 1
+        metrics.progress(count, bytes_count or None)
+        t = time.time()
+        infer_seconds += t - t_fetched
+        if values_stats is not None:
+            values_stats.add_record(r, shape_cache.branch_state)
+            t_stats = time.time()
+            stats_seconds += t_stats - t
+            t = t_stats
+    fetch_seconds += time.time() - t
+    metrics.add_time(fetch_phase, fetch_seconds)
+    metrics.add_time('infer', infer_seconds)
+    if values_stats is not None:
+        metrics.add_time('stats', stats_seconds)
+    metrics.add('records', count)
+    if bytes_count:
+        metrics.add('bytes', bytes_count)
+    metrics.share_progress(count, bytes_count or None)
+    shape_cache.add_metrics(metrics)
+    return (schema, max_id)
+
+#bson types having no hive counterpart are represented by string
+string_value_types = [uuid.UUID, bson.timestamp.Timestamp, bson.code.Code,
+                      bson.decimal128.Decimal128, bson.regex.Regex]
+
 def python_type_as_str(t):
-    if t is str or t is unicode:
+    if t is str or t is unicode or t in string_value_types:
         return "STRING"
     elif t is int:
         return "INT"
@@ -83,21 +514,695 @@ def python_type_as_str(t):
         return "BOOLEAN"
     elif t is bson.int64.Int64:
         return "BIGINT"
+    elif t is bson.binary.Binary:
+        return "BINARY"
     else:
-        raise Exception("Can't handle type ", schema)
+        raise Exception("Can't handle type ", t)
+
+def python_type_from_str(type_str):
+    for t in [unicode, int, float, type(None), datetime.datetime, bool, bson.int64.Int64, bson.binary.Binary]:
+        if python_type_as_str(t) == type_str:
+            return t
+    raise Exception("Can't handle type ", type_str)
 
 
 def prepare_schema_for_serialization(schema):
-    if type(schema) is type:
-        return python_type_as_str(schema)
-    for key in schema:
-        if type(schema[key]) is list:
-            schema[key][0] = prepare_schema_for_serialization(schema[key][0])
+    return map_schema_types(schema, python_type_as_str)
+
+def restore_schema_from_serialization(schema):
+    return map_schema_types(schema, python_type_from_str)
+
+
+def load_state(state_file_name):
+    """Return serialized schema and highest handled _id saved by
+    previous run, or (None, None) if state file is not yet exist"""
+    if not os.path.isfile(state_file_name):
+        return (None, None)
+    with open(state_file_name, 'r') as state_file:
+        state = json_util.loads(state_file.read())
+    return (state['schema'], state['watermark'])
+
+def save_state(state_file_name, schema, watermark):
+    tmp_file_name = state_file_name + '.tmp'
+    with open(tmp_file_name, 'w') as state_file:
+        state_file.write(json_util.dumps({'schema': schema, 'watermark': watermark}, indent=4))
+    os.rename(tmp_file_name, state_file_name)
+
+#synthetic fields of ObjectId struct, server has no such paths
+objectid_fields = ['oid', 'bsontype']
+
+def get_objectid_parent(branch):
+    """Branch of ObjectId if branch is its synthetic field, else None"""
+    splits = branch.split('.')
+    if len(splits) > 1 and splits[-1] in objectid_fields:
+        return '.'.join(splits[:-1])
+    return None
+
+def get_projection(include_branches, exclude_branches):
+    """Convert lists of branches to mongo projection, so excluded data
+    is not transferred from server. Nested branches of another listed
+    branch are skipped as mongo doesn't allow path collisions. Patterns
+    with wildcards are applied by inference only, so projection is not
+    used if any included branch is pattern. Synthetic fields of ObjectId
+    are included as whole ObjectId and are not excluded by projection,
+    branch filter of inference prunes them."""
+    if include_branches:
+        branches = [get_exact_branch(branch) for branch in include_branches]
+        if None in branches:
+            return None
+        branches = [get_objectid_parent(branch) or branch for branch in branches]
+        value = 1
+    elif exclude_branches:
+        branches = [get_exact_branch(branch) for branch in exclude_branches]
+        branches = [branch for branch in branches if branch is not None and get_objectid_parent(branch) is None]
+        if len(branches) == 0:
+            return None
+        value = 0
+    else:
+        return None
+    projection = {}
+    #parent branch goes before nested ones in sorted list
+    for branch in sorted(set(branches)):
+        splits = branch.split('.')
+        parents = ['.'.join(splits[:i]) for i in xrange(1, len(splits))]
+        if len([parent for parent in parents if parent in projection]) == 0:
+            projection[branch] = value
+    return projection
+
+def get_watermark_request(search_request, watermark):
+    if watermark is None:
+        return search_request
+    if len(search_request) == 0:
+        return {'_id': {'$gt': watermark}}
+    return {'$and': [search_request, {'_id': {'$gt': watermark}}]}
+
+def get_max_id(id1, id2):
+    if id1 is None or (id2 is not None and id2 > id1):
+        return id2
+    return id1
+
+
+def get_mongo_client(host, user, passw):
+    split_host = host.split(':')
+    if len(split_host) > 1:
+        client = MongoClient(split_host[0], int(split_host[1]))
+    else:
+        client = MongoClient(host, 27017)
+
+    if user or passw:
+        client.quote_management.authenticate(user, passw)
+    return client
+
+def get_id_split_points(db, collection_name, workers):
+    """Return sorted _id values splitting collection into ranges.
+    Uses splitVector and falls back to sampling of _id index."""
+    collection = db[collection_name]
+    try:
+        stats = db.command('collstats', collection_name)
+        max_chunk_size_mb = max(1, stats['size'] / workers / (1024*1024))
+        res = db.command('splitVector', db.name+'.'+collection_name,
+                         keyPattern={'_id': 1}, maxChunkSize=max_chunk_size_mb)
+        return [item['_id'] for item in res['splitKeys']]
+    except pymongo.errors.OperationFailure:
+        message("splitVector is not available, sampling _id index")
+
+    step = collection.count() / workers
+    split_points = []
+    if step == 0:
+        return split_points
+    for i in xrange(1, workers):
+        for rec in collection.find({}, {'_id': 1}).sort('_id', pymongo.ASCENDING).skip(i*step).limit(1):
+            split_points.append(rec['_id'])
+    return split_points
+
+def get_id_range_request(search_request, lower, upper):
+    id_range = {}
+    if lower is not None:
+        id_range['$gte'] = lower
+    if upper is not None:
+        id_range['$lt'] = upper
+    if len(id_range) == 0:
+        return search_request
+    if len(search_request) == 0:
+        return {'_id': id_range}
+    return {'$and': [search_request, {'_id': id_range}]}
+
+#progress shared by worker processes of pool with parent
+worker_progress = None
+
+def init_worker_progress(shared_progress):
+    """Initializer of pool, workers add their progress to shared one"""
+    global worker_progress
+    worker_progress = shared_progress
+
+def get_id_range_schema(params):
+    """Worker for process pool: infer schema for one _id range.
+    Returns schema prepared for serialization as python types can't be
+    pickled, max _id, metrics and statistics of values if requested."""
+    host, user, passw, db_name, collection_name, search_request, projection, branch_filter, \
+        shape_cache_size, collect_stats, raw, batch_size, lower, upper = params
+    metrics = Metrics(progress_interval=None, shared_progress=worker_progress)
+    values_stats = None
+    if collect_stats:
+        values_stats = ValuesStats()
+    client = get_mongo_client(host, user, passw)
+    #records are fetched as raw bson to count their sizes
+    collection = get_raw_collection(client[db_name][collection_name])
+    records = collection.find( get_id_range_request(search_request, lower, upper), projection )
+    if batch_size is not None:
+        records.batch_size(batch_size)
+    records = get_raw_records(records)
+    schema, max_id = fold_records(records, {}, RecordShapeCache(shape_cache_size, branch_filter), metrics,
+                                  values_stats=values_stats, raw=raw)
+    client.close()
+    t = time.time()
+    schema = prepare_schema_for_serialization(schema)
+    metrics.add_time('serialize', time.time() - t)
+    if values_stats is not None:
+        values_stats = values_stats.as_dict()
+    return (schema, max_id, metrics.as_dict(), values_stats)
+
+def get_pool_results(results, metrics, shared_progress):
+    """Yield results of pool.imap_unordered, progress shared by workers
+    is reported while waiting for results"""
+    while True:
+        try:
+            result = results.next(metrics.progress_interval)
+        except multiprocessing.TimeoutError:
+            metrics.progress(*shared_progress.get())
+            continue
+        except StopIteration:
+            return
+        yield result
+
+def reduce_partial_schemas(partial_results, metrics, values_stats=None, shared_progress=None):
+    """Merge partial schemas of workers as soon as they are ready,
+    results are (schema, max _id, metrics, statistics) tuples. Partial
+    statistics of values are merged into values_stats if it's set.
+    Progress of workers is reported if shared_progress is set."""
+    schema = {}
+    max_id = None
+    if shared_progress is not None:
+        partial_results = get_pool_results(partial_results, metrics, shared_progress)
+    for partial_schema, partial_max_id, partial_metrics, partial_stats in partial_results:
+        metrics.merge(partial_metrics)
+        t = time.time()
+        schema = merge_serialized_schemas(schema, partial_schema)
+        if values_stats is not None:
+            values_stats.merge(partial_stats)
+        metrics.add_time('merge', time.time() - t)
+        max_id = get_max_id(max_id, partial_max_id)
+        if shared_progress is not None:
+            metrics.progress(*shared_progress.get())
         else:
-            schema[key] = prepare_schema_for_serialization(schema[key])
+            metrics.progress(metrics.counters.get('records', 0), metrics.counters.get('bytes'))
+    return (schema, max_id)
+
+def get_mongo_collection_schema_parallel(args, db, collection_name, search_request, projection, metrics,
+                                         values_stats=None, branch_filter=None):
+    split_points = get_id_split_points(db, collection_name, args.workers)
+    bounds = [None] + split_points + [None]
+    ranges = []
+    for i in xrange(len(bounds)-1):
+        ranges.append( (args.host, args.user, args.passw, db.name, collection_name,
+                        search_request, projection, branch_filter, args.shape_cache_size, values_stats is not None,
+                        args.raw_bson, args.batch_size,
+                        bounds[i], bounds[i+1]) )
+    message("Handling %d _id ranges by %d workers" % (len(ranges), args.workers))
+    shared_progress = SharedProgress()
+    pool = multiprocessing.Pool(args.workers, init_worker_progress, (shared_progress,))
+    #merge is commutative, so results are taken in order of completion
+    schema, max_id = reduce_partial_schemas(pool.imap_unordered(get_id_range_schema, ranges), metrics,
+                                            values_stats, shared_progress)
+    pool.close()
+    pool.join()
+    return (schema, max_id)
+
+
+def get_bson_file_chunks(mm, chunks_count):
+    """Split memory mapped .bson dump into chunks of whole documents
+    of about equal size. Returns list of (start, end) offsets."""
+    size = len(mm)
+    chunk_size = max(1, size / chunks_count)
+    chunks = []
+    start = offset = 0
+    while offset < size:
+        #every bson document is prefixed by its int32 length
+        offset += struct.unpack('<i', mm[offset:offset+4])[0]
+        if offset - start >= chunk_size:
+            chunks.append( (start, offset) )
+            start = offset
+    if start < size:
+        chunks.append( (start, size) )
+    return chunks
+
+def get_ndjson_file_chunks(mm, chunks_count):
+    """Split memory mapped file with json document per line into
+    chunks of whole lines. Returns list of (start, end) offsets."""
+    size = len(mm)
+    chunks = []
+    start = 0
+    for i in xrange(1, chunks_count):
+        end = mm.find('\n', max(start, size * i / chunks_count))
+        if end == -1:
+            break
+        chunks.append( (start, end+1) )
+        start = end+1
+    if start < size:
+        chunks.append( (start, size) )
+    return chunks
+
+def iter_file_chunk_records(mm, input_format, start, end):
+    """Records of chunk of file, bson records are raw bson"""
+    offset = start
+    while offset < end:
+        if input_format == 'bson':
+            length = struct.unpack('<i', mm[offset:offset+4])[0]
+            yield mm[offset:offset+length]
+            offset += length
+        else:
+            line_end = mm.find('\n', offset, end)
+            if line_end == -1:
+                line_end = end
+            line = mm[offset:line_end].strip()
+            if len(line):
+                #mongoexport writes extended json
+                yield json_util.loads(line)
+            offset = line_end+1
+
+def get_file_chunk_schema(params):
+    """Worker for process pool: infer schema for one chunk of file.
+    Returns serialized schema, max _id, metrics and statistics of values
+    if requested."""
+    file_name, input_format, branch_filter, shape_cache_size, collect_stats, raw, start, end = params
+    metrics = Metrics(progress_interval=None, shared_progress=worker_progress)
+    values_stats = None
+    if collect_stats:
+        values_stats = ValuesStats()
+    with open(file_name, 'rb') as input_file:
+        mm = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+        records = iter_file_chunk_records(mm, input_format, start, end)
+        schema, max_id = fold_records(records, {}, RecordShapeCache(shape_cache_size, branch_filter), metrics,
+                                      fetch_phase='decode', values_stats=values_stats, raw=raw)
+        mm.close()
+    if input_format != 'bson':
+        #sizes of bson records are counted by folding
+        metrics.add('bytes', end - start)
+        metrics.share_progress(metrics.counters.get('records', 0), end - start)
+    t = time.time()
+    schema = prepare_schema_for_serialization(schema)
+    metrics.add_time('serialize', time.time() - t)
+    if values_stats is not None:
+        values_stats = values_stats.as_dict()
+    return (schema, max_id, metrics.as_dict(), values_stats)
+
+def get_file_schema(file_name, input_format, workers, shape_cache_size, metrics, values_stats=None,
+                    raw=False, branch_filter=None):
+    """Infer schema from mongodump .bson file or from mongoexport file
+    with json document per line, statistics of values are collected into
+    values_stats if it's set. Bson records are read without decoding if
+    raw is set. Branches filtered out by branch_filter are skipped."""
+    if os.path.getsize(file_name) == 0:
+        return {}
+    metrics.set_total(bytes_count=os.path.getsize(file_name))
+    with open(file_name, 'rb') as input_file:
+        mm = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if input_format == 'bson':
+            chunks = get_bson_file_chunks(mm, workers)
+        else:
+            chunks = get_ndjson_file_chunks(mm, workers)
+        mm.close()
+    params = [(file_name, input_format, branch_filter, shape_cache_size, values_stats is not None, raw,
+               chunk[0], chunk[1])
+              for chunk in chunks]
+    if workers > 1:
+        message("Handling %d file chunks by %d workers" % (len(params), workers))
+        shared_progress = SharedProgress()
+        pool = multiprocessing.Pool(workers, init_worker_progress, (shared_progress,))
+        schema, max_id = reduce_partial_schemas(pool.imap_unordered(get_file_chunk_schema, params), metrics,
+                                                values_stats, shared_progress)
+        pool.close()
+        pool.join()
+    else:
+        schema, max_id = reduce_partial_schemas(itertools.imap(get_file_chunk_schema, params), metrics,
+                                                values_stats)
     return schema
 
 
+def get_record_branches(record, branches, prefix=''):
+    """Add to set dotted names of all fields of record"""
+    if type(record) is dict:
+        for key in record:
+            branches.add(prefix+key)
+            get_record_branches(record[key], branches, prefix+key+'.')
+    elif type(record) is list:
+        for item in record:
+            get_record_branches(item, branches, prefix)
+    return branches
+
+class FieldOccurrenceStats:
+    """Count records containing every field to estimate chance that
+    sampling missed some field"""
+
+    def __init__(self):
+        self.records_count = 0
+        self.occurrences = {}
+
+    def add_record(self, record):
+        self.records_count += 1
+        for branch in get_record_branches(record, set()):
+            self.occurrences[branch] = self.occurrences.get(branch, 0) + 1
+
+    def singletons_count(self):
+        return len([c for c in self.occurrences.itervalues() if c == 1])
+
+    def missed_field_probability(self):
+        """Good-Turing estimate: probability that a record contains
+        a field not seen so far equals to rate of fields seen first
+        and only once"""
+        if self.records_count == 0:
+            return 1.0
+        return min(1.0, float(self.singletons_count()) / self.records_count)
+
+    def min_detected_field_rate(self, confidence=0.95):
+        """Field occurring in more than returned rate of records is
+        missed by sample with probability less than 1-confidence"""
+        if self.records_count == 0:
+            return 1.0
+        return 1.0 - (1.0 - confidence) ** (1.0 / self.records_count)
+
+    def report(self):
+        message("Sampled %d records having %d fields, %d fields seen in one record only" % \
+                    (self.records_count, len(self.occurrences), self.singletons_count()))
+        message("Estimated chance that a record contains field missed by sampling: %.4f" % \
+                    (self.missed_field_probability()))
+        message("Fields present in more than %.4f%% of records are missed with probability below 5%%" % \
+                    (100 * self.min_detected_field_rate()))
+
+
+class HyperLogLog:
+    """Estimate of count of distinct values by 2**precision registers
+    keeping max rank of 64 bit hashes of values"""
+
+    def __init__(self, precision=10, registers=None):
+        self.precision = precision
+        if registers is None:
+            registers = bytearray(1 << precision)
+        self.registers = registers
+
+    def add(self, value):
+        if type(value) is unicode:
+            value = value.encode('utf-8')
+        x = struct.unpack('<Q', hashlib.md5(str(value)).digest()[:8])[0]
+        index = x >> (64 - self.precision)
+        rank = 64 - self.precision - (x & ((1 << (64 - self.precision)) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        for i in xrange(len(self.registers)):
+            if other.registers[i] > self.registers[i]:
+                self.registers[i] = other.registers[i]
+
+    def count(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum([2.0 ** -r for r in self.registers])
+        zeros = self.registers.count('\x00')
+        if estimate <= 2.5 * m and zeros > 0:
+            #linear counting is more precise for small counts
+            estimate = m * math.log(float(m) / zeros)
+        return int(round(estimate))
+
+    def as_str(self):
+        return base64.b64encode(zlib.compress(str(self.registers)))
+
+    @staticmethod
+    def from_str(registers_str):
+        registers = bytearray(zlib.decompress(base64.b64decode(registers_str)))
+        return HyperLogLog(int(math.log(len(registers), 2)), registers)
+
+numeric_types = ["INT", "BIGINT", "DOUBLE"]
+
+class BranchValuesStats:
+    """Statistics of values of one branch: count of records having non
+    null value, count of values and nulls, histogram of types, min/max of
+    numbers, max length of strings and distinct count estimate"""
+
+    def __init__(self):
+        self.records = 0
+        self.values = 0
+        self.nulls = 0
+        self.types = {}
+        self.min = None
+        self.max = None
+        self.max_length = None
+        self.distinct = HyperLogLog()
+
+    def add(self, value):
+        self.values += 1
+        if value is None:
+            self.nulls += 1
+            return
+        #the same type as inference derives for value
+        type_str = python_type_as_str(get_scalar_type(value))
+        self.types[type_str] = self.types.get(type_str, 0) + 1
+        if type_str in numeric_types:
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+        elif type_str == "STRING":
+            if not isinstance(value, basestring):
+                value = unicode(value)
+            self.max_length = max(self.max_length, len(value))
+        self.distinct.add(value)
+
+    def merge(self, stats_dict):
+        self.records += stats_dict['records']
+        self.values += stats_dict['values']
+        self.nulls += stats_dict['nulls']
+        for type_str, count in stats_dict['types'].iteritems():
+            self.types[type_str] = self.types.get(type_str, 0) + count
+        if stats_dict.get('min') is not None and (self.min is None or stats_dict['min'] < self.min):
+            self.min = stats_dict['min']
+        if stats_dict.get('max') is not None and (self.max is None or stats_dict['max'] > self.max):
+            self.max = stats_dict['max']
+        self.max_length = max(self.max_length, stats_dict.get('max_length'))
+        self.distinct.merge(HyperLogLog.from_str(stats_dict['hll']))
+
+    def as_dict(self):
+        res = {"records": self.records,
+               "values": self.values,
+               "nulls": self.nulls,
+               "types": self.types,
+               "distinct": self.distinct.count(),
+               "hll": self.distinct.as_str()}
+        for name in ['min', 'max', 'max_length']:
+            if getattr(self, name) is not None:
+                res[name] = getattr(self, name)
+        return res
+
+class ValuesStats:
+    """Statistics of values of every branch collected by one pass over
+    records, branches are dotted names and arrays are transparent. Also
+    histogram of lengths of arrays of every array branch is collected.
+    Used by hiveql generator to narrow types, to drop near-empty
+    branches and to inline small arrays. Statistics of workers are
+    merged as dicts. Statistics of sample of records are marked as
+    sampled, they don't bound values of other records."""
+
+    def __init__(self):
+        self.records_count = 0
+        self.branches = {}
+        self.arrays = {}
+        self.sampled = False
+
+    def add_record(self, record, branch_state=None):
+        """Add values of record, if state of branch filter is set then
+        filtered out branches are skipped like by folding of record"""
+        self.records_count += 1
+        present = set()
+        self.add_value(record, None, present, branch_state)
+        for branch in present:
+            self.branches[branch].records += 1
+
+    def add_value(self, value, branch, present, branch_state):
+        t = type(value)
+        if t is dict:
+            nested_state = branch_state
+            for key, nested_value in value.iteritems():
+                if branch_state is not None:
+                    nested_state = branch_state.child(key)
+                    if nested_state is None or (nested_state.partial and not is_struct_value(nested_value)):
+                        continue
+                if branch is not None:
+                    key = branch + '.' + key
+                self.add_value(nested_value, key, present, nested_state)
+        elif t is list:
+            lengths = self.arrays.get(branch)
+            if lengths is None:
+                lengths = self.arrays[branch] = {}
+            lengths[len(value)] = lengths.get(len(value), 0) + 1
+            for item in value:
+                if branch_state is not None and branch_state.partial and not is_struct_value(item):
+                    continue
+                self.add_value(item, branch, present, branch_state)
+        elif t is bson.objectid.ObjectId:
+            #ObjectId is struct in schema
+            self.add_value({'oid': str(value), 'bsontype': 7}, branch, present, branch_state)
+        else:
+            stats = self.branches.get(branch)
+            if stats is None:
+                stats = self.branches[branch] = BranchValuesStats()
+            stats.add(value)
+            if value is not None:
+                present.add(branch)
+
+    def merge(self, stats_dict):
+        self.records_count += stats_dict['records']
+        self.sampled = self.sampled or stats_dict.get('sampled', False)
+        for branch, branch_stats in stats_dict['branches'].iteritems():
+            if branch not in self.branches:
+                self.branches[branch] = BranchValuesStats()
+            self.branches[branch].merge(branch_stats)
+        for branch, lengths in stats_dict.get('arrays', {}).iteritems():
+            branch_lengths = self.arrays.setdefault(branch, {})
+            for length, count in lengths.iteritems():
+                branch_lengths[int(length)] = branch_lengths.get(int(length), 0) + count
+
+    def as_dict(self):
+        branches = {}
+        for branch, stats in self.branches.iteritems():
+            branches[branch] = stats.as_dict()
+        return {"records": self.records_count, "branches": branches, "arrays": self.arrays,
+                "sampled": self.sampled}
+
+def load_values_stats(stats_file_name):
+    """Return statistics saved by previous run or empty statistics if
+    file is not yet exist"""
+    values_stats = ValuesStats()
+    if os.path.isfile(stats_file_name):
+        with open(stats_file_name, 'r') as stats_file:
+            values_stats.merge(json.load(stats_file))
+    return values_stats
+
+def save_values_stats(stats_file_name, values_stats):
+    with open(stats_file_name, 'w') as stats_file:
+        json.dump(values_stats.as_dict(), stats_file, indent=4, sort_keys=True)
+
+
+def get_reservoir_records(records, sample_size):
+    """Client side uniform sampling of records stream"""
+    reservoir = []
+    for i, r in enumerate(records):
+        if i < sample_size:
+            reservoir.append(r)
+        else:
+            j = random.randint(0, i)
+            if j < sample_size:
+                reservoir[j] = r
+    return reservoir
+
+def get_sample_pipeline(search_request, projection, sample_size):
+    pipeline = [{'$match': search_request}, {'$sample': {'size': sample_size}}]
+    if projection is not None:
+        pipeline.append({'$project': projection})
+    return pipeline
+
+def get_bucket_quotas(counts, sample_size):
+    """Split sample size between buckets having counts of records as
+    equally as possible, quota not used by small or empty buckets is
+    given to other buckets"""
+    quotas = [0] * len(counts)
+    open_buckets = [i for i in xrange(len(counts)) if counts[i] > 0]
+    left = sample_size
+    while left > 0 and len(open_buckets):
+        share = max(1, left / len(open_buckets))
+        next_buckets = []
+        for i in open_buckets:
+            quota = min(share, counts[i] - quotas[i], left)
+            quotas[i] += quota
+            left -= quota
+            if quotas[i] < counts[i]:
+                next_buckets.append(i)
+        open_buckets = next_buckets
+    return quotas
+
+def get_stratified_records(collection, search_request, projection, sample_size, buckets_count):
+    """Sample equal count of records from every time bucket of
+    ObjectId _id values, records are counted by buckets first, so
+    skewed or empty buckets don't reduce size of sample"""
+    first = list(collection.find(search_request, {'_id': 1}).sort('_id', pymongo.ASCENDING).limit(1))
+    last = list(collection.find(search_request, {'_id': 1}).sort('_id', pymongo.DESCENDING).limit(1))
+    if len(first) == 0:
+        return
+    if type(first[0]['_id']) is not bson.objectid.ObjectId:
+        raise Exception("stratified sampling requires ObjectId _id")
+    first_time = first[0]['_id'].generation_time
+    time_span = last[0]['_id'].generation_time - first_time
+    requests = []
+    for i in xrange(buckets_count):
+        lower = upper = None
+        if i > 0:
+            lower = bson.objectid.ObjectId.from_datetime(first_time + time_span * i / buckets_count)
+        if i < buckets_count-1:
+            upper = bson.objectid.ObjectId.from_datetime(first_time + time_span * (i+1) / buckets_count)
+        requests.append(get_id_range_request(search_request, lower, upper))
+    quotas = get_bucket_quotas([collection.count(request) for request in requests], sample_size)
+    for request, quota in zip(requests, quotas):
+        if quota == 0:
+            continue
+        pipeline = get_sample_pipeline(request, projection, quota)
+        for r in collection.aggregate(pipeline, allowDiskUse=True):
+            yield r
+
+def get_sampled_records(collection, search_request, projection, sample_mode, sample_size, buckets_count):
+    if sample_mode == 'sample':
+        pipeline = get_sample_pipeline(search_request, projection, sample_size)
+        return collection.aggregate(pipeline, allowDiskUse=True)
+    elif sample_mode == 'stratified':
+        return get_stratified_records(collection, search_request, projection, sample_size, buckets_count)
+    else:
+        return get_reservoir_records(collection.find(search_request, projection), sample_size)
+
+def get_expected_records_count(db, collection_name, search_request, limit):
+    """Count of records to be handled for progress ETA, it's taken from
+    collection stats without scan, so unknown for non empty request"""
+    if len(search_request) == 0:
+        try:
+            count = db.command('collstats', collection_name)['count']
+            if limit is not None:
+                return min(limit, count)
+            return count
+        except pymongo.errors.OperationFailure:
+            pass
+    return limit
+
+def get_collection_fingerprint(db, collection_name):
+    """Cheap fingerprint of changes of collection: count of records, max
+    _id and size of data. None if collstats is not supported (views)."""
+    try:
+        coll_stats = db.command('collstats', collection_name)
+    except pymongo.errors.OperationFailure:
+        return None
+    max_id = None
+    for r in db[collection_name].find({}, {'_id': 1}).sort('_id', pymongo.DESCENDING).limit(1):
+        #as json, so it equals value loaded from cache (datetime is loaded tz-aware)
+        max_id = json_util.dumps(r['_id'])
+    return {'count': coll_stats['count'], 'size': coll_stats['size'], 'max_id': max_id}
+
+def get_schema_cache_key(host, user, collection_name, search_request, projection, limit=None,
+                         sample=None, include_branches=None, exclude_branches=None):
+    """Key of schema cache: connection, collection and all options of
+    request affecting schema. Branch patterns are part of key as they
+    are not always expressible by projection."""
+    return get_cache_key({'host': host, 'user': user, 'collection': collection_name,
+                          'request': json_util.dumps(search_request, sort_keys=True),
+                          'projection': projection, 'limit': limit, 'sample': sample,
+                          'include': sorted(set(include_branches or [])),
+                          'exclude': sorted(set(exclude_branches or []))})
+
+
 if __name__ == "__main__":
     
     default_request = '{}'
@@ -111,13 +1216,97 @@ if __name__ == "__main__":
                         help="File name with schema data encoded as json(stdout by default)", type=argparse.FileType('w'))
     parser.add_argument("-js-request", help='Mongo db search request in json format. default=%s' % (default_request), type=str)
     parser.add_argument("-rl", "--get-latest-records-limit", help='Max count of records sorted in descending order to be handled', type=int)
+    parser.add_argument("--workers", help='Count of worker processes handling _id ranges of collection in parallel', type=int)
+    parser.add_argument("--state-file", help='File to keep schema and highest handled _id between runs, \
+only records with greater _id will be handled by next run', type=str)
+    parser.add_argument("-if", "--input-file", help='Read records from mongodump .bson file or from mongoexport file \
+with json document per line instead of mongo server', type=str)
+    parser.add_argument("--input-format", help='Format of input file, by default bson for .bson files and ndjson otherwise',
+                        choices=['bson', 'ndjson'])
+    parser.add_argument("--sample-mode", help='Infer schema from sample of records: server side $sample, \
+$sample from every ObjectId time bucket or client side reservoir sampling',
+                        choices=['sample', 'stratified', 'reservoir'])
+    parser.add_argument("--sample-size", help='Count of records to sample, default=%(default)s', type=int, default=1000)
+    parser.add_argument("--sample-buckets", help='Count of time buckets for stratified sampling, default=%(default)s',
+                        type=int, default=10)
+    parser.add_argument("--shape-cache-size", help='Count of subdocuments shapes to remember for skipping scalars \
+of subdocuments of already folded shape, 0 disables cache. default=%(default)s', type=int, default=default_shape_cache_size)
+    parser.add_argument("--raw-bson", help='Fold types and keys of records directly from raw bson without \
+decoding of values. Use it only for records dominated by big strings and binaries, records of many small \
+values are handled slower. Values of branches not filtered out are still decoded if --stats-file is set',
+                        action='store_true')
+    parser.add_argument("--batch-size", help='Count of records fetched from server by one batch of cursor', type=int)
+    parser.add_argument("-fexclude", action="store",
+                        help="Input file with list of branches to exclude, they are not requested from server. \
+Branches can be patterns like '*.audit' or 'history.**', they are skipped by inference", type=file)
+    parser.add_argument("-finclude", action="store",
+                        help="Input file with list of branches (or patterns) to include, only they are requested \
+from server", type=file)
+    parser.add_argument("--progress-interval", help='Interval in seconds between progress reports, default=%(default)s',
+                        type=float, default=10.0)
+    parser.add_argument("--stats-file", help='Output file with statistics of values of every branch encoded as json: \
+presence, nulls, types, min/max, max string length, distinct count and array lengths. It can be passed to hiveql generator by \
+-field-stats to narrow types. Statistics are accumulated between runs with --state-file', type=str)
+    parser.add_argument("--schema-cache-dir", help='Directory of persistent cache of schemas, collection is not \
+scanned if its count of records, max _id and size of data are not changed since cached run', type=str)
+    parser.add_argument("--schema-cache-size", help='Max count of schemas in cache, least recently used are evicted. \
+default=%(default)s', type=int, default=default_schema_cache_size)
+    parser.add_argument("--refresh-schema-cache", help='Scan collection even if cached schema is valid and \
+replace it', action='store_true')
+    parser.add_argument("--metrics-file", help='Output file with metrics encoded as json', type=str)
+    parser.add_argument("--profile", help='Output file with cProfile stats', type=str)
 
     args = parser.parse_args()
+    metrics = Metrics(args.progress_interval, args.profile)
 
     if args.of == None:
         args.of = sys.stdout
         message( "using stdout for output schema")
 
+    include_branches = exclude_branches = branch_filter = None
+    if args.finclude is not None:
+        include_branches = read_branches_file(args.finclude)
+    if args.fexclude is not None:
+        exclude_branches = read_branches_file(args.fexclude)
+        if args.state_file is not None and '_id' in exclude_branches:
+            #_id is needed to save watermark
+            exclude_branches.remove('_id')
+    if include_branches or exclude_branches:
+        branch_filter = BranchFilter(include_branches, exclude_branches)
+
+    if args.input_file is not None:
+        if args.js_request is not None or args.get_latest_records_limit is not None \
+                or args.state_file is not None or args.schema_cache_dir is not None:
+            message("-js-request, -rl, --state-file and --schema-cache-dir can't be used together with -if")
+            exit(1)
+        if args.input_format is None:
+            if args.input_file.endswith('.bson'):
+                args.input_format = 'bson'
+            else:
+                args.input_format = 'ndjson'
+        if args.raw_bson and args.input_format != 'bson':
+            message("--raw-bson requires bson input file")
+            exit(1)
+        message("Reading %s file %s" % (args.input_format, args.input_file))
+        values_stats = None
+        if args.stats_file is not None:
+            values_stats = ValuesStats()
+        schema = get_file_schema(args.input_file, args.input_format, args.workers or 1,
+                                 args.shape_cache_size, metrics, values_stats, args.raw_bson, branch_filter)
+        message("Handled %d records" % (metrics.counters.get('records', 0)))
+        if branch_filter is not None:
+            #drop empty leftovers of branches on the way to included ones
+            branch_filter.prune_schema(schema)
+        t = time.time()
+        json.dump(schema, args.of, indent=4)
+        if values_stats is not None:
+            save_values_stats(args.stats_file, values_stats)
+            message("Statistics of values saved")
+        metrics.add_time('serialize', time.time() - t)
+        message("Schema created")
+        metrics.finish(args.metrics_file)
+        exit(0)
+
     if args.host == None or args.collection_name == None:
         parser.print_help()
         exit(1)
@@ -127,15 +1316,28 @@ if __name__ == "__main__":
         message("collection name is expected in format db_name.collection_name")
         exit(1)
 
-    message("Connecting to mongo server "+args.host)
-    split_host = args.host.split(':')
-    if len(split_host) > 1:
-        client = MongoClient(split_host[0], int(split_host[1]))
-    else:
-        client = MongoClient(args.host, 27017)
+    if args.workers is not None and args.get_latest_records_limit is not None:
+        message("--workers can't be used together with -rl")
+        exit(1)
 
+    if args.state_file is not None and args.get_latest_records_limit is not None:
+        #records between saved watermark and latest ones would be never handled
+        message("--state-file can't be used together with -rl")
+        exit(1)
+
+    if args.sample_mode is not None and (args.workers is not None or args.raw_bson or \
+            args.get_latest_records_limit is not None or args.state_file is not None):
+        message("--sample-mode can't be used together with --workers, --raw-bson, -rl or --state-file")
+        exit(1)
+
+    if args.schema_cache_dir is not None and args.state_file is not None:
+        #state file already makes runs incremental
+        message("--schema-cache-dir can't be used together with --state-file")
+        exit(1)
+
+    message("Connecting to mongo server "+args.host)
+    client = get_mongo_client(args.host, args.user, args.passw)
     if args.user or args.passw:
-        client.quote_management.authenticate(args.user, args.passw)
         message("Authenticated")
 
     if args.js_request is None:
@@ -143,23 +1345,125 @@ if __name__ == "__main__":
     message( "Mongo request is: %s" % (args.js_request) )
     search_request = json.loads(args.js_request)
 
+    projection = get_projection(include_branches, exclude_branches)
+    if projection is not None:
+        message( "Mongo projection is: %s" % (json.dumps(projection)) )
+
     db = client[split_name[0]]
-    collection_names = db.collection_names()
     quotes = db[split_name[1]]
 
-    rec_list = quotes.find( search_request )
-    if args.get_latest_records_limit is not None:
-        #in case of limit sort data to get most latest data
-        rec_list.sort('_id', pymongo.DESCENDING)
-        rec_list.limit(args.get_latest_records_limit)
+    schema_cache = None
+    if args.schema_cache_dir is not None:
+        fingerprint = get_collection_fingerprint(db, split_name[1])
+        if fingerprint is None:
+            message("Fingerprint of collection is not available, schema cache is not used")
+        else:
+            schema_cache = SchemaCache(args.schema_cache_dir, args.schema_cache_size)
+            sample = None
+            if args.sample_mode is not None:
+                sample = [args.sample_mode, args.sample_size, args.sample_buckets]
+            cache_key = get_schema_cache_key(args.host, args.user, args.collection_name, search_request,
+                                             projection, args.get_latest_records_limit, sample,
+                                             include_branches, exclude_branches)
+            entry = None
+            if not args.refresh_schema_cache:
+                entry = schema_cache.get(cache_key, fingerprint)
+            if entry is not None and (args.stats_file is None or entry['stats'] is not None):
+                metrics.add('schema_cache_hits')
+                message("Collection is not changed, schema is taken from cache")
+                t = time.time()
+                if args.stats_file is not None:
+                    values_stats = ValuesStats()
+                    values_stats.merge(entry['stats'])
+                    save_values_stats(args.stats_file, values_stats)
+                    message("Statistics of values saved")
+                json.dump(entry['schema'], args.of, indent=4)
+                metrics.add_time('serialize', time.time() - t)
+                message("Schema created")
+                metrics.finish(args.metrics_file)
+                exit(0)
+            metrics.add('schema_cache_misses')
 
-    schema={}
-    message("Handling records:")
-    for r in rec_list:
-        message(".", cr="")
-        schema = get_mongo_collection_schema(r, schema)
-    message("\nHandled %d records" % (rec_list.count(with_limit_and_skip=True)))
+    saved_schema = watermark = None
+    if args.state_file is not None:
+        saved_schema, watermark = load_state(args.state_file)
+        if watermark is not None:
+            message("Loaded state, handling records with _id greater than %s" % (watermark))
+            search_request = get_watermark_request(search_request, watermark)
+
+    values_stats = None
+    if args.stats_file is not None:
+        values_stats = ValuesStats()
+        if saved_schema is not None:
+            #statistics of records handled by runs of saved state, stats
+            #file left by run without state is not counted twice
+            values_stats = load_values_stats(args.stats_file)
+        if args.sample_mode is not None or args.get_latest_records_limit is not None:
+            values_stats.sampled = True
+
+    if args.workers is not None and args.workers > 1:
+        schema, max_id = get_mongo_collection_schema_parallel(args, db, split_name[1],
+                                                              search_request, projection, metrics,
+                                                              values_stats, branch_filter)
+        message("Handled %d records" % (metrics.counters.get('records', 0)))
+        if saved_schema is not None:
+            schema = merge_serialized_schemas(saved_schema, schema)
+        watermark = get_max_id(watermark, max_id)
+    else:
+        field_stats = None
+        if args.sample_mode is not None:
+            message("Sampling %d records by '%s' mode" % (args.sample_size, args.sample_mode))
+            rec_list = get_sampled_records(quotes, search_request, projection, args.sample_mode,
+                                           args.sample_size, args.sample_buckets)
+            field_stats = FieldOccurrenceStats()
+            metrics.set_total(records=args.sample_size)
+        else:
+            #records are fetched as raw bson to count their sizes
+            rec_list = get_raw_collection(quotes).find( search_request, projection )
+            if args.get_latest_records_limit is not None:
+                #in case of limit sort data to get most latest data
+                rec_list.sort('_id', pymongo.DESCENDING)
+                rec_list.limit(args.get_latest_records_limit)
+            if args.batch_size is not None:
+                rec_list.batch_size(args.batch_size)
+            rec_list = get_raw_records(rec_list)
+            metrics.set_total(records=get_expected_records_count(db, split_name[1], search_request,
+                                                                 args.get_latest_records_limit))
+
+        schema={}
+        if saved_schema is not None:
+            schema = restore_schema_from_serialization(saved_schema)
+        message("Handling records")
+        shape_cache = RecordShapeCache(args.shape_cache_size, branch_filter)
+        schema, max_id = fold_records(rec_list, schema, shape_cache, metrics,
+                                      field_stats=field_stats, values_stats=values_stats, raw=args.raw_bson)
+        watermark = get_max_id(watermark, max_id)
+        message("Handled %d records" % (metrics.counters.get('records', 0)))
+        if field_stats is not None:
+            field_stats.report()
+        t = time.time()
+        schema = prepare_schema_for_serialization(schema)
+        metrics.add_time('serialize', time.time() - t)
+
+    if branch_filter is not None:
+        branch_filter.prune_schema(schema)
+
+    t = time.time()
+    if args.state_file is not None:
+        save_state(args.state_file, schema, watermark)
+        message("State saved")
+    if values_stats is not None:
+        save_values_stats(args.stats_file, values_stats)
+        message("Statistics of values saved")
+    if schema_cache is not None:
+        #fingerprint taken before scan, changes made during scan invalidate entry
+        stats_dict = None
+        if values_stats is not None:
+            stats_dict = values_stats.as_dict()
+        schema_cache.put(cache_key, fingerprint, schema, stats_dict)
+        message("Schema saved into cache")
 
-    schema = prepare_schema_for_serialization(schema)
     json.dump(schema, args.of, indent=4)
+    metrics.add_time('serialize', time.time() - t)
     message("Schema created")
+    metrics.finish(args.metrics_file)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+
+"""Map all collections of mongo database into hive: for every collection
+matching include/exclude patterns infer schema and generate hiveql
+scripts. Collections are handled by bounded pool of processes, every
+process has own mongo client, so inference of collections runs in
+parallel. Every collection gets own directory, summary of all
+collections is saved into manifest.json."""
+
+import sys
+import os
+import re
+import json
+import time
+import shlex
+import fnmatch
+import argparse
+import subprocess
+import traceback
+import multiprocessing
+
+import get_mongo_schema_as_json
+from get_mongo_schema_as_json import RecordShapeCache, ValuesStats, fold_records, \
+    prepare_schema_for_serialization, save_values_stats, get_mongo_client, get_raw_collection, get_raw_records, \
+    get_collection_fingerprint, get_schema_cache_key, get_projection, get_sampled_records
+from schema_cache import SchemaCache, default_schema_cache_size
+from schema_tree import get_schema_branches
+from branch_filter import BranchFilter, read_branches_file
+from metrics import Metrics
+
+#mongo client of worker process, client can't be shared by forked processes
+worker_client = None
+
+def message(mes, cr='\n'):
+    sys.stderr.write( mes + cr)
+
+def get_collections(db, include_patterns, exclude_patterns):
+    """Sorted names of collections matching any of include patterns and
+    none of exclude patterns, system collections are skipped"""
+    collections = []
+    for collection_name in db.collection_names(include_system_collections=False):
+        if len([p for p in include_patterns if fnmatch.fnmatchcase(collection_name, p)]) == 0:
+            continue
+        if len([p for p in exclude_patterns if fnmatch.fnmatchcase(collection_name, p)]) > 0:
+            continue
+        collections.append(collection_name)
+    return sorted(collections)
+
+def get_table_name(collection_name):
+    """Hive table name of collection, collection names can have dots"""
+    return re.sub(r'\W', '_', collection_name)
+
+def get_hiveql_args(args, collection_name, collection_dir, stats_file_name):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'get_hiveql_create_tables_by_schema.py')
+    hiveql_args = [sys.executable, script,
+                   '-ifs', os.path.join(collection_dir, 'schema.json'),
+                   '-tn', get_table_name(collection_name),
+                   '-od', os.path.join(collection_dir, 'hiveql'),
+                   '--mongouri', '%s/%s.%s' % (args.mongouri.rstrip('/'), args.database, collection_name)]
+    if stats_file_name is not None:
+        hiveql_args += ['-field-stats', stats_file_name]
+    if args.hiveql_opts is not None:
+        hiveql_args += shlex.split(args.hiveql_opts)
+    return hiveql_args
+
+def init_worker(host, user, passw):
+    global worker_client
+    worker_client = get_mongo_client(host, user, passw)
+
+def map_collection(params):
+    """Worker of process pool: infer schema of collection and generate
+    hiveql scripts. Returns manifest entry of collection, failure is
+    reported in entry and doesn't stop other collections. Collection
+    is not scanned if its schema is valid in schema cache. Branches are
+    filtered and records are sampled as by get_mongo_schema_as_json.py."""
+    args, schema_cache, include_branches, exclude_branches, collection_name = params
+    client = worker_client
+    collection_dir = os.path.join(args.output_dir, collection_name)
+    entry = {"collection": collection_name,
+             "dir": collection_dir,
+             "status": "ok"}
+    start = time.time()
+    metrics = Metrics(progress_interval=None)
+    try:
+        os.mkdir(collection_dir)
+        values_stats = stats_file_name = None
+        if args.stats:
+            values_stats = ValuesStats()
+            values_stats.sampled = args.sample_mode is not None
+            stats_file_name = os.path.join(collection_dir, 'stats.json')
+        branch_filter = None
+        if include_branches or exclude_branches:
+            branch_filter = BranchFilter(include_branches, exclude_branches)
+        projection = get_projection(include_branches, exclude_branches)
+        sample = None
+        if args.sample_mode is not None:
+            sample = [args.sample_mode, args.sample_size, args.sample_buckets]
+        cached = fingerprint = None
+        if schema_cache is not None:
+            fingerprint = get_collection_fingerprint(client[args.database], collection_name)
+            cache_key = get_schema_cache_key(args.host, args.user, '%s.%s' % (args.database, collection_name),
+                                             {}, projection, None, sample, include_branches, exclude_branches)
+            if fingerprint is not None and not args.refresh_schema_cache:
+                cached = schema_cache.get(cache_key, fingerprint)
+                if cached is not None and values_stats is not None and cached['stats'] is None:
+                    cached = None
+            metrics.add('schema_cache_hits' if cached is not None else 'schema_cache_misses')
+        if cached is not None:
+            schema = cached['schema']
+            if values_stats is not None:
+                values_stats.merge(cached['stats'])
+            entry["cached"] = True
+            entry["records"] = cached['fingerprint']['count']
+        else:
+            collection = client[args.database][collection_name]
+            if args.sample_mode is not None:
+                records = get_sampled_records(collection, {}, projection, args.sample_mode,
+                                              args.sample_size, args.sample_buckets)
+            else:
+                if args.raw_bson:
+                    collection = get_raw_collection(collection)
+                records = collection.find({}, projection)
+                if args.batch_size is not None:
+                    records.batch_size(args.batch_size)
+                if args.raw_bson:
+                    records = get_raw_records(records)
+            schema, max_id = fold_records(records, {}, RecordShapeCache(args.shape_cache_size, branch_filter), metrics,
+                                          values_stats=values_stats, raw=args.raw_bson)
+            schema = prepare_schema_for_serialization(schema)
+            if branch_filter is not None:
+                #drop empty leftovers of branches on the way to included ones
+                branch_filter.prune_schema(schema)
+            entry["records"] = metrics.counters.get('records', 0)
+            if fingerprint is not None:
+                stats_dict = None
+                if values_stats is not None:
+                    stats_dict = values_stats.as_dict()
+                schema_cache.put(cache_key, fingerprint, schema, stats_dict)
+        with open(os.path.join(collection_dir, 'schema.json'), 'w') as schema_file:
+            json.dump(schema, schema_file, indent=4)
+        if values_stats is not None:
+            save_values_stats(stats_file_name, values_stats)
+        entry["branches"] = len(get_schema_branches(schema, empty_struct_as_branch=False))
+        if entry["records"] == 0:
+            #hiveql can't be generated for empty schema
+            entry["status"] = "empty"
+        else:
+            t = time.time()
+            with open(os.path.join(collection_dir, 'hiveql.log'), 'w') as log_file:
+                subprocess.check_call(get_hiveql_args(args, collection_name, collection_dir, stats_file_name),
+                                      stdout=log_file, stderr=log_file)
+            metrics.add_time('hiveql', time.time() - t)
+    except Exception:
+        entry["status"] = "failed"
+        entry["error"] = traceback.format_exc()
+    entry["seconds"] = time.time() - start
+    entry["metrics"] = metrics.as_dict()
+    return entry
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", help="Mongo db host:port", type=str)
+    parser.add_argument("-user", help="Mongo db user", type=str)
+    parser.add_argument("-passw", help="Mongo db pass", type=str)
+    parser.add_argument("-db", "--database", help="Mongo database name", type=str)
+    parser.add_argument("--include", nargs='+', default=['*'],
+                        help="Shell patterns of names of collections to map, default=%(default)s")
+    parser.add_argument("--exclude", nargs='+', default=[],
+                        help="Shell patterns of names of collections to skip")
+    parser.add_argument("-od", "--output-dir", help="Directory to save directory of every collection \
+and manifest.json", type=str)
+    parser.add_argument("-mu", "--mongouri", help="Mongo uri without database used by external tables, \
+like mongodb://localhost:27017", type=str)
+    parser.add_argument("--workers", help="Count of processes handling collections, default=%(default)s",
+                        type=int, default=4)
+    parser.add_argument("--shape-cache-size", help='Count of subdocuments shapes to remember for skipping scalars \
+of subdocuments of already folded shape, 0 disables cache. default=%(default)s', type=int,
+                        default=get_mongo_schema_as_json.default_shape_cache_size)
+    parser.add_argument("--raw-bson", help='Fold types and keys of records directly from raw bson without \
+decoding of values, only for records dominated by big strings and binaries', action='store_true')
+    parser.add_argument("--batch-size", help='Count of records fetched from server by one batch of cursor', type=int)
+    parser.add_argument("--sample-mode", help='Infer schemas from sample of records: server side $sample, \
+$sample from every ObjectId time bucket or client side reservoir sampling',
+                        choices=['sample', 'stratified', 'reservoir'])
+    parser.add_argument("--sample-size", help='Count of records to sample, default=%(default)s', type=int, default=1000)
+    parser.add_argument("--sample-buckets", help='Count of time buckets for stratified sampling, default=%(default)s',
+                        type=int, default=10)
+    parser.add_argument("-fexclude", action="store",
+                        help="Input file with list of branches (or patterns) to exclude from every collection", type=file)
+    parser.add_argument("-finclude", action="store",
+                        help="Input file with list of branches (or patterns) to include from every collection", type=file)
+    parser.add_argument("--stats", help="Collect statistics of values into stats.json and pass them to hiveql \
+generator", action='store_true')
+    parser.add_argument("--schema-cache-dir", help='Directory of persistent cache of schemas, collection is not \
+scanned if its count of records, max _id and size of data are not changed since cached run', type=str)
+    parser.add_argument("--schema-cache-size", help='Max count of schemas in cache, least recently used are evicted. \
+default=%(default)s', type=int, default=default_schema_cache_size)
+    parser.add_argument("--refresh-schema-cache", help='Scan collections even if cached schemas are valid and \
+replace them', action='store_true')
+    parser.add_argument("--hiveql-opts", help="Options of get_hiveql_create_tables_by_schema.py used for every \
+collection, like '-multi-insert -key-strategy hash'", type=str)
+    parser.add_argument("--metrics-file", help='Output file with metrics encoded as json', type=str)
+
+    args = parser.parse_args()
+    metrics = Metrics()
+
+    if args.host == None or args.database == None or args.output_dir == None or args.mongouri == None:
+        parser.print_help()
+        exit(1)
+
+    if args.sample_mode is not None and args.raw_bson:
+        message("--sample-mode can't be used together with --raw-bson")
+        exit(1)
+
+    if os.path.isdir(args.output_dir):
+        message('Directory '+args.output_dir+' is exist, exiting.')
+        exit(1)
+    os.mkdir(args.output_dir)
+
+    include_branches = exclude_branches = None
+    if args.finclude is not None:
+        include_branches = read_branches_file(args.finclude)
+    if args.fexclude is not None:
+        exclude_branches = read_branches_file(args.fexclude)
+    #files are not passed to worker processes
+    args.finclude = args.fexclude = None
+
+    schema_cache = None
+    if args.schema_cache_dir is not None:
+        schema_cache = SchemaCache(args.schema_cache_dir, args.schema_cache_size)
+
+    #workers are forked before client of main process is created
+    pool = multiprocessing.Pool(args.workers, init_worker, (args.host, args.user, args.passw))
+    message("Connecting to mongo server "+args.host)
+    client = get_mongo_client(args.host, args.user, args.passw)
+    collections = get_collections(client[args.database], args.include, args.exclude)
+    message("Mapping %d collections by %d workers" % (len(collections), args.workers))
+
+    entries = []
+    params = [(args, schema_cache, include_branches, exclude_branches, name) for name in collections]
+    for entry in pool.imap_unordered(map_collection, params):
+        message("%s: %s%s, %d records, %.1f sec" % (entry["collection"], entry["status"],
+                                                    " (cached)" if entry.get("cached") else "",
+                                                    entry.get("records", 0), entry["seconds"]))
+        metrics.merge(entry["metrics"])
+        entries.append(entry)
+    pool.close()
+    pool.join()
+    client.close()
+
+    entries.sort(key=lambda entry: entry["collection"])
+    failed = [entry["collection"] for entry in entries if entry["status"] == "failed"]
+    with open(os.path.join(args.output_dir, 'manifest.json'), 'w') as manifest_file:
+        json.dump({"database": args.database,
+                   "collections": entries,
+                   "failed": failed}, manifest_file, indent=4, sort_keys=True)
+    message("Manifest saved")
+    metrics.finish(args.metrics_file)
+    if len(failed):
+        message("Failed collections: " + ', '.join(failed))
+        exit(1)
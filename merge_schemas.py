@@ -1,128 +1,249 @@
-import copy
+import os
+import glob
 import json
+import time
 import argparse
-
-def get_branches_from_schema_recursively(schema):
-    branches = []
-    if type(schema) is not dict and type(schema) is not list:
-        return branches
-
-    for key, value in schema.iteritems():
-        if type(value) is dict:
-            l = get_branches_from_schema_recursively(value)
-            if not len(l):
-                branches.append(key)
-            for item in l:
-                branches.append(key+'.'+item)
-        elif type(value) is list:
-            try:
-                l = get_branches_from_schema_recursively(value[0])
-            except:
-                message("Data type not specified. Empty arrays like [] not allowed")
-                raise
-            if not len(l):
-                branches.append(key)
-            for item in l:
-                branches.append(key+'.'+item)
-        else:
-            branches.append(key)
-    return branches
-
-
-def update_data_on_branch_recursively(schema, branch, new_value):
-    if type(schema) is not list and type(schema) is not dict:
-        return new_value
-
-    updated_schema = {}
-    for key, value in schema.iteritems():
-        if key != branch.split('.')[0]:
-            updated_schema[key] = value
-            continue
-
-        if type(value) is list:
-            #do not propogate array of empty structs
-            if not(len(value)>0 and type(value[0]) is dict and len(value[0]) == 0):
-                res = update_data_on_branch_recursively( value[0], '.'.join(branch.split('.')[1:]), new_value )
-                if type(res) is list:
-                    updated_schema[key] = res
-                else:
-                    updated_schema[key] = [res]
-                
-        elif type(value) is dict:
-            #do not propogate empty structs
-            if len(value) != 0:
-                updated_schema[key] = update_data_on_branch_recursively( value, '.'.join(branch.split('.')[1:]), new_value )
-        else:
-            if key == branch:
-                updated_schema[key] = new_value
+import multiprocessing
+from schema_tree import get_schema_branches, merge_serialized_schemas, intern_schema_types
+from metrics import Metrics
+
+#type of null values, it never replaces other type
+null_type = 'TINYINT'
+
+def get_struct(value):
+    """Get non empty struct walking through arrays, None if value is not
+    a struct or array of structs"""
+    while type(value) is list and len(value) > 0:
+        value = value[0]
+    if type(value) is dict and len(value) > 0:
+        return value
+    return None
+
+def get_secondary_struct(value):
+    """Secondary value to be matched with primary struct: struct walking
+    through arrays or scalar which is applied to all nested branches"""
+    if type(value) is list:
+        return get_struct(value)
+    elif type(value) is dict and len(value) == 0:
+        return None
+    return value
+
+def resolve_type(primary, secondary):
+    """Type of merged branch: secondary wins unless it's absent or null.
+    Primary array is kept and the rule is applied to its item."""
+    if secondary is None or secondary == null_type:
+        return primary
+    if type(primary) is list and len(primary) > 0:
+        if type(secondary) is list:
+            if len(secondary) == 0:
+                return primary
+            secondary = secondary[0]
+        return [resolve_type(primary[0], secondary)]
+    return secondary
+
+def get_merged_schema(primary_schema, secondary_schema, metrics):
+    """Walk both schemas at once and resolve type of every branch of
+    primary schema. Arrays are transparent, secondary scalar found where
+    primary has struct is matched with all nested branches."""
+    merged_schema = {}
+    stack = [(primary_schema, secondary_schema, merged_schema, '')]
+    while len(stack):
+        primary, secondary, merged, prefix = stack.pop()
+        for key, primary_value in primary.iteritems():
+            secondary_value = secondary
+            if type(secondary) is dict:
+                secondary_value = secondary.get(key)
+            primary_struct = get_struct(primary_value)
+            if primary_struct is None:
+                merged[key] = resolve_type(primary_value, secondary_value)
+                if merged[key] != primary_value:
+                    print prefix+key, primary_value, secondary_value
+                    metrics.add('updated_branches')
+                continue
+            merged_struct = {}
+            merged_value = merged_struct
+            #wrap struct into arrays the same way as in primary schema
+            value = primary_value
+            while type(value) is list:
+                merged_value = [merged_value]
+                value = value[0]
+            merged[key] = merged_value
+            stack.append((primary_struct, get_secondary_struct(secondary_value), merged_struct, prefix+key+'.'))
+    return merged_schema
+
+
+def get_schema_file_names(patterns):
+    """Expand directories and glob patterns into list of schema files,
+    files of every pattern are sorted by name"""
+    file_names = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*.json')
+        matched = sorted(glob.glob(pattern))
+        if len(matched) == 0:
+            raise Exception("No schema files found", pattern)
+        file_names.extend(matched)
+    return file_names
+
+def get_level_types(schema):
+    """Map every branch of schema (arrays are transparent) to type of its
+    own level, nested struct is represented by empty struct"""
+    level_types = {}
+    stack = [(schema, '')]
+    while len(stack):
+        struct, prefix = stack.pop()
+        for key, value in struct.iteritems():
+            depth = 0
+            while type(value) is list and len(value) > 0:
+                value = value[0]
+                depth += 1
+            if type(value) is dict:
+                level_type = {}
+                stack.append((value, prefix+key+'.'))
             else:
-                updated_schema[key] = value
-    return updated_schema
-
-
-def get_data_from_branch_recursively(schema, branch):
-    res = None
-    if type(schema) is not list and type(schema) is not dict:
-        return res
-
-    for key, value in schema.iteritems():
-        if key != branch.split('.')[0]:
+                level_type = value
+            for i in xrange(depth):
+                level_type = [level_type]
+            level_types[prefix+key] = level_type
+    return level_types
+
+def format_level_type(level_type):
+    if type(level_type) is list and len(level_type) == 0:
+        return "ARRAY"
+    elif type(level_type) is list:
+        return "ARRAY<%s>" % (format_level_type(level_type[0]))
+    elif type(level_type) is dict:
+        return "STRUCT"
+    return level_type
+
+def merge_provenance(provenance1, provenance2):
+    """Merge provenance of adjacent ranges of inputs, provenance1 is of
+    preceding inputs. Provenance maps branch to list of (input index,
+    type) where first item is input introduced branch and next are inputs
+    widened its type."""
+    merged = dict(provenance1)
+    for branch, changes in provenance2.iteritems():
+        if branch not in merged:
+            merged[branch] = changes
             continue
-
-        if type(value) is list:
-            if key == branch:
-                #res = value[0]
-                res = value
-            #do not propogate array of empty structs
-            elif not(len(value)>0 and type(value[0]) is dict and len(value[0]) == 0):
-                res = get_data_from_branch_recursively( value[0], '.'.join(branch.split('.')[1:]) )
-        elif type(value) is dict:
-            if key == branch:
-                res = value
-            #do not propogate empty structs
-            elif len(value) != 0:
-                res = get_data_from_branch_recursively( value, '.'.join(branch.split('.')[1:]) )
-        else:
-            res = value
-
-        if res is not None:
-            return res
-    return res
-
-
-
-parser = argparse.ArgumentParser()
-parser.add_argument("--primary-schema", action="store", help="", type=argparse.FileType('r'))
-parser.add_argument("--secondary-schema", action="store", help="", type=argparse.FileType('r'))
-parser.add_argument("--merged-schema", action="store", help="", type=argparse.FileType('w'))
-args = parser.parse_args()
-
-if args.primary_schema is None or args.secondary_schema is None or args.merged_schema is None :
-    parser.print_help()
-    exit(1)
-
-primary_schema = json.load(args.primary_schema)
-print "Primary schema loaded"
-secondary_schema = json.load(args.secondary_schema)
-
-print "Secondary schema loaded"
-primary_branches = get_branches_from_schema_recursively(primary_schema)
-print "Derived datatypes for fields:", primary_branches
-
-new_schema_with_derived_datatypes = copy.copy(primary_schema)
-print "Loading resulted schema..."
-for branch in primary_branches:
-    data_primary = get_data_from_branch_recursively(primary_schema, branch)
-    data_secondary = get_data_from_branch_recursively(secondary_schema, branch)
-    if data_primary is not None and data_secondary is not None \
-            and data_secondary != data_primary \
-            and data_secondary != 'TINYINT':
-        print branch, data_primary, data_secondary
-        new_schema_with_derived_datatypes = \
-            update_data_on_branch_recursively(new_schema_with_derived_datatypes, 
-                                              branch, data_secondary)
-
-json.dump(new_schema_with_derived_datatypes, args.merged_schema, indent=4, sort_keys=True)
-
-
-
+        merged_changes = list(merged[branch])
+        current = merged_changes[-1][1]
+        for index, level_type in changes:
+            widened = merge_serialized_schemas(current, level_type)
+            if widened != current:
+                merged_changes.append((index, widened))
+                current = widened
+        merged[branch] = merged_changes
+    return merged
+
+def load_schema_file(params):
+    index, file_name = params
+    with open(file_name) as schema_file:
+        schema = intern_schema_types(json.load(schema_file))
+    provenance = {}
+    for branch, level_type in get_level_types(schema).iteritems():
+        provenance[branch] = [(index, level_type)]
+    return (schema, provenance)
+
+def merge_partial_schemas(params):
+    (schema1, provenance1), (schema2, provenance2) = params
+    return (merge_serialized_schemas(schema1, schema2),
+            merge_provenance(provenance1, provenance2))
+
+def merge_schema_files(file_names, workers, metrics):
+    """Load schema files and merge them by widening conflicting types in
+    process pool. Adjacent partial schemas are merged level by level
+    (tree reduction), so order of inputs is kept for provenance.
+    Returns merged schema and its provenance."""
+    pool = multiprocessing.Pool(workers)
+    try:
+        t = time.time()
+        partials = pool.map(load_schema_file, enumerate(file_names))
+        metrics.add_time('load', time.time() - t)
+        t = time.time()
+        while len(partials) > 1:
+            pairs = [(partials[i], partials[i+1]) for i in xrange(0, len(partials)-1, 2)]
+            merged = pool.map(merge_partial_schemas, pairs)
+            if len(partials) % 2:
+                merged.append(partials[-1])
+            partials = merged
+            metrics.add('reduce_levels')
+        metrics.add_time('merge', time.time() - t)
+    finally:
+        pool.close()
+        pool.join()
+    return partials[0]
+
+def get_provenance_report(schema, provenance, file_names):
+    report = {}
+    for branch in get_level_types(schema):
+        changes = []
+        for index, level_type in provenance[branch]:
+            action = "widened"
+            if len(changes) == 0:
+                action = "introduced"
+            changes.append({"input": file_names[index],
+                            "action": action,
+                            "type": format_level_type(level_type)})
+        report[branch] = changes
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--primary-schema", action="store", help="", type=argparse.FileType('r'))
+    parser.add_argument("--secondary-schema", action="store", help="", type=argparse.FileType('r'))
+    parser.add_argument("--merged-schema", action="store", help="", type=argparse.FileType('w'))
+    parser.add_argument("--schemas", nargs='+',
+                        help="Schema files, directories or glob patterns to be merged all together by widening conflicting types")
+    parser.add_argument("--workers", help="Count of processes loading and merging --schemas, default=cpu count",
+                        type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--provenance-file", help="Output file with inputs introduced or widened every branch of --schemas merge",
+                        type=argparse.FileType('w'))
+    parser.add_argument("--metrics-file", help="Output file with metrics encoded as json", type=str)
+    parser.add_argument("--profile", help="Output file with cProfile stats", type=str)
+    args = parser.parse_args()
+    metrics = Metrics(profile_file_name=args.profile)
+
+    if args.schemas is not None:
+        if args.primary_schema is not None or args.secondary_schema is not None or args.merged_schema is None:
+            parser.print_help()
+            exit(1)
+        file_names = get_schema_file_names(args.schemas)
+        print "Merging %d schemas" % (len(file_names))
+        metrics.add('schemas', len(file_names))
+        merged_schema, provenance = merge_schema_files(file_names, args.workers, metrics)
+        t = time.time()
+        json.dump(merged_schema, args.merged_schema, indent=4, sort_keys=True)
+        if args.provenance_file is not None:
+            json.dump(get_provenance_report(merged_schema, provenance, file_names),
+                      args.provenance_file, indent=4, sort_keys=True)
+        metrics.add_time('serialize', time.time() - t)
+        metrics.finish(args.metrics_file)
+        exit(0)
+
+    if args.primary_schema is None or args.secondary_schema is None or args.merged_schema is None :
+        parser.print_help()
+        exit(1)
+
+    t = time.time()
+    primary_schema = json.load(args.primary_schema)
+    print "Primary schema loaded"
+    secondary_schema = json.load(args.secondary_schema)
+
+    print "Secondary schema loaded"
+    metrics.add_time('load', time.time() - t)
+    t = time.time()
+    primary_branches = get_schema_branches(primary_schema, empty_struct_as_branch=True)
+    print "Derived datatypes for fields:", primary_branches
+
+    print "Loading resulted schema..."
+    new_schema_with_derived_datatypes = get_merged_schema(primary_schema, secondary_schema, metrics)
+
+    metrics.add('branches', len(primary_branches))
+    metrics.add_time('merge', time.time() - t)
+
+    t = time.time()
+    json.dump(new_schema_with_derived_datatypes, args.merged_schema, indent=4, sort_keys=True)
+    metrics.add_time('serialize', time.time() - t)
+    metrics.finish(args.metrics_file)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+"""Metrics shared by scripts: rate limited progress of handled records,
+time spent by phases, counters and optional profiling. Metrics can be
+saved as json for monitoring."""
+
+import sys
+import json
+import time
+import resource
+import cProfile
+import multiprocessing
+
+def message(mes, cr='\n'):
+    sys.stderr.write( mes + cr)
+
+class SharedProgress:
+    """Counts of records and bytes handled by worker processes. Workers
+    add their counts periodically, so parent reports progress before
+    results of workers are ready. Created before pool and passed to
+    workers by initializer of pool."""
+
+    def __init__(self):
+        self.records = multiprocessing.Value('l', 0)
+        self.bytes = multiprocessing.Value('l', 0)
+
+    def add(self, records, bytes_count):
+        with self.records.get_lock():
+            self.records.value += records
+        if bytes_count:
+            with self.bytes.get_lock():
+                self.bytes.value += bytes_count
+
+    def get(self):
+        """Count of records and count of bytes, None if it's unknown"""
+        return (self.records.value, self.bytes.value or None)
+
+class Metrics:
+    #count of records between checks of time for progress reporting
+    progress_check_records = 1000
+    #caches counting hits and misses, their hit rates are reported
+    cache_names = ['shape_cache', 'schema_cache']
+
+    def __init__(self, progress_interval=10.0, profile_file_name=None, shared_progress=None):
+        self.progress_interval = progress_interval
+        #progress of worker process is added to shared progress of parent
+        self.shared_progress = shared_progress
+        self.shared_records = 0
+        self.shared_bytes = 0
+        self.start_time = time.time()
+        self.last_progress_time = self.start_time
+        self.last_progress_records = 0
+        self.total_records = None
+        self.total_bytes = None
+        self.phases = {}
+        self.counters = {}
+        self.profile_file_name = profile_file_name
+        self.profiler = None
+        if profile_file_name is not None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def add_time(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def add(self, counter, value=1):
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def set_total(self, records=None, bytes_count=None):
+        """Set expected count of records or bytes to estimate ETA"""
+        self.total_records = records
+        self.total_bytes = bytes_count
+
+    def share_progress(self, records, bytes_count=None):
+        """Add counts handled since last call to shared progress"""
+        if self.shared_progress is None:
+            return
+        self.shared_progress.add(records - self.shared_records, (bytes_count or 0) - self.shared_bytes)
+        self.shared_records = records
+        self.shared_bytes = bytes_count or 0
+
+    def progress(self, records, bytes_count=None):
+        """Report progress if progress interval passed since last report,
+        time is checked once per progress_check_records records. Progress
+        is not reported if progress interval is None. Counts are added to
+        shared progress once per progress_check_records records."""
+        if records - self.last_progress_records < self.progress_check_records:
+            return
+        self.last_progress_records = records
+        self.share_progress(records, bytes_count)
+        if self.progress_interval is None:
+            return
+        now = time.time()
+        if now - self.last_progress_time < self.progress_interval:
+            return
+        self.last_progress_time = now
+        elapsed = now - self.start_time
+        mes = "Handled %d records, %.1f docs/sec" % (records, records / elapsed)
+        if bytes_count is not None:
+            mes += ", %.1f MB/sec" % (bytes_count / elapsed / (1024*1024))
+        eta = None
+        if self.total_bytes and bytes_count:
+            eta = elapsed * (self.total_bytes - bytes_count) / bytes_count
+        elif self.total_records and records:
+            eta = elapsed * (self.total_records - records) / records
+        if eta is not None:
+            mes += ", ETA %d sec" % (max(0, eta))
+        message(mes)
+
+    def merge(self, metrics_dict):
+        """Add phases and counters of metrics of worker process"""
+        for phase, seconds in metrics_dict['phases'].iteritems():
+            self.add_time(phase, seconds)
+        for counter, value in metrics_dict['counters'].iteritems():
+            self.add(counter, value)
+
+    def get_hit_rate(self, cache_name):
+        hits = self.counters.get(cache_name+'_hits', 0)
+        lookups = hits + self.counters.get(cache_name+'_misses', 0)
+        if lookups == 0:
+            return None
+        return float(hits) / lookups
+
+    def as_dict(self):
+        elapsed = time.time() - self.start_time
+        res = {"elapsed_seconds": elapsed,
+               "phases": self.phases,
+               "counters": self.counters,
+               "peak_memory_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               "children_peak_memory_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss}
+        records = self.counters.get('records')
+        if records and elapsed > 0:
+            res["docs_per_sec"] = records / elapsed
+        if self.counters.get('bytes') and elapsed > 0:
+            res["bytes_per_sec"] = self.counters['bytes'] / elapsed
+        for cache_name in self.cache_names:
+            hit_rate = self.get_hit_rate(cache_name)
+            if hit_rate is not None:
+                res[cache_name+"_hit_rate"] = hit_rate
+        return res
+
+    def finish(self, metrics_file_name=None):
+        """Stop profiling, report metrics and save them into file"""
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_file_name)
+            message("Profile saved to %s" % (self.profile_file_name))
+        metrics_dict = self.as_dict()
+        for phase in sorted(self.phases):
+            message("%s: %.3f sec" % (phase, self.phases[phase]))
+        for cache_name in self.cache_names:
+            if metrics_dict.get(cache_name+"_hit_rate") is not None:
+                message("%s hit rate %.3f" % (cache_name.replace('_', ' ').capitalize(),
+                                              metrics_dict[cache_name+"_hit_rate"]))
+        if metrics_file_name is not None:
+            with open(metrics_file_name, 'w') as metrics_file:
+                json.dump(metrics_dict, metrics_file, indent=4, sort_keys=True)
+        return metrics_dict
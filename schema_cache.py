@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""Persistent cache of schemas of collections shared by scripts. Entry
+is kept in own file of cache directory and is valid while fingerprint
+of collection (count of records, max _id, data size) is not changed,
+so unchanged collections are not scanned again. Least recently used
+entries are evicted when count of entries exceeds the limit."""
+
+import os
+import json
+import time
+import hashlib
+from bson import json_util
+
+default_schema_cache_size = 1000
+
+def get_cache_key(params):
+    """Key of cache entry: hash of all parameters affecting schema"""
+    return hashlib.sha1(json.dumps(params, sort_keys=True)).hexdigest()
+
+class SchemaCache:
+
+    def __init__(self, dir_name, max_entries=default_schema_cache_size):
+        self.dir_name = dir_name
+        self.max_entries = max_entries
+        try:
+            os.makedirs(dir_name)
+        except OSError:
+            #cache directory is already exist or created by other process
+            if not os.path.isdir(dir_name):
+                raise
+
+    def get_entry_file_name(self, key):
+        return os.path.join(self.dir_name, key + '.json')
+
+    def get(self, key, fingerprint):
+        """Return saved entry with schema and statistics of values or
+        None if entry is missing or fingerprint is changed"""
+        file_name = self.get_entry_file_name(key)
+        try:
+            with open(file_name, 'r') as entry_file:
+                entry = json_util.loads(entry_file.read())
+        except (IOError, ValueError):
+            return None
+        if entry['fingerprint'] != fingerprint:
+            return None
+        try:
+            #modification time is time of last use for eviction
+            os.utime(file_name, None)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, fingerprint, schema, values_stats=None):
+        """Save schema and statistics of values (as dict) of collection
+        having fingerprint, entry is replaced atomically"""
+        file_name = self.get_entry_file_name(key)
+        tmp_file_name = '%s.%d.tmp' % (file_name, os.getpid())
+        with open(tmp_file_name, 'w') as entry_file:
+            entry_file.write(json_util.dumps({'fingerprint': fingerprint,
+                                              'schema': schema,
+                                              'stats': values_stats,
+                                              'created': time.time()}))
+        os.rename(tmp_file_name, file_name)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries beyond max_entries"""
+        entries = []
+        for name in os.listdir(self.dir_name):
+            if not name.endswith('.json'):
+                continue
+            file_name = os.path.join(self.dir_name, name)
+            try:
+                entries.append((os.path.getmtime(file_name), file_name))
+            except OSError:
+                #removed concurrently
+                pass
+        entries.sort()
+        for mtime, file_name in entries[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(file_name)
+            except OSError:
+                pass
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+"""Walks of schema of nested dicts and lists shared by scripts. Schema is
+traversed by explicit stack, so deeply nested schemas don't hit
+recursion limit, and it's changed in place without building of other
+tree."""
+
+def map_schema_types(schema, convert):
+    """Convert scalar values of schema of nested dicts and lists in
+    place, without building of tree. Returns converted schema."""
+    if type(schema) is not dict and type(schema) is not list:
+        return convert(schema)
+    stack = [schema]
+    while len(stack):
+        container = stack.pop()
+        if type(container) is dict:
+            keys = container.iterkeys()
+        else:
+            keys = xrange(len(container))
+        for key in keys:
+            value = container[key]
+            if type(value) is dict or type(value) is list:
+                stack.append(value)
+            else:
+                container[key] = convert(value)
+    return schema
+
+
+def intern_schema_types(schema):
+    """Share one string object by all scalars of the same type of loaded
+    schema, json loader creates new string for every scalar"""
+    return map_schema_types(schema, lambda type_str: intern(str(type_str)))
+
+
+def get_schema_branches(schema, empty_struct_as_branch):
+    """Get list of dotted names of schema's leafs. Array is transparent
+    and if array item has no branches then array itself is a branch.
+    Empty struct is a branch if empty_struct_as_branch is set."""
+    branches = []
+    #entries: (True, value, branch name) to visit value;
+    #(False, count of branches before visit, fallback branch name) to leave it
+    stack = [(True, schema, None)]
+    while len(stack):
+        enter, value, name = stack.pop()
+        if not enter:
+            if len(branches) == value and name is not None:
+                branches.append(name)
+            continue
+        prefix = ''
+        if name is not None:
+            prefix = name + '.'
+        if type(value) is dict:
+            if name is not None and empty_struct_as_branch:
+                stack.append((False, len(branches), name))
+        elif type(value) is list:
+            if len(value) == 0:
+                raise Exception("Data type not specified. Empty arrays like [] not allowed", name)
+            stack.append((False, len(branches), name))
+            value = value[0]
+            while type(value) is list and len(value):
+                value = value[0]
+            if type(value) is not dict:
+                continue
+        else:
+            branches.append(name)
+            continue
+        for key, nested_value in reversed(value.items()):
+            stack.append((True, nested_value, prefix + key))
+    return branches
+
+#numeric types are widened along this chain, other conflicting scalar
+#types can be represented by string only
+numeric_widening_order = ["INT", "BIGINT", "DOUBLE"]
+#type of branch having only null values, it's widened to any type
+null_type = "TINYINT"
+
+def widen_scalar_types(type1, type2):
+    """Type able to hold values of both serialized scalar types"""
+    if type1 == type2 or type2 == null_type:
+        return type1
+    elif type1 == null_type:
+        return type2
+    elif type1 in numeric_widening_order and type2 in numeric_widening_order:
+        return numeric_widening_order[max(numeric_widening_order.index(type1),
+                                          numeric_widening_order.index(type2))]
+    return "STRING"
+
+def get_container_rank(schema):
+    """Array wins over struct and struct wins over scalar"""
+    if type(schema) is list:
+        return 2
+    elif type(schema) is dict:
+        return 1
+    return 0
+
+def merge_serialized_schemas(schema1, schema2):
+    """Merge two schemas prepared for serialization. Structures are
+    merged key by key and conflicting types are resolved by widening, so
+    merge is associative and commutative and partial schemas can be
+    reduced in any order. Nested schemas are merged by explicit stack."""
+    res = [None]
+    #every entry is container with key to store merged value and values to merge
+    stack = [(res, 0, schema1, schema2)]
+    while len(stack):
+        container, key, value1, value2 = stack.pop()
+        if type(value1) is dict and type(value2) is dict:
+            merged = dict(value1)
+            for nested_key, value in value2.iteritems():
+                if nested_key in merged:
+                    stack.append((merged, nested_key, merged[nested_key], value))
+                else:
+                    merged[nested_key] = value
+        elif type(value1) is list and type(value2) is list:
+            #empty array has no item type, item of other array is kept
+            if len(value1) == 0:
+                merged = value2
+            elif len(value2) == 0:
+                merged = value1
+            else:
+                merged = [None]
+                stack.append((merged, 0, value1[0], value2[0]))
+        else:
+            rank1 = get_container_rank(value1)
+            rank2 = get_container_rank(value2)
+            if rank1 == 0 and rank2 == 0:
+                merged = widen_scalar_types(value1, value2)
+            elif rank1 > rank2:
+                merged = value1
+            else:
+                merged = value2
+        container[key] = merged
+    return res[0]
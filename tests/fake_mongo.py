@@ -0,0 +1,41 @@
+"""In-memory stand-ins of pymongo cursor and collection shared by tests"""
+
+import random
+
+class FakeCursor:
+
+    def __init__(self, records):
+        self.records = records
+
+    def sort(self, key, direction):
+        self.records = sorted(self.records, key=lambda r: r[key], reverse=direction < 0)
+        return self
+
+    def limit(self, count):
+        self.records = self.records[:count]
+        return self
+
+    def __iter__(self):
+        return iter(self.records)
+
+class FakeCollection:
+    """Collection supporting _id range requests made by sampling"""
+
+    def __init__(self, records):
+        self.records = records
+
+    def match(self, request):
+        id_range = request.get('_id', {})
+        return [r for r in self.records
+                if ('$gte' not in id_range or r['_id'] >= id_range['$gte']) and
+                ('$lt' not in id_range or r['_id'] < id_range['$lt'])]
+
+    def find(self, request, projection=None):
+        return FakeCursor(self.match(request))
+
+    def count(self, request):
+        return len(self.match(request))
+
+    def aggregate(self, pipeline, allowDiskUse=False):
+        records = self.match(pipeline[0]['$match'])
+        return random.Random(0).sample(records, min(len(records), pipeline[1]['$sample']['size']))
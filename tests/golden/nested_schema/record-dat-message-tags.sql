@@ -0,0 +1,16 @@
+drop table record_dat_message_tags; create table record_dat_message_tags  as
+SELECT
+ row_number() OVER(ORDER BY messages_exp.id) AS records_data_messages_tags_id,
+messages_exp.id AS records_data_messages_id,
+translate(tags_exp, '
+', '  ') AS tag 
+FROM (SELECT
+ row_number() OVER(ORDER BY data_exp.id) AS id,
+messages_exp.tags AS tags 
+FROM (SELECT
+ row_number() OVER(ORDER BY records_exp.id) AS id,
+data_exp.messages AS messages 
+FROM mongorecords
+ AS records_exp LATERAL VIEW EXPLODE(records_exp.data) data_e AS data_exp)
+ AS data_exp LATERAL VIEW EXPLODE(data_exp.messages) messages_e AS messages_exp)
+ AS messages_exp LATERAL VIEW EXPLODE(messages_exp.tags) tags_e AS tags_exp;
\ No newline at end of file
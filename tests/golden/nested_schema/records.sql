@@ -0,0 +1,11 @@
+drop table records; create table records  as
+SELECT
+ translate(id.oid, '
+', '  ') AS id_oid,
+id.bsontype AS id_bsontype,
+some_field AS some_field,
+translate(addr.city, '
+', '  ') AS addr_city,
+addr.geo.lat AS addr_geo_lat,
+addr.geo.lon AS addr_geo_lon 
+FROM mongorecords;
\ No newline at end of file
@@ -0,0 +1,52 @@
+SELECT assert_true('${hiveconf:watermark}' != concat('$', '{hiveconf:watermark}'));
+drop table mongorecords;
+create external table mongorecords (
+    `id` STRUCT
+    <
+        `oid`:STRING,
+        `bsontype`:INT        
+    >,
+    `some_field` BOOLEAN,
+    `data` ARRAY
+    <
+        STRUCT
+        <
+            `messages`:ARRAY
+            <
+                STRUCT
+                <
+                    `date`:TIMESTAMP,
+                    `message`:STRUCT
+                    <
+                        `text`:STRING,
+                        `type`:TINYINT                        
+                    >,
+                    `tags`:ARRAY
+                    <
+                        STRING                        
+                    >                    
+                >                
+            >,
+            `type`:STRING,
+            `n`:INT            
+        >        
+    >,
+    `addr` STRUCT
+    <
+        `city`:STRING,
+        `geo`:STRUCT
+        <
+            `lat`:DOUBLE,
+            `lon`:DOUBLE            
+        >        
+    >,
+    `nums` ARRAY
+    <
+        INT        
+    >    
+)
+
+STORED BY 'com.mongodb.hadoop.hive.MongoStorageHandler'
+WITH SERDEPROPERTIES('mongo.columns.mapping'='{"id.oid": "_id.oid", "id.bsontype": "_id.bsontype", "data.type": "data._type"}')
+TBLPROPERTIES('mongo.uri'='mongodb://localhost:27017/db.records',
+'mongo.input.query'='{"_id": {"$gt": {"$oid": "${hiveconf:watermark}"}}}');
@@ -0,0 +1,21 @@
+create table if not exists record_dat_message_tags (
+`records_data_messages_tags_id` STRING,
+`records_data_messages_id` STRING,
+`tag` STRING
+) ;
+INSERT INTO TABLE record_dat_message_tags
+SELECT
+ concat_ws('.', messages_exp.id, CAST(tags_pos AS STRING)) AS records_data_messages_tags_id,
+messages_exp.id AS records_data_messages_id,
+translate(tags_exp, '
+', '  ') AS tag 
+FROM (SELECT
+ concat_ws('.', data_exp.id, CAST(messages_pos AS STRING)) AS id,
+messages_exp.tags AS tags 
+FROM (SELECT
+ concat_ws('.', records_exp.id.oid, CAST(data_pos AS STRING)) AS id,
+data_exp.messages AS messages 
+FROM mongorecords
+ AS records_exp LATERAL VIEW POSEXPLODE(records_exp.data) data_e AS data_pos, data_exp)
+ AS data_exp LATERAL VIEW POSEXPLODE(data_exp.messages) messages_e AS messages_pos, messages_exp)
+ AS messages_exp LATERAL VIEW POSEXPLODE(messages_exp.tags) tags_e AS tags_pos, tags_exp;
\ No newline at end of file
@@ -0,0 +1,21 @@
+create table if not exists record_dat_messages (
+`records_data_messages_id` STRING,
+`records_data_id` STRING,
+`record_dat_message_date` TIMESTAMP,
+`record_dat_message_message_text` STRING,
+`record_dat_message_message_type` TINYINT
+) ;
+INSERT INTO TABLE record_dat_messages
+SELECT
+ concat_ws('.', data_exp.id, CAST(messages_pos AS STRING)) AS records_data_messages_id,
+data_exp.id AS records_data_id,
+messages_exp.date AS record_dat_message_date,
+translate(messages_exp.message.text, '
+', '  ') AS record_dat_message_message_text,
+messages_exp.message.type AS record_dat_message_message_type 
+FROM (SELECT
+ concat_ws('.', records_exp.id.oid, CAST(data_pos AS STRING)) AS id,
+data_exp.messages AS messages 
+FROM mongorecords
+ AS records_exp LATERAL VIEW POSEXPLODE(records_exp.data) data_e AS data_pos, data_exp)
+ AS data_exp LATERAL VIEW POSEXPLODE(data_exp.messages) messages_e AS messages_pos, messages_exp;
\ No newline at end of file
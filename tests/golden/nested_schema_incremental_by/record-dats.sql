@@ -0,0 +1,15 @@
+create table if not exists record_dats (
+`records_data_id` STRING,
+`records_id` STRING,
+`record_dat_type` STRING,
+`record_dat_n` INT
+) ;
+INSERT INTO TABLE record_dats
+SELECT
+ concat_ws('.', records_exp.id.oid, CAST(data_pos AS STRING)) AS records_data_id,
+records_exp.id.oid AS records_id,
+translate(data_exp.type, '
+', '  ') AS record_dat_type,
+data_exp.n AS record_dat_n 
+FROM mongorecords
+ AS records_exp LATERAL VIEW POSEXPLODE(records_exp.data) data_e AS data_pos, data_exp;
\ No newline at end of file
@@ -0,0 +1,12 @@
+create table if not exists record_nums (
+`records_nums_id` STRING,
+`records_id` STRING,
+`num` INT
+) ;
+INSERT INTO TABLE record_nums
+SELECT
+ concat_ws('.', records_exp.id.oid, CAST(nums_pos AS STRING)) AS records_nums_id,
+records_exp.id.oid AS records_id,
+nums_exp AS num 
+FROM mongorecords
+ AS records_exp LATERAL VIEW POSEXPLODE(records_exp.nums) nums_e AS nums_pos, nums_exp;
\ No newline at end of file
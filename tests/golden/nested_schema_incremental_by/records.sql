@@ -0,0 +1,19 @@
+create table if not exists records (
+`id_oid` STRING,
+`id_bsontype` INT,
+`some_field` BOOLEAN,
+`addr_city` STRING,
+`addr_geo_lat` DOUBLE,
+`addr_geo_lon` DOUBLE
+) ;
+INSERT INTO TABLE records
+SELECT
+ translate(id.oid, '
+', '  ') AS id_oid,
+id.bsontype AS id_bsontype,
+some_field AS some_field,
+translate(addr.city, '
+', '  ') AS addr_city,
+addr.geo.lat AS addr_geo_lat,
+addr.geo.lon AS addr_geo_lon 
+FROM mongorecords;
\ No newline at end of file
@@ -0,0 +1 @@
+SELECT max(id_oid) FROM records;
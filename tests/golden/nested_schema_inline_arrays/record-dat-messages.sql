@@ -0,0 +1,18 @@
+drop table record_dat_messages; create table record_dat_messages  as
+SELECT
+ row_number() OVER(ORDER BY data_exp.id) AS records_data_messages_id,
+data_exp.id AS records_data_id,
+messages_exp.date AS record_dat_message_date,
+CAST(translate(messages_exp.message.text, '
+', '  ') AS VARCHAR(2)) AS record_dat_message_message_text,
+messages_exp.message.type AS record_dat_message_message_type,
+CAST(translate(messages_exp.tags[0], '
+', '  ') AS VARCHAR(1)) AS record_dat_message_tags_0,
+CAST(translate(messages_exp.tags[1], '
+', '  ') AS VARCHAR(1)) AS record_dat_message_tags_1 
+FROM (SELECT
+ row_number() OVER(ORDER BY records_exp.id) AS id,
+data_exp.messages AS messages 
+FROM mongorecords
+ AS records_exp LATERAL VIEW EXPLODE(records_exp.data) data_e AS data_exp)
+ AS data_exp LATERAL VIEW EXPLODE(data_exp.messages) messages_e AS messages_exp;
\ No newline at end of file
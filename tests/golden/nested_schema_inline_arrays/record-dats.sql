@@ -0,0 +1,9 @@
+drop table record_dats; create table record_dats  as
+SELECT
+ row_number() OVER(ORDER BY records_exp.id) AS records_data_id,
+records_exp.id.oid AS records_id,
+CAST(translate(data_exp.type, '
+', '  ') AS VARCHAR(1)) AS record_dat_type,
+CAST(data_exp.n AS SMALLINT) AS record_dat_n 
+FROM mongorecords
+ AS records_exp LATERAL VIEW EXPLODE(records_exp.data) data_e AS data_exp;
\ No newline at end of file
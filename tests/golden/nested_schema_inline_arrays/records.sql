@@ -0,0 +1,13 @@
+drop table records; create table records  as
+SELECT
+ translate(id.oid, '
+', '  ') AS id_oid,
+id.bsontype AS id_bsontype,
+some_field AS some_field,
+CAST(translate(addr.city, '
+', '  ') AS VARCHAR(4)) AS addr_city,
+addr.geo.lat AS addr_geo_lat,
+addr.geo.lon AS addr_geo_lon,
+CAST(nums[0] AS SMALLINT) AS nums_0,
+CAST(nums[1] AS SMALLINT) AS nums_1 
+FROM mongorecords;
\ No newline at end of file
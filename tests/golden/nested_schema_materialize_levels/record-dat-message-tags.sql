@@ -0,0 +1,9 @@
+drop table record_dat_message_tags; create table record_dat_message_tags  as
+SELECT
+ row_number() OVER(ORDER BY messages_level.id) AS records_data_messages_tags_id,
+messages_level.id AS records_data_messages_id,
+translate(tags_exp, '
+', '  ') AS tag 
+FROM record_dat_messages_level messages_level
+LATERAL VIEW EXPLODE(messages_level.messages_exp.tags) tags_e AS tags_exp;
+drop table record_dat_messages_level;
\ No newline at end of file
@@ -0,0 +1,17 @@
+drop table record_dat_messages_level; create table record_dat_messages_level STORED AS orc as
+SELECT
+ row_number() OVER(ORDER BY data_level.id) AS id,
+data_level.id AS parent_id,
+messages_exp 
+FROM record_dats_level data_level
+LATERAL VIEW EXPLODE(data_level.data_exp.messages) messages_e AS messages_exp;
+drop table record_dat_messages; create table record_dat_messages  as
+SELECT
+ id AS records_data_messages_id,
+parent_id AS records_data_id,
+messages_exp.date AS record_dat_message_date,
+translate(messages_exp.message.text, '
+', '  ') AS record_dat_message_message_text,
+messages_exp.message.type AS record_dat_message_message_type 
+FROM record_dat_messages_level;
+drop table record_dats_level;
\ No newline at end of file
@@ -0,0 +1,15 @@
+drop table record_dats_level; create table record_dats_level STORED AS orc as
+SELECT
+ row_number() OVER(ORDER BY records_exp.id) AS id,
+records_exp.id.oid AS parent_id,
+data_exp 
+FROM mongorecords records_exp
+LATERAL VIEW EXPLODE(records_exp.data) data_e AS data_exp;
+drop table record_dats; create table record_dats  as
+SELECT
+ id AS records_data_id,
+parent_id AS records_id,
+translate(data_exp.type, '
+', '  ') AS record_dat_type,
+data_exp.n AS record_dat_n 
+FROM record_dats_level;
\ No newline at end of file
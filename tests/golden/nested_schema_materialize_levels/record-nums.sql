@@ -0,0 +1,7 @@
+drop table record_nums; create table record_nums  as
+SELECT
+ row_number() OVER(ORDER BY records_exp.id) AS records_nums_id,
+records_exp.id.oid AS records_id,
+nums_exp AS num 
+FROM mongorecords records_exp
+LATERAL VIEW EXPLODE(records_exp.nums) nums_e AS nums_exp;
\ No newline at end of file
@@ -0,0 +1,26 @@
+SET hive.exec.dynamic.partition=true;
+SET hive.exec.dynamic.partition.mode=nonstrict;
+drop table record_dat_message_tags; create table record_dat_message_tags (
+`records_data_messages_tags_id` INT,
+`records_data_messages_id` INT,
+`tag` STRING
+) PARTITIONED BY (partition_date STRING) ;
+INSERT OVERWRITE TABLE record_dat_message_tags PARTITION (partition_date)
+SELECT
+ row_number() OVER(ORDER BY messages_exp.id) AS records_data_messages_tags_id,
+messages_exp.id AS records_data_messages_id,
+translate(tags_exp, '
+', '  ') AS tag,
+messages_exp.partition_date AS partition_date 
+FROM (SELECT
+ row_number() OVER(ORDER BY data_exp.id) AS id,
+messages_exp.tags AS tags,
+data_exp.partition_date AS partition_date 
+FROM (SELECT
+ row_number() OVER(ORDER BY records_exp.id) AS id,
+data_exp.messages AS messages,
+from_unixtime(CAST(conv(substr(records_exp.id.oid, 1, 8), 16, 10) AS BIGINT), 'yyyy-MM') AS partition_date 
+FROM mongorecords
+ AS records_exp LATERAL VIEW EXPLODE(records_exp.data) data_e AS data_exp)
+ AS data_exp LATERAL VIEW EXPLODE(data_exp.messages) messages_e AS messages_exp)
+ AS messages_exp LATERAL VIEW EXPLODE(messages_exp.tags) tags_e AS tags_exp;
\ No newline at end of file
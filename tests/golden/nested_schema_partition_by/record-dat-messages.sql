@@ -0,0 +1,25 @@
+SET hive.exec.dynamic.partition=true;
+SET hive.exec.dynamic.partition.mode=nonstrict;
+drop table record_dat_messages; create table record_dat_messages (
+`records_data_messages_id` INT,
+`records_data_id` INT,
+`record_dat_message_date` TIMESTAMP,
+`record_dat_message_message_text` STRING,
+`record_dat_message_message_type` TINYINT
+) PARTITIONED BY (partition_date STRING) ;
+INSERT OVERWRITE TABLE record_dat_messages PARTITION (partition_date)
+SELECT
+ row_number() OVER(ORDER BY data_exp.id) AS records_data_messages_id,
+data_exp.id AS records_data_id,
+messages_exp.date AS record_dat_message_date,
+translate(messages_exp.message.text, '
+', '  ') AS record_dat_message_message_text,
+messages_exp.message.type AS record_dat_message_message_type,
+data_exp.partition_date AS partition_date 
+FROM (SELECT
+ row_number() OVER(ORDER BY records_exp.id) AS id,
+data_exp.messages AS messages,
+from_unixtime(CAST(conv(substr(records_exp.id.oid, 1, 8), 16, 10) AS BIGINT), 'yyyy-MM') AS partition_date 
+FROM mongorecords
+ AS records_exp LATERAL VIEW EXPLODE(records_exp.data) data_e AS data_exp)
+ AS data_exp LATERAL VIEW EXPLODE(data_exp.messages) messages_e AS messages_exp;
\ No newline at end of file
@@ -0,0 +1,18 @@
+SET hive.exec.dynamic.partition=true;
+SET hive.exec.dynamic.partition.mode=nonstrict;
+drop table record_dats; create table record_dats (
+`records_data_id` INT,
+`records_id` STRING,
+`record_dat_type` STRING,
+`record_dat_n` INT
+) PARTITIONED BY (partition_date STRING) ;
+INSERT OVERWRITE TABLE record_dats PARTITION (partition_date)
+SELECT
+ row_number() OVER(ORDER BY records_exp.id) AS records_data_id,
+records_exp.id.oid AS records_id,
+translate(data_exp.type, '
+', '  ') AS record_dat_type,
+data_exp.n AS record_dat_n,
+from_unixtime(CAST(conv(substr(records_exp.id.oid, 1, 8), 16, 10) AS BIGINT), 'yyyy-MM') AS partition_date 
+FROM mongorecords
+ AS records_exp LATERAL VIEW EXPLODE(records_exp.data) data_e AS data_exp;
\ No newline at end of file
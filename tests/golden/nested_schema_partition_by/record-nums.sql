@@ -0,0 +1,15 @@
+SET hive.exec.dynamic.partition=true;
+SET hive.exec.dynamic.partition.mode=nonstrict;
+drop table record_nums; create table record_nums (
+`records_nums_id` INT,
+`records_id` STRING,
+`num` INT
+) PARTITIONED BY (partition_date STRING) ;
+INSERT OVERWRITE TABLE record_nums PARTITION (partition_date)
+SELECT
+ row_number() OVER(ORDER BY records_exp.id) AS records_nums_id,
+records_exp.id.oid AS records_id,
+nums_exp AS num,
+from_unixtime(CAST(conv(substr(records_exp.id.oid, 1, 8), 16, 10) AS BIGINT), 'yyyy-MM') AS partition_date 
+FROM mongorecords
+ AS records_exp LATERAL VIEW EXPLODE(records_exp.nums) nums_e AS nums_exp;
\ No newline at end of file
@@ -0,0 +1,22 @@
+SET hive.exec.dynamic.partition=true;
+SET hive.exec.dynamic.partition.mode=nonstrict;
+drop table records; create table records (
+`id_oid` STRING,
+`id_bsontype` INT,
+`some_field` BOOLEAN,
+`addr_city` STRING,
+`addr_geo_lat` DOUBLE,
+`addr_geo_lon` DOUBLE
+) PARTITIONED BY (partition_date STRING) ;
+INSERT OVERWRITE TABLE records PARTITION (partition_date)
+SELECT
+ translate(id.oid, '
+', '  ') AS id_oid,
+id.bsontype AS id_bsontype,
+some_field AS some_field,
+translate(addr.city, '
+', '  ') AS addr_city,
+addr.geo.lat AS addr_geo_lat,
+addr.geo.lon AS addr_geo_lon,
+from_unixtime(CAST(conv(substr(id.oid, 1, 8), 16, 10) AS BIGINT), 'yyyy-MM') AS partition_date 
+FROM mongorecords;
\ No newline at end of file
@@ -0,0 +1,15 @@
+drop table record_dat_messages; create table record_dat_messages STORED AS orc TBLPROPERTIES('orc.compress'='SNAPPY', 'orc.stripe.size'='67108864', 'orc.bloom.filter.columns'='records_data_messages_id,records_data_id') as
+SELECT
+ row_number() OVER(ORDER BY data_exp.id) AS records_data_messages_id,
+data_exp.id AS records_data_id,
+messages_exp.date AS record_dat_message_date,
+translate(messages_exp.message.text, '
+', '  ') AS record_dat_message_message_text,
+messages_exp.message.type AS record_dat_message_message_type 
+FROM (SELECT
+ row_number() OVER(ORDER BY records_exp.id) AS id,
+data_exp.messages AS messages 
+FROM mongorecords
+ AS records_exp LATERAL VIEW EXPLODE(records_exp.data) data_e AS data_exp)
+ AS data_exp LATERAL VIEW EXPLODE(data_exp.messages) messages_e AS messages_exp;
+ANALYZE TABLE record_dat_messages COMPUTE STATISTICS FOR COLUMNS;
\ No newline at end of file
@@ -0,0 +1,9 @@
+drop table record_dats; create table record_dats STORED AS orc TBLPROPERTIES('orc.compress'='SNAPPY', 'orc.stripe.size'='67108864') as
+SELECT
+ row_number() OVER(ORDER BY records_exp.id) AS records_data_id,
+records_exp.id.oid AS records_id,
+translate(data_exp.type, '
+', '  ') AS record_dat_type,
+data_exp.n AS record_dat_n 
+FROM mongorecords
+ AS records_exp LATERAL VIEW EXPLODE(records_exp.data) data_e AS data_exp;
\ No newline at end of file
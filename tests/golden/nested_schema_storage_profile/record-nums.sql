@@ -0,0 +1,8 @@
+drop table record_nums; create table record_nums STORED AS parquet TBLPROPERTIES('parquet.compression'='GZIP', 'parquet.block.size'='67108864') as
+SELECT
+ row_number() OVER(ORDER BY records_exp.id) AS records_nums_id,
+records_exp.id.oid AS records_id,
+nums_exp AS num 
+FROM mongorecords
+ AS records_exp LATERAL VIEW EXPLODE(records_exp.nums) nums_e AS nums_exp;
+ANALYZE TABLE record_nums COMPUTE STATISTICS FOR COLUMNS;
\ No newline at end of file
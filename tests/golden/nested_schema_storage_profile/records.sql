@@ -0,0 +1,13 @@
+drop table records; create table records STORED AS orc TBLPROPERTIES('orc.compress'='SNAPPY', 'orc.stripe.size'='67108864', 'orc.bloom.filter.columns'='addr_city,id_oid') as
+SELECT
+ translate(id.oid, '
+', '  ') AS id_oid,
+id.bsontype AS id_bsontype,
+some_field AS some_field,
+translate(addr.city, '
+', '  ') AS addr_city,
+addr.geo.lat AS addr_geo_lat,
+addr.geo.lon AS addr_geo_lon 
+FROM mongorecords
+SORT BY id_oid;
+ANALYZE TABLE records COMPUTE STATISTICS FOR COLUMNS;
\ No newline at end of file
@@ -0,0 +1,30 @@
+drop table mongorecords;
+create external table mongorecords (
+    `nums` ARRAY
+    <
+        INT        
+    >,
+    `data` ARRAY
+    <
+        STRUCT
+        <
+            `geo`:STRUCT
+            <
+                `lat`:DOUBLE,
+                `lon`:DOUBLE                
+            >,
+            `type`:STRING,
+            `n`:INT            
+        >        
+    >,
+    `id` STRUCT
+    <
+        `oid`:STRING,
+        `bsontype`:INT        
+    >,
+    `name` STRING    
+)
+
+STORED BY 'com.mongodb.hadoop.hive.MongoStorageHandler'
+WITH SERDEPROPERTIES('mongo.columns.mapping'='{"id.oid": "_id.oid", "id.bsontype": "_id.bsontype", "data.type": "data._type"}')
+TBLPROPERTIES('mongo.uri'='mongodb://localhost:27017/db.records');
@@ -0,0 +1,42 @@
+drop table record_dats; create table record_dats (
+`records_data_id` INT,
+`records_id` STRING,
+`record_dat_geo_lat` DOUBLE,
+`record_dat_geo_lon` DOUBLE,
+`record_dat_type` STRING,
+`record_dat_n` INT
+) ;
+drop table record_nums; create table record_nums (
+`records_nums_id` INT,
+`records_id` STRING,
+`num` INT
+) ;
+drop table records; create table records (
+`id_oid` STRING,
+`id_bsontype` INT,
+`name` STRING
+) ;
+FROM mongorecords records_exp
+INSERT OVERWRITE TABLE record_dats
+SELECT
+ row_number() OVER(ORDER BY records_exp.id) AS records_data_id,
+records_exp.id.oid AS records_id,
+data_exp.geo.lat AS record_dat_geo_lat,
+data_exp.geo.lon AS record_dat_geo_lon,
+translate(data_exp.type, '
+', '  ') AS record_dat_type,
+data_exp.n AS record_dat_n
+LATERAL VIEW EXPLODE(records_exp.data) data_e AS data_exp
+INSERT OVERWRITE TABLE record_nums
+SELECT
+ row_number() OVER(ORDER BY records_exp.id) AS records_nums_id,
+records_exp.id.oid AS records_id,
+nums_exp AS num
+LATERAL VIEW EXPLODE(records_exp.nums) nums_e AS nums_exp
+INSERT OVERWRITE TABLE records
+SELECT
+ translate(id.oid, '
+', '  ') AS id_oid,
+id.bsontype AS id_bsontype,
+translate(name, '
+', '  ') AS name;
\ No newline at end of file
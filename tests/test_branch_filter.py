@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+"""Branch filter applied during inference must agree with filter
+applied by hiveql generator to unfiltered schema"""
+
+import unittest
+import bson
+from bson.objectid import ObjectId
+
+from metrics import Metrics
+from branch_filter import BranchFilter
+from get_mongo_schema_as_json import RecordShapeCache, ValuesStats, fold_records, \
+    prepare_schema_for_serialization, get_projection
+
+records = [{'_id': ObjectId(), 'name': u'a', 'ref': {'user': ObjectId(), 'n': 1},
+            'items': [{'owner': ObjectId(), 'q': 2}]},
+           {'_id': ObjectId(), 'name': u'b', 'ref': {'user': ObjectId(), 'n': 2},
+            'items': [{'owner': ObjectId(), 'q': 3}, {'owner': ObjectId(), 'q': 4}]}]
+
+def infer(branch_filter, shape_cache_size, raw=False):
+    """Serialized schema of records as made by get_mongo_schema_as_json.py"""
+    shape_cache = RecordShapeCache(shape_cache_size, branch_filter)
+    schema = {}
+    for record in records:
+        if raw:
+            schema = shape_cache.fold_raw(bson.BSON.encode(record), schema)
+        else:
+            schema = shape_cache.fold(record, schema)
+    schema = prepare_schema_for_serialization(schema)
+    if branch_filter is not None:
+        branch_filter.prune_schema(schema)
+    return schema
+
+def collect_stats(branch_filter, raw):
+    """Branches of statistics of values collected with schema"""
+    values_stats = ValuesStats()
+    data = records
+    if raw:
+        data = [bson.BSON.encode(record) for record in records]
+    fold_records(data, {}, RecordShapeCache(1024, branch_filter), Metrics(), values_stats=values_stats, raw=raw)
+    return sorted(values_stats.branches)
+
+class TestObjectIdFilter(unittest.TestCase):
+
+    def check_patterns(self, include_patterns, exclude_patterns, expected):
+        for shape_cache_size in [0, 1024]:
+            for raw in [False, True]:
+                schema = infer(BranchFilter(include_patterns, exclude_patterns), shape_cache_size, raw)
+                self.assertEqual(schema, expected)
+                #generator prunes schema inferred without filter
+                pruned = BranchFilter(include_patterns, exclude_patterns).prune_schema(infer(None, shape_cache_size))
+                self.assertEqual(schema, pruned)
+
+    def test_include_oid_of_id(self):
+        self.check_patterns(['_id.oid'], None, {'_id': {'oid': 'STRING'}})
+
+    def test_include_oid_by_glob(self):
+        self.check_patterns(['*.oid'], None, {'_id': {'oid': 'STRING'}})
+
+    def test_include_nested_oids(self):
+        self.check_patterns(['**.oid'], None, {'_id': {'oid': 'STRING'},
+                                               'ref': {'user': {'oid': 'STRING'}},
+                                               'items': [{'owner': {'oid': 'STRING'}}]})
+
+    def test_include_whole_objectid(self):
+        self.check_patterns(['ref.user', 'items.*'], None,
+                            {'ref': {'user': {'oid': 'STRING', 'bsontype': 'INT'}},
+                             'items': [{'owner': {'oid': 'STRING', 'bsontype': 'INT'}, 'q': 'INT'}]})
+
+    def test_exclude_part_of_objectid(self):
+        self.check_patterns(None, ['**.bsontype', 'name', 'items'], {'_id': {'oid': 'STRING'},
+                                                                  'ref': {'user': {'oid': 'STRING'}, 'n': 'INT'}})
+
+    def test_stats_skip_filtered_branches(self):
+        for raw in [False, True]:
+            self.assertEqual(collect_stats(BranchFilter(None, ['items', 'ref.n']), raw),
+                             ['_id.bsontype', '_id.oid', 'name', 'ref.user.bsontype', 'ref.user.oid'])
+            self.assertEqual(collect_stats(BranchFilter(['**.oid'], None), raw),
+                             ['_id.oid', 'items.owner.oid', 'ref.user.oid'])
+
+    def test_projection_of_objectid_fields(self):
+        #server has no paths under ObjectId, whole ObjectId is requested
+        self.assertEqual(get_projection(['_id.oid', 'ref.user.oid', 'ref.n'], None),
+                         {'_id': 1, 'ref.user': 1, 'ref.n': 1})
+        self.assertEqual(get_projection(['ref.user.bsontype', 'ref'], None), {'ref': 1})
+        self.assertEqual(get_projection(['*.oid'], None), None)
+        #part of ObjectId is not excluded by server
+        self.assertEqual(get_projection(None, ['_id.bsontype', 'items']), {'items': 0})
+        self.assertEqual(get_projection(None, ['**.bsontype']), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
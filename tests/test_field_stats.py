@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+"""Statistics of values narrow types of columns and drop empty branches
+unless they are collected from sample of records"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+script_name = os.path.join(os.path.dirname(tests_dir), 'get_hiveql_create_tables_by_schema.py')
+schema_file_name = os.path.join(tests_dir, 'data', 'one_level_schema.json')
+
+def get_stats(sampled):
+    return {"records": 10, "arrays": {}, "sampled": sampled,
+            "branches": {"name": {"records": 10, "values": 10, "nulls": 0, "types": {"STRING": 10},
+                                  "max_length": 5},
+                         "data.n": {"records": 0, "values": 10, "nulls": 10, "types": {}}}}
+
+class TestFieldStats(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def generate(self, stats):
+        """Generate scripts using statistics, returns scripts of base
+        table and of data array"""
+        stats_file_name = os.path.join(self.tmp_dir, 'stats.json')
+        with open(stats_file_name, 'w') as stats_file:
+            json.dump(stats, stats_file)
+        output_dir = os.path.join(self.tmp_dir, 'hiveql')
+        shutil.rmtree(output_dir, ignore_errors=True)
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call([sys.executable, script_name, '-ifs', schema_file_name, '-tn', 'records',
+                                   '-od', output_dir, '-field-stats', stats_file_name,
+                                   '--mongouri', 'mongodb://localhost:27017/db.records'], stderr=devnull)
+        scripts = []
+        for name in ['records.sql', 'record-dats.sql']:
+            with open(os.path.join(output_dir, name), 'r') as script_file:
+                scripts.append(script_file.read())
+        return scripts
+
+    def test_narrowed(self):
+        records_script, data_script = self.generate(get_stats(False))
+        self.assertIn("VARCHAR(8)", records_script)
+        self.assertNotIn("record_dat_n", data_script)
+
+    def test_sampled(self):
+        records_script, data_script = self.generate(get_stats(True))
+        self.assertNotIn("VARCHAR", records_script)
+        self.assertIn("record_dat_n", data_script)
+
+
+if __name__ == '__main__':
+    unittest.main()
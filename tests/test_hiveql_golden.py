@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""Hiveql scripts generated for nested schema must be byte identical to
+golden files made by recursive generator preceding iterative one, and
+scripts of every generation mode to golden files of that mode"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import subprocess
+from StringIO import StringIO
+
+import get_hiveql_create_tables_by_schema as hive
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+script_name = os.path.join(os.path.dirname(tests_dir), 'get_hiveql_create_tables_by_schema.py')
+schema_file_name = os.path.join(tests_dir, 'data', 'nested_schema.json')
+golden_dir = os.path.join(tests_dir, 'golden', 'nested_schema')
+golden_external_table = os.path.join(tests_dir, 'golden', 'nested_schema_external_table.txt')
+one_level_schema_file_name = os.path.join(tests_dir, 'data', 'one_level_schema.json')
+golden_multi_insert_dir = os.path.join(tests_dir, 'golden', 'one_level_schema_multi_insert')
+golden_materialize_levels_dir = os.path.join(tests_dir, 'golden', 'nested_schema_materialize_levels')
+golden_partition_by_dir = os.path.join(tests_dir, 'golden', 'nested_schema_partition_by')
+golden_incremental_by_dir = os.path.join(tests_dir, 'golden', 'nested_schema_incremental_by')
+storage_profile_file_name = os.path.join(tests_dir, 'data', 'storage_profile.json')
+golden_storage_profile_dir = os.path.join(tests_dir, 'golden', 'nested_schema_storage_profile')
+field_stats_file_name = os.path.join(tests_dir, 'data', 'nested_schema.stats.json')
+golden_inline_arrays_dir = os.path.join(tests_dir, 'golden', 'nested_schema_inline_arrays')
+
+def read_file(file_name):
+    with open(file_name, 'r') as input_file:
+        return input_file.read()
+
+class TestHiveqlGolden(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = os.path.join(tempfile.mkdtemp(), 'hiveql')
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.output_dir))
+
+    def get_canonical_schema(self):
+        with open(schema_file_name, 'r') as schema_file:
+            return hive.get_canonical_hive_schema(json.load(schema_file))
+
+    def test_external_table(self):
+        schema = self.get_canonical_schema()
+        golden = read_file(golden_external_table)
+        self.assertEqual(hive.generate_external_hive_table(0, schema), golden)
+        output_file = StringIO()
+        hive.write_external_hive_table(output_file, schema)
+        self.assertEqual(output_file.getvalue(), golden)
+
+    def generate(self, schema_file_name, output_dir, options=[]):
+        """Run generator, returns its exit code"""
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call([sys.executable, script_name, '-ifs', schema_file_name, '-tn', 'records',
+                                    '-od', output_dir, '--mongouri', 'mongodb://localhost:27017/db.records'] + options,
+                                   stderr=devnull)
+
+    def check_golden(self, output_dir, golden_dir):
+        self.assertEqual(sorted(os.listdir(output_dir)), sorted(os.listdir(golden_dir)))
+        for name in os.listdir(golden_dir):
+            self.assertEqual(read_file(os.path.join(output_dir, name)),
+                             read_file(os.path.join(golden_dir, name)), name)
+
+    def test_plain_tables(self):
+        self.assertEqual(self.generate(schema_file_name, self.output_dir), 0)
+        self.check_golden(self.output_dir, golden_dir)
+
+    def test_multi_insert(self):
+        os.mkdir(self.output_dir)
+        for key_strategy in ['row_number', 'hash']:
+            output_dir = os.path.join(self.output_dir, key_strategy)
+            self.assertEqual(self.generate(one_level_schema_file_name, output_dir,
+                                           ['-multi-insert', '-key-strategy', key_strategy]), 0)
+            self.check_golden(output_dir, os.path.join(golden_multi_insert_dir, key_strategy))
+
+    def test_materialize_levels(self):
+        self.assertEqual(self.generate(schema_file_name, self.output_dir, ['-materialize-levels']), 0)
+        self.check_golden(self.output_dir, golden_materialize_levels_dir)
+
+    def test_partition_by(self):
+        self.assertEqual(self.generate(schema_file_name, self.output_dir,
+                                       ['-partition-by', '_id', '-partition-granularity', 'monthly']), 0)
+        self.check_golden(self.output_dir, golden_partition_by_dir)
+        #only ObjectId or TIMESTAMP branch of base record
+        self.assertEqual(self.generate(schema_file_name, self.output_dir+'_n', ['-partition-by', 'some_field']), 1)
+
+    def test_incremental_by(self):
+        self.assertEqual(self.generate(schema_file_name, self.output_dir, ['-incremental-by', '_id']), 0)
+        self.check_golden(self.output_dir, golden_incremental_by_dir)
+        #only ObjectId, TIMESTAMP or number branch of base record
+        self.assertEqual(self.generate(schema_file_name, self.output_dir+'_n', ['-incremental-by', 'some_field']), 1)
+
+    def test_storage_profile(self):
+        self.assertEqual(self.generate(schema_file_name, self.output_dir,
+                                       ['-storage-profile', storage_profile_file_name]), 0)
+        self.check_golden(self.output_dir, golden_storage_profile_dir)
+
+    def test_inline_arrays(self):
+        #arrays of scalars are inlined, arrays of items having arrays keep own tables
+        self.assertEqual(self.generate(schema_file_name, self.output_dir,
+                                       ['-field-stats', field_stats_file_name, '-inline-arrays-max-length', '2']), 0)
+        self.check_golden(self.output_dir, golden_inline_arrays_dir)
+
+    def test_multi_insert_nested_arrays(self):
+        #insert of multi-insert can have only one lateral view
+        self.assertEqual(self.generate(schema_file_name, self.output_dir, ['-multi-insert']), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
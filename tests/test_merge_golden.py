@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+"""Schema and provenance of N-way merge must be equal to golden files
+whatever count of workers reduces partial schemas"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+script_name = os.path.join(os.path.dirname(tests_dir), 'merge_schemas.py')
+#relative to tests dir, as input names are written into provenance
+schemas_dir = os.path.join('data', 'merge_schemas')
+golden_dir = os.path.join(tests_dir, 'golden', 'merge_schemas')
+
+def read_file(file_name):
+    with open(file_name, 'r') as input_file:
+        return input_file.read()
+
+class TestMergeGolden(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def merge(self, workers):
+        """Run merge of schemas dir, returns its exit code"""
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call([sys.executable, script_name, '--schemas', schemas_dir,
+                                    '--merged-schema', os.path.join(self.output_dir, 'merged_schema.json'),
+                                    '--provenance-file', os.path.join(self.output_dir, 'provenance.json'),
+                                    '--workers', str(workers)],
+                                   cwd=tests_dir, stdout=devnull, stderr=devnull)
+
+    def test_provenance(self):
+        #odd count of inputs is reduced by uneven levels
+        for workers in [1, 2, 3]:
+            self.assertEqual(self.merge(workers), 0)
+            for name in ['merged_schema.json', 'provenance.json']:
+                self.assertEqual(read_file(os.path.join(self.output_dir, name)),
+                                 read_file(os.path.join(golden_dir, name)), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+"""Workers add counts of handled records and bytes to progress shared
+with parent before their results are ready"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import bson
+from bson.objectid import ObjectId
+
+from metrics import Metrics, SharedProgress
+import get_mongo_schema_as_json
+from get_mongo_schema_as_json import RecordShapeCache, fold_records, get_file_schema
+
+records = [{'_id': ObjectId(), 'n': i, 's': u'x' * i} for i in xrange(2500)]
+
+class TestSharedProgress(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.dir_name, 'records.bson')
+        with open(self.file_name, 'wb') as bson_file:
+            for record in records:
+                bson_file.write(bson.BSON.encode(record))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def test_worker_progress(self):
+        data = [bson.BSON.encode(record) for record in records]
+        for raw in [False, True]:
+            shared_progress = SharedProgress()
+            metrics = Metrics(progress_interval=None, shared_progress=shared_progress)
+            fold_records(iter(data), {}, RecordShapeCache(0), metrics, raw=raw)
+            #counts are shared once per progress_check_records records and when records end
+            self.assertEqual(shared_progress.get(), (len(data), sum(map(len, data))))
+            self.assertEqual(metrics.counters['bytes'], sum(map(len, data)))
+
+    def test_file_workers(self):
+        metrics = Metrics(progress_interval=0.0)
+        schema = get_file_schema(self.file_name, 'bson', 2, 0, metrics)
+        self.assertEqual(schema['s'], 'STRING')
+        self.assertEqual(metrics.counters['records'], len(records))
+        self.assertEqual(metrics.counters['bytes'], os.path.getsize(self.file_name))
+        self.assertIsNone(get_mongo_schema_as_json.worker_progress)
+
+
+if __name__ == '__main__':
+    unittest.main()
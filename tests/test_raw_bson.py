@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+"""Schema folded from raw bson without decoding of values equals schema
+of decoded records"""
+
+import datetime
+import unittest
+import bson
+from bson.binary import Binary
+from bson.code import Code
+from bson.decimal128 import Decimal128
+from bson.int64 import Int64
+from bson.objectid import ObjectId
+from bson.timestamp import Timestamp
+
+from branch_filter import BranchFilter
+from get_mongo_schema_as_json import RecordShapeCache, ValuesStats, prepare_schema_for_serialization, \
+    restore_schema_from_serialization
+
+records = [{'_id': ObjectId(), 's': u'text', 'i': 1, 'l': Int64(2), 'f': 1.5, 'b': True, 'n': None,
+            'd': datetime.datetime(2000, 1, 1), 'bin': Binary('\x00' * 1024),
+            'uuid': Binary('\x01' * 16, 4), 'sub': {'a': [1, {'bin': Binary('x', 128)}]},
+            u'k\u00e9y': 1},
+           {'_id': ObjectId(), 's': None, 'i': 2.0, 'l': 3, 'f': 1, 'b': 1, 'n': {'x': [2.5]},
+            'sub': {'a': [], 'e': [{}], 'ts': Timestamp(0, 1)}, 'code': Code('f'), 'dec': Decimal128('1.5'),
+            'ts': Timestamp(0, 2)},
+           {'_id': 3, 'i': [1], 'sub': [{'a': [[1]]}], 'e': []}]
+
+def fold(branch_filter, raw):
+    shape_cache = RecordShapeCache(1024, branch_filter)
+    schema = {}
+    for record in records:
+        if raw:
+            schema = shape_cache.fold_raw(bson.BSON.encode(record), schema)
+        else:
+            schema = shape_cache.fold(bson.BSON(bson.BSON.encode(record)).decode(), schema)
+    return schema
+
+class TestRawBson(unittest.TestCase):
+
+    def test_types(self):
+        self.assertEqual(fold(None, True), fold(None, False))
+        self.assertEqual(fold(None, True)['n'], {'x': [float]})
+
+    def test_serialization(self):
+        #bson types having no hive counterpart are written as string or binary
+        schema = prepare_schema_for_serialization(fold(None, True))
+        self.assertEqual(schema['bin'], 'BINARY')
+        self.assertEqual(schema['uuid'], 'STRING')
+        self.assertEqual(schema['ts'], 'STRING')
+        self.assertEqual(schema['code'], 'STRING')
+        self.assertEqual(schema['dec'], 'STRING')
+        self.assertEqual(prepare_schema_for_serialization(restore_schema_from_serialization(schema)), schema)
+        stats = ValuesStats()
+        for record in records:
+            stats.add_record(bson.BSON(bson.BSON.encode(record)).decode())
+        branches = stats.as_dict()['branches']
+        self.assertEqual(branches['bin']['types'], {'BINARY': 1})
+        self.assertEqual(branches['uuid']['max_length'], 36)
+
+    def test_branch_filter(self):
+        for include_patterns, exclude_patterns in [(None, ['sub.a', '**.oid']), (['sub.a', 'n.*'], None)]:
+            self.assertEqual(fold(BranchFilter(include_patterns, exclude_patterns), True),
+                             fold(BranchFilter(include_patterns, exclude_patterns), False))
+
+
+if __name__ == '__main__':
+    unittest.main()
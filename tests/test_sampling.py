@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+"""Stratified sampling returns sample of requested size even if time
+buckets of _id values are skewed or empty"""
+
+import struct
+import unittest
+from bson.objectid import ObjectId
+
+from get_mongo_schema_as_json import get_bucket_quotas, get_stratified_records
+from tests.fake_mongo import FakeCollection
+
+def get_records(seconds):
+    """Records having ObjectIds of given seconds, index of record is
+    counter of ObjectId"""
+    start = 1577836800
+    return [{'_id': ObjectId(struct.pack('>IQ', start + seconds[i], i))} for i in xrange(len(seconds))]
+
+class TestStratifiedSampling(unittest.TestCase):
+
+    def test_bucket_quotas(self):
+        self.assertEqual(get_bucket_quotas([100, 100, 100, 100], 40), [10, 10, 10, 10])
+        self.assertEqual(get_bucket_quotas([0, 0, 0, 100], 40), [0, 0, 0, 40])
+        self.assertEqual(get_bucket_quotas([2, 0, 100, 5], 40), [2, 0, 33, 5])
+        self.assertEqual(get_bucket_quotas([2, 3], 40), [2, 3])
+        self.assertEqual(sum(get_bucket_quotas([7, 1, 1000, 3, 0, 50], 99)), 99)
+
+    def test_same_second(self):
+        #ObjectIds of one second differ by counter only
+        records = [{'_id': ObjectId()} for i in xrange(500)]
+        sample = list(get_stratified_records(FakeCollection(records), {}, None, 100, 10))
+        self.assertEqual(len(sample), 100)
+
+    def test_skewed_buckets(self):
+        seconds = range(0, 1000, 100) + [999] * 300
+        sample = list(get_stratified_records(FakeCollection(get_records(seconds)), {}, None, 100, 10))
+        self.assertEqual(len(sample), 100)
+        self.assertEqual(len(set([r['_id'] for r in sample])), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
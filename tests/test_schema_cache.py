@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+"""Entry of schema cache is found by fingerprint of unchanged collection
+whatever type of _id values it has"""
+
+import shutil
+import datetime
+import tempfile
+import unittest
+from bson.objectid import ObjectId
+
+from schema_cache import SchemaCache
+from get_mongo_schema_as_json import get_collection_fingerprint
+from tests.fake_mongo import FakeCollection
+
+class FakeDatabase:
+
+    def __init__(self, max_id):
+        self.max_id = max_id
+
+    def command(self, name, collection_name):
+        return {'count': 10, 'size': 100}
+
+    def __getitem__(self, collection_name):
+        return FakeCollection([{'_id': self.max_id}])
+
+class TestSchemaCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def test_fingerprint(self):
+        schema_cache = SchemaCache(self.dir_name)
+        for max_id in [ObjectId(), datetime.datetime(2000, 1, 1, 12, 30), u'key', 10, 1.5]:
+            fingerprint = get_collection_fingerprint(FakeDatabase(max_id), 'coll')
+            schema_cache.put('key', fingerprint, {'a': 'INT'})
+            entry = schema_cache.get('key', get_collection_fingerprint(FakeDatabase(max_id), 'coll'))
+            self.assertIsNotNone(entry)
+            self.assertEqual(entry['schema'], {'a': 'INT'})
+            changed = get_collection_fingerprint(FakeDatabase(u'other'), 'coll')
+            self.assertIsNone(schema_cache.get('key', changed))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""Merge of serialized schemas widens only numeric types, other
+conflicting types become STRING. Walks of schema don't depend on
+recursion limit."""
+
+import json
+import unittest
+
+from schema_tree import merge_serialized_schemas, get_schema_branches, intern_schema_types
+from get_branches_for_json_schema_draft4 import get_draft4_branches
+import get_hiveql_create_tables_by_schema as hive
+
+def get_deep_schema(depth):
+    schema = {"leaf": "INT"}
+    for i in xrange(depth):
+        schema = {"a": schema, "b": "STRING"}
+    return schema
+
+class TestMergeSerializedSchemas(unittest.TestCase):
+
+    def check_merge(self, schema1, schema2, expected):
+        self.assertEqual(merge_serialized_schemas(schema1, schema2), expected)
+        self.assertEqual(merge_serialized_schemas(schema2, schema1), expected)
+
+    def test_numeric_chain(self):
+        self.check_merge("INT", "BIGINT", "BIGINT")
+        self.check_merge("INT", "DOUBLE", "DOUBLE")
+        self.check_merge("BIGINT", "DOUBLE", "DOUBLE")
+
+    def test_boolean_int(self):
+        self.check_merge("BOOLEAN", "INT", "STRING")
+
+    def test_int_timestamp(self):
+        self.check_merge("INT", "TIMESTAMP", "STRING")
+
+    def test_double_timestamp(self):
+        self.check_merge("DOUBLE", "TIMESTAMP", "STRING")
+
+    def test_null_type(self):
+        self.check_merge("TINYINT", "TIMESTAMP", "TIMESTAMP")
+        self.check_merge("TINYINT", "BOOLEAN", "BOOLEAN")
+
+    def test_empty_array(self):
+        self.check_merge({"a": []}, {"a": ["INT"]}, {"a": ["INT"]})
+        self.check_merge({"a": []}, {"a": [{"b": "INT"}]}, {"a": [{"b": "INT"}]})
+
+    def test_nested(self):
+        self.check_merge({"a": [{"b": "INT", "c": "BOOLEAN"}]},
+                         {"a": [{"b": "DOUBLE", "c": "TIMESTAMP", "d": "STRING"}]},
+                         {"a": [{"b": "DOUBLE", "c": "STRING", "d": "STRING"}]})
+
+    def test_associative(self):
+        types = ["TINYINT", "BOOLEAN", "INT", "BIGINT", "DOUBLE", "TIMESTAMP", "STRING"]
+        for type1 in types:
+            for type2 in types:
+                for type3 in types:
+                    self.assertEqual(merge_serialized_schemas(merge_serialized_schemas(type1, type2), type3),
+                                     merge_serialized_schemas(type1, merge_serialized_schemas(type2, type3)))
+
+    def test_deep_nesting(self):
+        #deeper than recursion limit
+        schema1 = "INT"
+        schema2 = "DOUBLE"
+        for i in xrange(5000):
+            schema1 = {"a": [schema1]}
+            schema2 = {"a": [schema2], "b": "STRING"}
+        merged = merge_serialized_schemas(schema1, schema2)
+        self.assertEqual(merged["b"], "STRING")
+        for i in xrange(5000):
+            merged = merged["a"][0]
+        self.assertEqual(merged, "DOUBLE")
+
+
+class TestSchemaWalks(unittest.TestCase):
+
+    schema = json.loads('{"_id": {"oid": "STRING", "bsontype": "INT"}, "name": "STRING", "empty": {}, '
+                        '"tags": ["STRING"], "matrix": [["INT"]], "items": [{"n": "INT", "sub": [{"m": "DOUBLE"}]}], '
+                        '"nothing": [{}]}')
+
+    def test_schema_branches(self):
+        self.assertEqual(sorted(get_schema_branches(self.schema, empty_struct_as_branch=False)),
+                         ['_id.bsontype', '_id.oid', 'items.n', 'items.sub.m', 'matrix', 'name', 'nothing', 'tags'])
+        self.assertEqual(sorted(get_schema_branches(self.schema, empty_struct_as_branch=True)),
+                         ['_id.bsontype', '_id.oid', 'empty', 'items.n', 'items.sub.m', 'matrix', 'name', 'nothing',
+                          'tags'])
+        self.assertRaises(Exception, get_schema_branches, {"a": []}, False)
+
+    def test_schema_branches_order(self):
+        #branches are listed in order of keys of structs
+        branches = []
+        for key, value in self.schema["items"][0].iteritems():
+            branches.append("items." + key + (".m" if key == "sub" else ""))
+        self.assertEqual([branch for branch in get_schema_branches(self.schema, False) if branch.startswith("items.")],
+                         branches)
+
+    def test_intern_schema_types(self):
+        schema = intern_schema_types(json.loads('{"a": "INT", "b": [{"c": "INT"}], "d": "STRING"}'))
+        self.assertEqual(schema, {"a": "INT", "b": [{"c": "INT"}], "d": "STRING"})
+        self.assertIs(schema["a"], schema["b"][0]["c"])
+
+    def test_draft4_branches(self):
+        draft4 = json.loads('{"type": "object", "properties": {"a": {"type": "string"}, '
+                            '"b": {"type": "array", "items": {"type": "object", "properties": {"c": {"type": "integer"}}}}}}')
+        self.assertEqual(sorted(get_draft4_branches(draft4)), ['a.type', 'b.c.type', 'b.type', 'b.type', 'type'])
+
+    def test_struct_fields(self):
+        self.assertEqual(hive.get_struct_fields(self.schema["_id"]), [[key, "STRING" if key == "oid" else "INT"]
+                                                                       for key in self.schema["_id"]])
+        fields = hive.get_struct_fields({"a": {"b": {"c": "INT"}}, "d": ["INT"]})
+        self.assertEqual(fields, [[["a", "b", "c"], "INT"]])
+
+    def test_canonical_schema(self):
+        self.assertEqual(hive.get_canonical_hive_schema(self.schema),
+                         {"id": {"oid": "STRING", "bsontype": "INT"}, "name": "STRING", "tags": ["STRING"],
+                          "matrix": [["INT"]], "items": [{"n": "INT", "sub": [{"m": "DOUBLE"}]}]})
+
+    def test_deep_walks(self):
+        #deeper than recursion limit
+        schema = get_deep_schema(5000)
+        self.assertEqual(len(get_schema_branches(schema, False)), 5001)
+        self.assertEqual(len(hive.get_struct_fields(schema)), 5001)
+        canonical = hive.get_canonical_hive_schema(schema)
+        for i in xrange(5000):
+            canonical = canonical["a"]
+        self.assertEqual(canonical, {"leaf": "INT"})
+
+
+if __name__ == '__main__':
+    unittest.main()
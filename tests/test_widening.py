@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""Folding of records widens conflicting types the same way as merge of
+partial schemas, so schema of --workers ranges equals serial schema"""
+
+import random
+import datetime
+import unittest
+from bson.int64 import Int64
+from bson.objectid import ObjectId
+
+from schema_tree import merge_serialized_schemas
+from get_mongo_schema_as_json import RecordShapeCache, prepare_schema_for_serialization
+
+def get_value(rand, i):
+    return rand.choice([i, i * 1.5, Int64(i), u'v%d' % i, None, i % 2 == 0,
+                        datetime.datetime(2000, 1, 1)])
+
+def get_records(seed):
+    rand = random.Random(seed)
+    records = []
+    for i in xrange(300):
+        records.append({'_id': ObjectId(),
+                        'n': u's' if i % 10 == 0 else i,
+                        'v': get_value(rand, i),
+                        'sub': {'w': get_value(rand, i), 'when': datetime.datetime(2000, 1, 1)},
+                        'items': [{'q': get_value(rand, i)} for j in xrange(rand.randint(0, 3))]})
+    return records
+
+def fold(records, shape_cache_size=0):
+    shape_cache = RecordShapeCache(shape_cache_size)
+    schema = {}
+    for record in records:
+        schema = shape_cache.fold(record, schema)
+    return prepare_schema_for_serialization(schema)
+
+def fold_ranges(records, ranges_count, shape_cache_size=0):
+    """Schema of records split into ranges as by --workers"""
+    size = len(records) / ranges_count + 1
+    ranges = [records[i:i+size] for i in xrange(0, len(records), size)]
+    random.Random(ranges_count).shuffle(ranges)
+    merged = {}
+    for range_records in ranges:
+        merged = merge_serialized_schemas(merged, fold(range_records, shape_cache_size))
+    return merged
+
+class TestWidening(unittest.TestCase):
+
+    def test_widen_records(self):
+        records = [{'n': 1}, {'n': u's'}, {'n': 2}]
+        self.assertEqual(fold(records), {'n': 'STRING'})
+        records = [{'n': 1}, {'n': None}, {'n': 1.5}, {'n': Int64(2)}]
+        self.assertEqual(fold(records), {'n': 'DOUBLE'})
+        records = [{'n': True}, {'n': 1}]
+        self.assertEqual(fold(records), {'n': 'STRING'})
+        records = [{'n': {'a': 1}}, {'n': 1}]
+        self.assertEqual(fold(records), {'n': {'a': 'INT'}})
+
+    def test_ranges_equal_serial(self):
+        for seed in xrange(5):
+            records = get_records(seed)
+            serial = fold(records)
+            self.assertEqual(serial['n'], 'STRING')
+            self.assertEqual(fold(records, 1024), serial)
+            for ranges_count in [2, 3, 7]:
+                self.assertEqual(fold_ranges(records, ranges_count), serial)
+
+    def check_conflict(self, values, expected):
+        """Schema of field having conflicting values doesn't depend on
+        order of records and on split of them into ranges"""
+        for order in [values, list(reversed(values))]:
+            records = [{'a': value} for value in order]
+            for shape_cache_size in [0, 1024]:
+                self.assertEqual(fold(records, shape_cache_size), {'a': expected})
+                self.assertEqual(fold_ranges(records, len(records), shape_cache_size), {'a': expected})
+
+    def test_null_struct(self):
+        self.check_conflict([None, {'b': 1}], {'b': 'INT'})
+
+    def test_scalar_struct(self):
+        self.check_conflict([u's', {'b': 1}], {'b': 'INT'})
+        self.check_conflict([1, ObjectId()], {'oid': 'STRING', 'bsontype': 'INT'})
+
+    def test_array_struct(self):
+        self.check_conflict([[1], {'b': 1}], ['INT'])
+        self.check_conflict([{'b': 1}, [{'c': 1}], None], [{'c': 'INT'}])
+
+    def test_struct_array(self):
+        self.check_conflict([{'b': 1}, [1], {'b': u's'}], ['INT'])
+        self.check_conflict([[{'b': 1}], {'b': 1}, [{'c': True}]], [{'b': 'INT', 'c': 'BOOLEAN'}])
+
+    def test_empty_values(self):
+        self.check_conflict([[], 1.5], 'DOUBLE')
+        self.check_conflict([[{}], [1]], ['INT'])
+        self.check_conflict([[{}, 1], {'b': 1}], {'b': 'INT'})
+        self.check_conflict([{}, 1], {})
+
+    def test_random_conflicts(self):
+        rand = random.Random(0)
+        values = [None, 1, 1.5, u's', True, {}, [], {'b': 1}, {'c': u's'}, [1], [u's'], [{'b': 1.5}],
+                  [{}], [[1]], ObjectId(), {'oid': 1}]
+        for i in xrange(300):
+            records = [{'a': rand.choice(values), 'x': {'a': rand.choice(values)}} for j in xrange(4)]
+            serial = fold(records)
+            for ranges_count in [2, 4]:
+                self.assertEqual(fold_ranges(records, ranges_count), serial)
+
+    def test_shape_cache_hits(self):
+        records = [{'a': i, 'b': u'x', 'c': {'d': i * 0.5, 'e': [1, 2]}} for i in xrange(100)]
+        shape_cache = RecordShapeCache(1024)
+        schema = {}
+        for record in records:
+            schema = shape_cache.fold(record, schema)
+        self.assertTrue(shape_cache.hits > shape_cache.misses)
+        self.assertEqual(prepare_schema_for_serialization(schema), fold(records))
+
+    def test_shape_cache_lru(self):
+        shape_cache = RecordShapeCache(2)
+        #shapes are cached when they are folded without changes of schema
+        schema = shape_cache.fold({'a': 0, 'b': 0, 'c': 0}, {})
+        for record in [{'a': 1}, {'b': 1}, {'a': 2}, {'c': 1}, {'a': 3}]:
+            schema = shape_cache.fold(record, schema)
+        #shape of 'b' is evicted as least recently used, shape of 'a' is kept
+        self.assertEqual(len(shape_cache.fold_state.shapes), 2)
+        self.assertEqual(sorted([shape[2] for shape in shape_cache.fold_state.shapes]), [('a',), ('c',)])
+
+
+
+if __name__ == '__main__':
+    unittest.main()